@@ -0,0 +1,139 @@
+"""Load test of the threaded slip pipeline against the asyncio runtime, using fake upstreams.
+
+Every slip does a Telegram download, a Gemini call and a sheet write, each simulated
+with a sleep in a blocking function. Both runtimes get the same per-upstream
+concurrency, and the report shows wall time, throughput, threads added at peak and the
+traced memory high-water mark.
+
+    python benchmarks/bench_async_runtime.py --slips 500 --users 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.pipeline import AsyncSlipRuntime, StagedPipeline
+
+
+class Job:
+    def __init__(self, user_id, number):
+        self.user_id = user_id
+        self.number = number
+        self.image_bytes = None
+
+
+class Recorder:
+    def __init__(self, total):
+        self.total = total
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.count = 0
+        self.baseline_threads = threading.active_count()
+        self.peak_threads = self.baseline_threads
+        self.order = {}
+
+    def finish(self, jobs):
+        with self.lock:
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            for job in jobs:
+                self.order.setdefault(job.user_id, []).append(job.number)
+            self.count += len(jobs)
+            if self.count >= self.total:
+                self.done.set()
+
+
+def fake_download(job, latency):
+    time.sleep(latency)
+    job.image_bytes = b"\xff" * 200_000
+
+
+def fake_ocr(jobs, latency):
+    time.sleep(latency)
+    for job in jobs:
+        job.image_bytes = None
+    return True
+
+
+def run_threads(args, jobs, recorder):
+    def download_stage(items):
+        for job in items:
+            fake_download(job, args.download_ms / 1000)
+        return True
+
+    def ocr_stage(items):
+        return fake_ocr(items, args.ocr_ms / 1000)
+
+    def sheet_stage(items):
+        time.sleep(args.sheet_ms / 1000)
+        recorder.finish(items)
+
+    pipeline = StagedPipeline(
+        [("download", download_stage, args.telegram), ("ocr", ocr_stage, args.gemini), ("sheet", sheet_stage, args.sheets)],
+        queue_size=len(jobs)
+    )
+    pipeline.start()
+    for job in jobs:
+        pipeline.submit([job])
+    recorder.done.wait()
+
+
+def run_async(args, jobs, recorder):
+    runtime = None
+
+    async def prepare(items):
+        await asyncio.gather(*(runtime.call("telegram", fake_download, job, args.download_ms / 1000) for job in items))
+        return await runtime.call("gemini", fake_ocr, items, args.ocr_ms / 1000)
+
+    async def commit(items):
+        await runtime.call("sheets", time.sleep, args.sheet_ms / 1000)
+        recorder.finish(items)
+
+    runtime = AsyncSlipRuntime(
+        prepare, commit,
+        limits={"telegram": args.telegram, "gemini": args.gemini, "sheets": args.sheets, "gcs": 1},
+        max_in_flight=len(jobs)
+    )
+    runtime.start()
+    for job in jobs:
+        runtime.submit([job])
+    recorder.done.wait()
+    runtime.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slips", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--download-ms", type=float, default=150)
+    parser.add_argument("--ocr-ms", type=float, default=2000)
+    parser.add_argument("--sheet-ms", type=float, default=300)
+    parser.add_argument("--telegram", type=int, default=16, help="download concurrency")
+    parser.add_argument("--gemini", type=int, default=64, help="OCR concurrency")
+    parser.add_argument("--sheets", type=int, default=8, help="sheet write concurrency")
+    args = parser.parse_args()
+
+    print(f"{args.slips} slips from {args.users} users")
+    print(f"{'runtime':<8} {'wall s':>8} {'slips/s':>8} {'threads':>8} {'peak MB':>8} {'ordered':>8}")
+    for name, runner in (("threads", run_threads), ("async", run_async)):
+        jobs = [Job(number % args.users, number) for number in range(args.slips)]
+        recorder = Recorder(len(jobs))
+        tracemalloc.start()
+        start = time.perf_counter()
+        runner(args, jobs, recorder)
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        ordered = all(numbers == sorted(numbers) for numbers in recorder.order.values())
+        print(
+            f"{name:<8} {wall:8.2f} {args.slips / wall:8.1f} {recorder.peak_threads - recorder.baseline_threads:>8} "
+            f"{peak / 1024 / 1024:8.1f} {'yes' if ordered else 'no':>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Microbenchmark of per-call Gemini setup overhead in do_ocr, using a fake Gemini client.
+
+Compares the old path (configure + safety settings + new GenerativeModel on every
+call) with GeminiModelRegistry, where only generate_content is paid per call.
+
+    python benchmarks/bench_gemini_registry.py --calls 2000 --setup-ms 2
+"""
+import argparse
+import os
+import sys
+import time
+from statistics import mean
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.ocr import GeminiModelRegistry
+
+
+class FakeResponse:
+    text = "ID: 1\n##############\nID: 1"
+
+    def resolve(self):
+        pass
+
+
+class FakeGenai:
+    """Stand-in for google.generativeai with a configurable setup cost"""
+
+    def __init__(self, setup_ms):
+        self.setup_seconds = setup_ms / 1000
+        self.configure_calls = 0
+        self.model_builds = 0
+        fake = self
+
+        class GenerativeModel:
+            def __init__(self, model_name, generation_config, safety_settings):
+                fake.model_builds += 1
+                time.sleep(fake.setup_seconds)
+
+            def generate_content(self, prompt_parts):
+                return FakeResponse()
+
+        self.GenerativeModel = GenerativeModel
+
+    def configure(self, api_key):
+        self.configure_calls += 1
+        time.sleep(self.setup_seconds)
+
+
+def ocr_before(genai, image_bytes):
+    genai.configure(api_key="fake")
+    generation_config = dict(GeminiModelRegistry.GENERATION_CONFIG)
+    safety_settings = [dict(setting) for setting in GeminiModelRegistry.SAFETY_SETTINGS]
+    model = genai.GenerativeModel(
+        model_name=GeminiModelRegistry.MODEL_NAME,
+        generation_config=generation_config,
+        safety_settings=safety_settings
+    )
+    prompt_parts = [GeminiModelRegistry.PROMPT, {"mime_type": "image/jpeg", "data": image_bytes}]
+    response = model.generate_content(prompt_parts)
+    response.resolve()
+    return response.text
+
+
+def ocr_after(registry, image_bytes):
+    response = registry.model().generate_content(registry.prompt_parts(image_bytes))
+    response.resolve()
+    return response.text
+
+
+def run(label, func, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    print(f"{label:<8} mean {mean(samples) * 1e6:10.1f} us   p99 {samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6:10.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--setup-ms", type=float, default=1.0,
+                        help="simulated cost of genai.configure and of building a model")
+    args = parser.parse_args()
+
+    image_bytes = os.urandom(200_000)
+
+    before = FakeGenai(args.setup_ms)
+    run("before", lambda: ocr_before(before, image_bytes), args.calls)
+
+    after = FakeGenai(args.setup_ms)
+    registry = GeminiModelRegistry(after, "fake")
+    run("after", lambda: ocr_after(registry, image_bytes), args.calls)
+
+    print(f"configure calls: before {before.configure_calls}, after {after.configure_calls}")
+    print(f"model builds:    before {before.model_builds}, after {after.model_builds}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Offline load test of the whole bot against fake Telegram, Gemini, GCS and Sheets/Drive.
+
+The real TOCR() is built on top of fake_backends, its photo handler is fed N users x M
+slips through a dispatcher-sized thread pool, and every slip's trace is read back
+to report throughput, outcomes, p50/p95/p99 latency per stage and the memory
+high-water mark. Latencies are lognormal, NAME=MEAN_MS[:SIGMA], and error rates
+are per call. Bot settings come from the environment as usual, so a change can be
+compared by running the same command twice:
+
+    python benchmarks/bench_load.py --users 50 --slips 10
+    python benchmarks/bench_load.py --runtime async --latency gemini=3000:0.5 --errors gemini=0.05 sheets=0.02
+    SHEET_BATCH_ROWS=1 python benchmarks/bench_load.py --users 20 --slips 20
+    SPECULATIVE_PREP=0 python benchmarks/bench_load.py --latency gcs=300 sheets=400 drive=400
+
+The token scan stays on and runs once on the real APScheduler as the load starts,
+TOKEN_SCAN_DELAY delays it; the run fails if it never reports.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import fake_backends
+
+DEFAULT_LATENCIES = {"telegram": "80:0.3", "gemini": "2500:0.4", "gcs": "40:0.3", "sheets": "300:0.4", "drive": "250:0.4"}
+BUCKET = "andre_ocr_bot-bucket"
+
+
+def parse_pairs(pairs, convert):
+    values = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        if name not in fake_backends.Backends.NAMES:
+            sys.exit(f"Unknown backend {name!r}, expected one of {', '.join(fake_backends.Backends.NAMES)}")
+        values[name] = convert(value)
+    return values
+
+
+def parse_latency(value):
+    mean_ms, _, sigma = value.partition(":")
+    return float(mean_ms), float(sigma or 0)
+
+
+def load_responses(corpus):
+    """Corpus responses per output mode, parse failures left out so errors come only from the fakes"""
+    responses = {"json": [], "text": []}
+    for path in sorted(corpus.iterdir()):
+        if path.suffix == ".json":
+            responses["json"].append(path.read_text(encoding="utf-8"))
+        elif path.suffix == ".txt":
+            responses["text"].append(path.read_text(encoding="utf-8"))
+    return responses
+
+
+class ScanReports(logging.Handler):
+    """Collects the token scanner's report lines"""
+
+    def __init__(self):
+        super().__init__()
+        self.reports = []
+
+    def emit(self, record):
+        if record.getMessage().startswith("Token scan:"):
+            self.reports.append(record.getMessage())
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--slips", type=int, default=5, help="slips per user")
+    parser.add_argument("--interval-ms", type=float, default=0, help="gap between each round of one slip per user")
+    parser.add_argument("--runtime", choices=["threads", "async"], default=os.environ.get("BOT_RUNTIME", "threads"))
+    parser.add_argument("--output-mode", choices=["json", "text"], default=os.environ.get("OCR_OUTPUT_MODE", "json"))
+    parser.add_argument("--latency", nargs="*", default=[], metavar="NAME=MEAN_MS[:SIGMA]")
+    parser.add_argument("--errors", nargs="*", default=[], metavar="NAME=RATE")
+    parser.add_argument("--image-kb", type=int, default=200, help="image size when Pillow is not installed")
+    parser.add_argument("--corpus", type=Path, default=HERE / "corpus")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--keep-traces", type=Path, metavar="PATH", help="copy the run's trace file here")
+    args = parser.parse_args()
+
+    latencies = {name: parse_latency(value) for name, value in DEFAULT_LATENCIES.items()}
+    latencies.update(parse_pairs(args.latency, parse_latency))
+    error_rates = parse_pairs(args.errors, float)
+    backends = fake_backends.install(latencies, error_rates, load_responses(args.corpus), args.image_kb)
+
+    # The bot writes its log, caches and traces to the working directory
+    keep_traces = args.keep_traces.resolve() if args.keep_traces else None
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    os.environ.update({
+        "BOT_MODE": "polling", "BOT_RUNTIME": args.runtime, "OCR_OUTPUT_MODE": args.output_mode,
+        "METRICS_ENABLED": "0", "TRACE_PATH": os.path.join(workdir, "traces.jsonl"), "TRACE_SAMPLE_RATE": "1",
+        # Fake file paths can't be fetched over HTTP, so the async runtime downloads through its executor
+        "ASYNC_HTTP_FETCH": "0",
+        "TOKEN_SCAN_ENABLED": "1",
+    })
+    os.environ.setdefault("TOKEN_SCAN_DELAY", "0")
+    scan_reports = ScanReports()
+    logging.getLogger("bet_ocr.tokens").addHandler(scan_reports)
+    logging.getLogger("bet_ocr.tokens").setLevel(logging.INFO)
+
+    tracemalloc.start()
+    # Imported only now, so the bot binds to the fake SDK modules
+    from TOCRSB import TOCR
+    from bet_ocr.extraction import parse_ocr_output
+    from bet_ocr.telemetry import tracer
+
+    valid = {mode: [] for mode in backends.responses}
+    for mode, texts in backends.responses.items():
+        for text in texts:
+            try:
+                parse_ocr_output(text)
+                valid[mode].append(text)
+            except ValueError:
+                pass
+    backends.responses = valid
+    if not valid[args.output_mode]:
+        sys.exit(f"No usable {args.output_mode} responses in {args.corpus}")
+
+    backends.seed_blob(BUCKET, "config.txt", "telegram_bot_token=fake\ngoogle_gemini_api_key=fake\n")
+    for user_id in range(1, args.users + 1):
+        backends.seed_blob(BUCKET, f"bot_user_tokens/{user_id}/token.json", "{}")
+
+    main_bot = TOCR()
+    logging.getLogger().setLevel(logging.WARNING)
+    updater, bot_thread = fake_backends.start_bot(main_bot)
+    image_handler = updater.dispatcher.handler("MessageHandler")
+    context = type("Context", (), {"bot": updater.bot})()
+
+    total = args.users * args.slips
+    print(
+        f"{total} slips from {args.users} users, runtime {args.runtime}, output {args.output_mode}, "
+        f"latency {', '.join(f'{name}={mean:g}:{sigma:g}' for name, (mean, sigma) in latencies.items())}"
+    )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=updater.workers, thread_name_prefix="dispatcher") as dispatcher:
+        for slip in range(args.slips):
+            for user_id in range(1, args.users + 1):
+                update = fake_backends.photo_update(user_id, f"u{user_id}-s{slip}")
+                dispatcher.submit(image_handler, update, context)
+            if args.interval_ms:
+                time.sleep(args.interval_ms / 1000)
+
+        deadline = time.monotonic() + args.timeout
+        while tracer.exported < total and time.monotonic() < deadline:
+            time.sleep(0.05)
+    wall = time.perf_counter() - start
+    while not scan_reports.reports and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    updater.stop()
+    bot_thread.join(timeout=60)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    trace_path = Path(os.environ["TRACE_PATH"])
+    traces = [json.loads(line) for line in trace_path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if keep_traces:
+        shutil.copyfile(trace_path, keep_traces)
+
+    outcomes = {}
+    durations = {}
+    for trace in traces:
+        outcomes[trace["status"]] = outcomes.get(trace["status"], 0) + 1
+        for span in trace["spans"]:
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+
+    print(f"finished {len(traces)}/{total} in {wall:.2f} s, {len(traces) / wall:.1f} slips/s, outcomes {outcomes}")
+    print(
+        f"peak traced memory {peak / 1024 / 1024:.1f} MB, "
+        f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB"
+    )
+    print(f"\n{'span':<24} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(durations.items(), key=lambda item: -max(item[1])):
+        values.sort()
+        print(
+            f"{name:<24} {len(values):>6} {percentile(values, 0.5):9.1f} "
+            f"{percentile(values, 0.95):9.1f} {percentile(values, 0.99):9.1f}"
+        )
+    print(f"\n{'upstream':<10} {'calls':>7} {'errors':>7}")
+    for name, stats in backends.stats().items():
+        print(f"{name:<10} {stats['calls']:>7} {stats['errors']:>7}")
+
+    if not scan_reports.reports:
+        sys.exit("\nFAIL: the token scan never ran")
+    print(f"\n{scan_reports.reports[0]}")
+
+
+if __name__ == "__main__":
+    main()
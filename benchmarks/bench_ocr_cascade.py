@@ -0,0 +1,164 @@
+"""Run the OCR cascade over a corpus of slips with fake Tesseract and Gemini, against Gemini alone.
+
+Each slip in the corpus folder is a pair: <name>.txt is what Tesseract reads off
+the screenshot, with a "# confidence: N" first line, and <name>.json is the slip
+as Gemini returns it, which is also taken as the truth. templates.json holds the
+bookmaker layouts the local backend knows. Every slip is sent --rounds times
+from --workers threads through OCRCascade([tesseract, gemini]) and then through
+OCRCascade([gemini]), and the per-backend hit rate and latency, the Gemini calls
+saved and the per-slip latency of both are reported.
+
+Exits non-zero if a slip the local backend accepted differs from the truth, or
+if a slip's outcome differs from what its name promises: *_single, *_double and
+*_accumulator must be read locally, everything else must escalate:
+
+    python benchmarks/bench_ocr_cascade.py
+    python benchmarks/bench_ocr_cascade.py --rounds 10 --latency tesseract=400:0.3 gemini=3000:0.5
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from statistics import mean
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+import fake_backends
+from bench_load import parse_latency
+from bet_ocr.backends import OCRBackend, OCRCascade, SlipTemplate, TesseractBackend
+from bet_ocr.extraction import parse_ocr_output
+
+DEFAULT_LATENCIES = {"tesseract": "250:0.2", "gemini": "2500:0.4"}
+LOCAL_SUFFIXES = ("_single", "_double", "_accumulator")
+
+
+class CorpusGemini(OCRBackend):
+    """Gemini that answers with the corpus truth for each image"""
+
+    name = "gemini"
+
+    def __init__(self, truths, mean_ms, sigma):
+        self.truths = truths
+        self.upstream = fake_backends.Upstream("gemini", mean_ms, sigma)
+        self.served = set()
+
+    def read(self, image_bytes, mime_type, user_id=None):
+        self.upstream.call()
+        self.served.add(image_bytes)
+        return self.truths[image_bytes]
+
+
+def load_corpus(corpus):
+    """[(name, ocr text, confidence, truth json)] for every .txt with a matching .json"""
+    slips = []
+    for path in sorted(corpus.glob("*.txt")):
+        header, _, text = path.read_text(encoding="utf-8").partition("\n")
+        if not header.startswith("# confidence:"):
+            sys.exit(f"{path.name} should start with '# confidence: N'")
+        truth = path.with_suffix(".json").read_text(encoding="utf-8").strip()
+        slips.append((path.stem, text, float(header.partition(":")[2]), truth))
+    return slips
+
+
+def run(cascade, images, rounds, workers):
+    """Seconds per slip across rounds, reading each image from the worker threads in shuffled order"""
+    order = [image for _ in range(rounds) for image in images]
+    random.shuffle(order)
+    results = {}
+    lock = threading.Lock()
+
+    def read(image):
+        start = time.perf_counter()
+        text = cascade.read(image, "image/jpeg")
+        elapsed = time.perf_counter() - start
+        with lock:
+            results.setdefault(image, []).append((text, elapsed))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(read, order))
+    return results
+
+
+def rows(text):
+    return parse_ocr_output(text).to_row()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=HERE / "corpus" / "tesseract")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--min-confidence", type=float, default=70)
+    parser.add_argument("--latency", nargs="*", default=[], metavar="NAME=MEAN_MS[:SIGMA]",
+                        help="tesseract and gemini latencies, lognormal")
+    args = parser.parse_args()
+
+    if fake_backends.Image is None:
+        sys.exit("Pillow is needed, the Tesseract backend reads images through it")
+    logging.basicConfig(level=logging.WARNING)
+    latencies = dict(DEFAULT_LATENCIES, **dict(pair.partition("=")[::2] for pair in args.latency))
+    latencies = {name: parse_latency(value) for name, value in latencies.items()}
+
+    slips = load_corpus(args.corpus)
+    tesseract = fake_backends.FakeTesseract(*latencies["tesseract"])
+    names, truths = {}, {}
+    for name, text, confidence, truth in slips:
+        image = fake_backends.slip_image(name, 200)
+        tesseract.register(image, text, confidence)
+        names[image] = name
+        truths[image] = truth
+    images = list(names)
+
+    local = TesseractBackend(
+        SlipTemplate.load_all(args.corpus / "templates.json"), pytesseract=tesseract,
+        min_confidence=args.min_confidence, workers=args.workers
+    )
+    gemini = CorpusGemini(truths, *latencies["gemini"])
+    cascade = OCRCascade([local, gemini])
+    baseline = OCRCascade([CorpusGemini(truths, *latencies["gemini"])])
+
+    print(f"{len(slips)} corpus slips x {args.rounds} rounds from {args.workers} threads")
+    cascade_results = run(cascade, images, args.rounds, args.workers)
+    baseline_results = run(baseline, images, args.rounds, args.workers)
+
+    failures = []
+    print(f"\n{'slip':<20} {'read by':>10} {'ms':>8}")
+    for image in images:
+        name = names[image]
+        read_by = "gemini" if image in gemini.served else "tesseract"
+        # A local read is a fresh JSON dump, so compare parsed rows rather than the texts
+        if read_by == "tesseract" and any(rows(text) != rows(truths[image]) for text, _ in cascade_results[image]):
+            failures.append(f"{name}: local read differs from the truth")
+        should_be_local = name.endswith(LOCAL_SUFFIXES)
+        if (read_by == "tesseract") != should_be_local:
+            failures.append(f"{name}: read by {read_by}, expected {'tesseract' if should_be_local else 'gemini'}")
+        print(f"{name:<20} {read_by:>10} {mean(elapsed for _, elapsed in cascade_results[image]) * 1000:8.1f}")
+
+    print(f"\n{'backend':<10} {'slips':>6} {'accepted':>9} {'rejected':>9} {'declined':>9} {'hit rate':>9} {'mean ms':>8}")
+    for backend, stat in cascade.stats().items():
+        print(f"{backend:<10} {stat['images']:6d} {stat['accepted']:9d} {stat['rejected']:9d} {stat['declined']:9d} "
+              f"{stat['hit_rate']:9.0%} {stat['mean_seconds'] * 1000:8.1f}")
+
+    gemini_calls = cascade.stats()["gemini"]["images"]
+    baseline_calls = baseline.stats()["gemini"]["images"]
+    cascade_mean = mean(elapsed for reads in cascade_results.values() for _, elapsed in reads)
+    baseline_mean = mean(elapsed for reads in baseline_results.values() for _, elapsed in reads)
+    print(f"\nGemini calls: {gemini_calls} with the cascade, {baseline_calls} with Gemini alone "
+          f"({1 - gemini_calls / baseline_calls:.0%} saved)")
+    print(f"Mean per slip: {cascade_mean * 1000:.0f} ms with the cascade, {baseline_mean * 1000:.0f} ms with Gemini alone")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: every local read matches the truth and every other slip escalated to Gemini")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare the text and JSON OCR output modes on parse failures and latency.
+
+Without --ocr it replays stored responses from the corpus folder: *.txt files go
+through the text parser and *.json files through the schema-validated JSON parser.
+With --ocr it sends every image in a samples folder to Gemini once per mode and
+times the whole path from request to parsed row.
+
+A slip counts as a parse failure when validation rejects it or when any of the
+core columns comes back "NA".
+
+    python benchmarks/bench_output_modes.py --corpus benchmarks/corpus
+    GOOGLE_API_KEY=... python benchmarks/bench_output_modes.py --ocr samples/
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from statistics import mean, median
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.extraction import SlipValidationError, parse_bet_slip, parse_slip_json
+from bet_ocr.ocr import GeminiModelRegistry, detect_mime_type
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+CORE_KEYS = ["Home Team", "Away Team", "Staked Amount", "Bet Option Staked", "Legs Odds", "Bet Status"]
+PARSERS = {"text": parse_bet_slip, "json": parse_slip_json}
+
+
+def info_text(all_text):
+    return all_text.split("##############\n")[1] if "##############\n" in all_text else all_text
+
+
+def parse(mode, text):
+    """Return (slip, failure reason or None)"""
+    try:
+        slip = PARSERS[mode](info_text(text) if mode == "text" else text)
+    except SlipValidationError as e:
+        return None, str(e)
+    missing = [key for key in CORE_KEYS if slip.values[key] == "NA"]
+    return slip, f"NA in {', '.join(missing)}" if missing else None
+
+
+def replay(corpus, rounds):
+    print(f"{'mode':<6} {'slips':>6} {'failures':>9} {'parse us':>9}")
+    for mode, suffix in (("text", ".txt"), ("json", ".json")):
+        paths = sorted(corpus.glob(f"*{suffix}"))
+        if not paths:
+            continue
+        texts = [path.read_text(encoding="utf-8") for path in paths]
+        failures = 0
+        for path, text in zip(paths, texts):
+            _, reason = parse(mode, text)
+            if reason:
+                failures += 1
+                print(f"  {path.name}: {reason}")
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                parse(mode, text)
+        per_slip = (time.perf_counter() - start) / (rounds * len(texts))
+        print(f"{mode:<6} {len(texts):>6} {failures:>9} {per_slip * 1e6:9.2f}")
+
+
+def live(samples, modes):
+    import google.generativeai as genai
+
+    images = sorted(path for path in samples.iterdir() if path.suffix.lower() in IMAGE_SUFFIXES)
+    if not images:
+        sys.exit(f"No images found in {samples}")
+
+    print(f"{len(images)} images")
+    print(f"{'mode':<6} {'failures':>9} {'e2e s p50':>10} {'e2e s mean':>11} {'parse ms':>9}")
+    for mode in modes:
+        registry = GeminiModelRegistry(genai, os.environ["GOOGLE_API_KEY"], per_thread=False, output_mode=mode)
+        latencies, parse_times, failures = [], [], 0
+        for path in images:
+            image_bytes = path.read_bytes()
+            start = time.perf_counter()
+            response = registry.model().generate_content(registry.prompt_parts(image_bytes, detect_mime_type(image_bytes)))
+            response.resolve()
+            parse_start = time.perf_counter()
+            _, reason = parse(mode, response.text)
+            latencies.append(time.perf_counter() - start)
+            parse_times.append(time.perf_counter() - parse_start)
+            if reason:
+                failures += 1
+                print(f"  {mode} {path.name}: {reason}")
+        print(
+            f"{mode:<6} {failures:>9} {median(latencies):10.2f} {mean(latencies):11.2f} "
+            f"{mean(parse_times) * 1000:9.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=Path(__file__).parent / "corpus")
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--ocr", type=Path, metavar="SAMPLES", help="folder of slip images to send to Gemini")
+    parser.add_argument("--modes", nargs="+", choices=sorted(PARSERS), default=["text", "json"])
+    args = parser.parse_args()
+
+    if args.ocr:
+        live(args.ocr, args.modes)
+    else:
+        replay(args.corpus, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
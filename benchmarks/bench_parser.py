@@ -0,0 +1,89 @@
+"""Benchmark OCR text parsing over a corpus of stored Gemini outputs.
+
+Compares the old per-field regex scan of do_values_extraction (13 patterns, two
+re.search calls each) with the precompiled single-pass parse_bet_slip, and checks
+that both produce the same sheet row.
+
+    python benchmarks/bench_parser.py --corpus benchmarks/corpus --rounds 2000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.extraction import ROW_KEYS, parse_bet_slip
+
+
+def legacy_extraction(text_from_ocr):
+    regex_patterns = {
+        "ID": r"ID: (.+)",
+        "Date": r"Date: (.+)",
+        "Time": r"Time: (.+)",
+        "Country": r"Country: (.+)",
+        "Match League": r"Match League: (.+)",
+        "Home Team": r"Home Team: (.+)",
+        "Away Team": r"Away Team: (.+)",
+        "Staked Amount": r"Staked Amount: (.+)",
+        "Potential Winning": r"Potential Winning: (.+)",
+        "Bet Option Staked": r"Bet Option Staked: (.+)",
+        "Legs Odds": r"Odds of Bet Option Staked: (.+)",
+        "Total Odds": r"Total Odds: (.+)",
+        "Bet Status": r"Bet Status: (.+)"
+    }
+    extracted_values = {
+        key: re.search(pattern, text_from_ocr).group(1) if re.search(pattern, text_from_ocr) else "NA"
+        for key, pattern in regex_patterns.items()
+    }
+    if extracted_values["ID"] == "NA":
+        extracted_values["ID"] = "generated"
+    if extracted_values["Total Odds"] == "NA":
+        if extracted_values["Legs Odds"] != "NA":
+            if ";" not in extracted_values["Legs Odds"]:
+                extracted_values["Total Odds"] = extracted_values["Legs Odds"]
+    return extracted_values
+
+
+def info_text(all_text):
+    return all_text.split("##############\n")[1] if "##############\n" in all_text else all_text
+
+
+def time_per_slip(func, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            func(text)
+    return (time.perf_counter() - start) / (rounds * len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, default=Path(__file__).parent / "corpus")
+    parser.add_argument("--rounds", type=int, default=1000)
+    args = parser.parse_args()
+
+    paths = sorted(args.corpus.glob("*.txt"))
+    texts = [info_text(path.read_text(encoding="utf-8")) for path in paths]
+
+    mismatches = 0
+    for path, text in zip(paths, texts):
+        legacy = legacy_extraction(text)
+        slip = parse_bet_slip(text)
+        legacy_row = [legacy[key] for key in ROW_KEYS[1:]]
+        if legacy_row != slip.to_row()[1:] or (legacy["ID"] == "generated") != (slip.bet_id not in text):
+            mismatches += 1
+            print(f"row mismatch in {path.name}")
+        print(f"{path.name:<28} legs {len(slip.legs)}  stake {slip.stake}  total odds {slip.total_odds}")
+
+    legacy_time = time_per_slip(legacy_extraction, texts, args.rounds)
+    parser_time = time_per_slip(parse_bet_slip, texts, args.rounds)
+    print(f"\n{len(texts)} slips, {mismatches} row mismatches")
+    print(f"legacy regex scan  {legacy_time * 1e6:8.2f} us per slip")
+    print(f"single-pass parser {parser_time * 1e6:8.2f} us per slip (amounts and legs parsed on first use)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark image preprocessing over a folder of sample slips.
+
+For every max dimension it reports preprocessing time and payload size, and with
+--ocr it also calls Gemini and scores field accuracy against ground truth. Ground
+truth for `slip1.png` is `slip1.txt` in the same folder, written in the same
+"Field: value" layout the OCR prompt asks for. A size of 0 sends the original image.
+
+    python benchmarks/bench_preprocessing.py samples/ --sizes 0 800 1200 1600
+    GOOGLE_API_KEY=... python benchmarks/bench_preprocessing.py samples/ --ocr
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from statistics import mean, median
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.ocr import GeminiModelRegistry, ImagePreprocessor, detect_mime_type
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+FIELD_PATTERN = re.compile(r"^([A-Za-z ]+): (.+)$", re.MULTILINE)
+
+
+def parse_fields(text):
+    if "##############\n" in text:
+        text = text.split("##############\n")[1]
+    return {key.strip(): value.strip().lower() for key, value in FIELD_PATTERN.findall(text)}
+
+
+def field_accuracy(expected_text, ocr_text):
+    expected = parse_fields(expected_text)
+    if not expected:
+        return None
+    actual = parse_fields(ocr_text)
+    return sum(actual.get(key) == value for key, value in expected.items()) / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("samples", type=Path, help="folder of slip images with optional .txt ground truth")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 800, 1200, 1600, 2400])
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--no-grayscale", action="store_true")
+    parser.add_argument("--no-crop", action="store_true")
+    parser.add_argument("--ocr", action="store_true", help="call Gemini and score field accuracy")
+    args = parser.parse_args()
+
+    images = sorted(path for path in args.samples.iterdir() if path.suffix.lower() in IMAGE_SUFFIXES)
+    if not images:
+        sys.exit(f"No images found in {args.samples}")
+
+    registry = None
+    if args.ocr:
+        import google.generativeai as genai
+        registry = GeminiModelRegistry(genai, os.environ["GOOGLE_API_KEY"])
+
+    print(f"{len(images)} images")
+    print(f"{'size':>6} {'prep ms':>9} {'bytes in':>10} {'bytes out':>10} {'ocr s p50':>10} {'accuracy':>9}")
+    for size in args.sizes:
+        preprocessor = ImagePreprocessor(
+            max_dimension=size,
+            grayscale=not args.no_grayscale,
+            crop_margins=not args.no_crop,
+            jpeg_quality=args.quality
+        )
+        prep_times, bytes_in, bytes_out, ocr_times, accuracies = [], [], [], [], []
+        for path in images:
+            original = path.read_bytes()
+            start = time.perf_counter()
+            if size:
+                payload, mime_type = preprocessor.process(original)
+            else:
+                payload, mime_type = original, detect_mime_type(original)
+            prep_times.append(time.perf_counter() - start)
+            bytes_in.append(len(original))
+            bytes_out.append(len(payload))
+
+            if registry is not None:
+                start = time.perf_counter()
+                response = registry.model().generate_content(registry.prompt_parts(payload, mime_type))
+                response.resolve()
+                ocr_times.append(time.perf_counter() - start)
+                truth = path.with_suffix(".txt")
+                if truth.exists():
+                    accuracy = field_accuracy(truth.read_text(), response.text)
+                    if accuracy is not None:
+                        accuracies.append(accuracy)
+
+        ocr_column = f"{median(ocr_times):10.2f}" if ocr_times else f"{'-':>10}"
+        accuracy_column = f"{mean(accuracies):9.1%}" if accuracies else f"{'-':>9}"
+        print(
+            f"{size or 'orig':>6} {mean(prep_times) * 1000:9.1f} {int(mean(bytes_in)):>10} "
+            f"{int(mean(bytes_out)):>10} {ocr_column} {accuracy_column}"
+        )
+
+
+if __name__ == "__main__":
+    main()
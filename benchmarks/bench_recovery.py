@@ -0,0 +1,188 @@
+"""Kill the bot mid-stage against fake backends and check that a restart resumes every slip.
+
+The first bot process gets N slips, with slow sheet writes so they pile up after
+OCR, and is SIGKILLed as soon as the job journal shows --kill-count slips at or
+past --kill-at. A second process starts on the same working directory. It must
+finish every slip the journal left open, and may only call Gemini for the slips
+that had not reached ocr_done when the first one died:
+
+    python benchmarks/bench_recovery.py --slips 20 --kill-at ocr_done
+    python benchmarks/bench_recovery.py --runtime async --kill-at downloaded --kill-count 3
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+# Journal states a slip can be killed in; written only lasts until the reply is edited
+STATES = ("received", "downloaded", "ocr_done", "written")
+KILL_STATES = STATES[:3]
+
+
+def run_bot(workdir, send, users, latency, runtime, timeout):
+    """Child process: run the bot in workdir, send slips, wait for them and print a JSON report"""
+    import logging
+
+    import fake_backends
+    from bench_load import load_responses, parse_latency
+
+    latencies = {name: parse_latency(value) for name, value in latency.items()}
+    backends = fake_backends.install(latencies, {}, load_responses(HERE / "corpus"), 50)
+    os.chdir(workdir)
+    os.environ.update({
+        "BOT_MODE": "polling", "BOT_RUNTIME": runtime, "OCR_OUTPUT_MODE": "json", "METRICS_ENABLED": "0",
+        "TELEGRAM_BOT_TOKEN": "fake", "GOOGLE_GEMINI_API_KEY": "fake", "ASYNC_HTTP_FETCH": "0",
+        "TRACE_PATH": os.path.join(workdir, f"traces-{os.getpid()}.jsonl"), "TRACE_SAMPLE_RATE": "1",
+        "SHEET_BATCH_MS": "100",
+    })
+
+    from bet_ocr.extraction import parse_ocr_output
+    from bet_ocr.journal import JobJournal
+    from bet_ocr.telemetry import tracer
+    from TOCRSB import TOCR
+
+    backends.responses["json"] = [text for text in backends.responses["json"] if _parses(parse_ocr_output, text)]
+    for user_id in range(1, users + 1):
+        backends.seed_blob("andre_ocr_bot-bucket", f"bot_user_tokens/{user_id}/token.json", "{}")
+    expected = send or len(JobJournal("jobs.db").pending())
+
+    main_bot = TOCR()
+    logging.getLogger().setLevel(logging.WARNING)
+    updater, _ = fake_backends.start_bot(main_bot)
+    image_handler = updater.dispatcher.handler("MessageHandler")
+    context = type("Context", (), {"bot": updater.bot})()
+    for slip in range(send):
+        user_id = slip % users + 1
+        image_handler(fake_backends.photo_update(user_id, f"u{user_id}-s{slip}-{os.getpid()}"), context)
+
+    deadline = time.monotonic() + timeout
+    while tracer.exported < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    outcomes = {}
+    for line in Path(os.environ["TRACE_PATH"]).read_text(encoding="utf-8").splitlines():
+        status = json.loads(line)["status"]
+        outcomes[status] = outcomes.get(status, 0) + 1
+    print(json.dumps({
+        "expected": expected, "exported": tracer.exported, "outcomes": outcomes,
+        "gemini_calls": backends.stats()["gemini"]["calls"]
+    }), flush=True)
+    # Daemon pipeline threads don't need a clean shutdown
+    os._exit(0)
+
+
+def _parses(parse, text):
+    try:
+        parse(text)
+        return True
+    except ValueError:
+        return False
+
+
+def journal_states(path):
+    """state -> count of the journal's entries, read straight from the WAL database"""
+    import sqlite3
+
+    if not path.exists():
+        return {}
+    db = sqlite3.connect(str(path))
+    try:
+        return dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        db.close()
+
+
+def child_command(args, workdir, send, latency):
+    command = [
+        sys.executable, __file__, "--child", workdir, "--send", str(send), "--users", str(args.users),
+        "--runtime", args.runtime, "--timeout", str(args.timeout),
+    ]
+    if latency:
+        command += ["--latency", *latency]
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slips", type=int, default=20)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--runtime", choices=["threads", "async"], default="threads")
+    parser.add_argument("--kill-at", choices=KILL_STATES, default="ocr_done", help="stage the slips must have reached")
+    parser.add_argument("--kill-count", type=int, default=5, help="slips at or past --kill-at before the kill")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="NAME=MEAN_MS[:SIGMA]",
+                        help="fake latencies for the first run, sheets defaults to 5000 so slips stall before the write")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--child", metavar="WORKDIR", help=argparse.SUPPRESS)
+    parser.add_argument("--send", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        latency = dict(pair.partition("=")[::2] for pair in args.latency)
+        run_bot(args.child, args.send, args.users, latency, args.runtime, args.timeout)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_recovery_")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    journal_path = Path(workdir) / "jobs.db"
+    first_latency = ["gemini=300:0.3", "sheets=5000", *args.latency]
+
+    print(f"first run: {args.slips} slips, killed once {args.kill_count} reach {args.kill_at}")
+    first_log = open(Path(workdir) / "first_run.log", "w+")
+    first = subprocess.Popen(child_command(args, workdir, args.slips, first_latency),
+                             stdout=subprocess.DEVNULL, stderr=first_log, text=True)
+    reached = STATES[STATES.index(args.kill_at):]
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline and first.poll() is None:
+        states = journal_states(journal_path)
+        if sum(states.get(state, 0) for state in reached) >= args.kill_count:
+            break
+        time.sleep(0.01)
+    if first.poll() is not None:
+        first_log.seek(0)
+        sys.exit(f"First run exited before the kill:\n{first_log.read()}")
+    first.send_signal(signal.SIGKILL)
+    first.wait()
+
+    states = journal_states(journal_path)
+    unfinished = sum(count for state, count in states.items() if state != "finished")
+    past_ocr = states.get("ocr_done", 0) + states.get("written", 0)
+    print(f"journal at kill: {states}")
+
+    second = subprocess.run(child_command(args, workdir, 0, []), capture_output=True, text=True)
+    if second.returncode != 0 or not second.stdout.strip():
+        sys.exit(f"Restart failed:\n{second.stderr}")
+    report = json.loads(second.stdout.strip().splitlines()[-1])
+    after = journal_states(journal_path)
+    print(f"restart: {report['exported']}/{report['expected']} replayed slips finished {report['outcomes']}, "
+          f"{report['gemini_calls']} Gemini calls, journal now {after}")
+
+    failures = []
+    if report["expected"] != unfinished or report["exported"] < unfinished:
+        failures.append(f"{unfinished} slips were unfinished, {report['exported']} finished after the restart")
+    if any(state != "finished" for state in after):
+        failures.append("the journal still has unfinished slips")
+    if report["gemini_calls"] > unfinished - past_ocr:
+        failures.append(
+            f"Gemini was called {report['gemini_calls']} times for {unfinished - past_ocr} slips without OCR results"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: {past_ocr} slips resumed after OCR, {unfinished - past_ocr} re-read")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
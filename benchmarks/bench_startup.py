@@ -0,0 +1,149 @@
+"""Measure the bot's cold start, from a fresh interpreter to answering /start.
+
+A child interpreter first times `import TOCRSB` against whatever SDKs are installed
+and lists the heavy ones the import pulled in, which should be none. The bot is
+then built and started against fake_backends, so the remaining phases time our own
+startup work plus the configured fake latencies, and /start is sent as the first
+update. Exits non-zero when the total is over --budget, so a replica that would
+miss its readiness deadline fails here first:
+
+    python benchmarks/bench_startup.py --budget 5
+    python benchmarks/bench_startup.py --latency gcs=200 telegram=150 --repeat 5
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from statistics import median
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+# Modules that must not load before the bot is built
+HEAVY_PREFIXES = (
+    "google.generativeai", "google.cloud", "google.api_core", "google.auth", "google.oauth2",
+    "google_auth_oauthlib", "googleapiclient", "grpc", "telegram", "aiohttp", "requests",
+)
+IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import TOCRSB\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))\n"
+)
+BUCKET = "andre_ocr_bot-bucket"
+
+
+def measure_import():
+    """Seconds to import TOCRSB in a fresh interpreter and the heavy modules it loaded"""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=HERE.parent, capture_output=True, text=True, check=True
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    heavy = sorted({name.split(".")[0] if not name.startswith("google.") else ".".join(name.split(".")[:2])
+                    for name in probe["modules"] if name.startswith(HEAVY_PREFIXES)})
+    return probe["seconds"], heavy
+
+
+def parse_latency(pairs):
+    import fake_backends
+    latencies = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        if name not in fake_backends.Backends.NAMES:
+            sys.exit(f"Unknown backend {name!r}, expected one of {', '.join(fake_backends.Backends.NAMES)}")
+        mean_ms, _, sigma = value.partition(":")
+        latencies[name] = (float(mean_ms), float(sigma or 0))
+    return latencies
+
+
+def measure_start(latencies, remote_config, timeout):
+    """Phase timings of one in-process start against the fakes, in seconds"""
+    import fake_backends
+    backends = fake_backends.install(latencies)
+    if remote_config:
+        backends.seed_blob(BUCKET, "config.txt", "telegram_bot_token=fake\ngoogle_gemini_api_key=fake\n")
+    else:
+        os.environ.update({"TELEGRAM_BOT_TOKEN": "fake", "GOOGLE_GEMINI_API_KEY": "fake"})
+
+    phases = {}
+    start = time.perf_counter()
+    from TOCRSB import TOCR
+    phases["import"] = time.perf_counter() - start
+    main_bot = TOCR()
+    phases["build"] = time.perf_counter() - start - phases["import"]
+
+    updater, _ = fake_backends.start_bot(main_bot, timeout)
+    phases["ready"] = time.perf_counter() - start - phases["import"] - phases["build"]
+
+    before_start = time.perf_counter()
+    update = types.SimpleNamespace(message=fake_backends.FakeMessage(1), effective_user=types.SimpleNamespace(id=1))
+    updater.dispatcher.command("start")(update, types.SimpleNamespace(bot=updater.bot))
+    phases["first_reply"] = time.perf_counter() - before_start
+    phases["total"] = time.perf_counter() - start
+    updater.stop()
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("STARTUP_BUDGET_SECONDS", 5)))
+    parser.add_argument("--latency", nargs="*", default=[], metavar="NAME=MEAN_MS[:SIGMA]")
+    parser.add_argument("--remote-config", action="store_true", help="read config.txt from the fake bucket instead of env")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters to run, the median is reported")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds a start may take before the run fails")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        workdir = tempfile.mkdtemp(prefix="bench_startup_")
+        atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+        latencies = parse_latency(args.latency)
+        os.chdir(workdir)
+        os.environ.update({"BOT_MODE": "polling", "METRICS_ENABLED": "0", "TRACE_PATH": "", "CONFIG_PATH": "config.txt"})
+        print(json.dumps(measure_start(latencies, args.remote_config, args.timeout)))
+        sys.stdout.flush()
+        # The bot's daemon threads don't need a clean shutdown here
+        os._exit(0)
+
+    import_seconds, heavy = measure_import()
+    print(f"import TOCRSB: {import_seconds * 1000:.1f} ms, heavy modules loaded: {', '.join(heavy) or 'none'}")
+
+    runs = []
+    child = [
+        sys.executable, __file__, "--child", "--timeout", str(args.timeout),
+        *(["--remote-config"] if args.remote_config else [])
+    ]
+    if args.latency:
+        child += ["--latency", *args.latency]
+    for _ in range(args.repeat):
+        result = subprocess.run(child, capture_output=True, text=True)
+        if result.returncode != 0:
+            sys.exit(f"Start run failed:\n{result.stderr}")
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'phase':<12} {'median ms':>10} {'max ms':>10}")
+    for phase in runs[0]:
+        values = [run[phase] for run in runs]
+        print(f"{phase:<12} {median(values) * 1000:10.1f} {max(values) * 1000:10.1f}")
+
+    total = median(run["total"] for run in runs)
+    if heavy:
+        print(f"\nFAIL: importing TOCRSB loaded {', '.join(heavy)}")
+    if total > args.budget:
+        print(f"\nFAIL: /start answered after {total:.2f} s, over the {args.budget:.2f} s budget")
+    else:
+        print(f"\nOK: /start answered after {total:.2f} s, within the {args.budget:.2f} s budget")
+    sys.exit(1 if heavy or total > args.budget else 0)
+
+
+if __name__ == "__main__":
+    main()
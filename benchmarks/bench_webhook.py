@@ -0,0 +1,105 @@
+"""POST recorded Telegram updates to a webhook endpoint and measure acknowledgement latency.
+
+Point --url at a bot running with BOT_MODE=webhook (and WEBHOOK_REGISTER=0 so
+Telegram keeps its own webhook), or use --local to start an in-process
+WebhookServer whose handler only sleeps, which measures the server itself.
+
+    python benchmarks/bench_webhook.py --url http://localhost:8080/telegram --secret $WEBHOOK_SECRET
+    python benchmarks/bench_webhook.py --local --requests 2000 --concurrency 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from statistics import median
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bet_ocr.webhook import WebhookServer
+
+
+def post(url, secret, body):
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        WebhookServer.SECRET_HEADER: secret,
+    })
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=Path, default=Path(__file__).parent / "updates")
+    parser.add_argument("--url")
+    parser.add_argument("--secret", default="local-secret")
+    parser.add_argument("--local", action="store_true", help="serve with an in-process WebhookServer")
+    parser.add_argument("--handler-ms", type=float, default=50, help="fake processing time with --local")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    bodies = [path.read_bytes() for path in sorted(args.updates.glob("*.json"))]
+    if not bodies:
+        sys.exit(f"No recorded updates in {args.updates}")
+
+    server = None
+    processed = []
+    if args.local:
+        lock = threading.Lock()
+
+        def on_update(data):
+            time.sleep(args.handler_ms / 1000)
+            with lock:
+                processed.append(data["update_id"])
+
+        server = WebhookServer("127.0.0.1", 0, "/telegram", args.secret, on_update)
+        server.start()
+        args.url = f"http://127.0.0.1:{server.port}/telegram"
+    elif not args.url:
+        sys.exit("Pass --url or --local")
+
+    # A wrong secret must be refused before anything is queued
+    forbidden, _ = post(args.url, args.secret + "-wrong", bodies[0])
+    print(f"wrong secret -> HTTP {forbidden}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda number: post(args.url, args.secret, bodies[number % len(bodies)]),
+            range(args.requests)
+        ))
+    wall = time.perf_counter() - start
+
+    latencies = [latency for _, latency in results]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"{args.requests} updates in {wall:.2f} s ({args.requests / wall:.0f}/s), statuses {statuses}")
+    print(
+        f"ack latency ms  p50 {median(latencies) * 1000:.1f}  p95 {percentile(latencies, 0.95) * 1000:.1f}  "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}"
+    )
+
+    if server is not None:
+        server.stop()
+        print(f"processed {len(processed)} updates, server counters {json.dumps(server.stats())}")
+
+
+if __name__ == "__main__":
+    main()
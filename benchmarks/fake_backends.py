@@ -0,0 +1,668 @@
+"""In-process stand-ins for Telegram, Gemini, Tesseract, GCS and the Sheets/Drive APIs.
+
+install() registers fake versions of the SDK modules the bot imports, so it must run
+before the bot is built. Every outbound call goes through an Upstream, which
+sleeps for a lognormal latency sample and fails at a configured rate with the
+error the real client would raise, so the bot's retry, breaker and batching
+code runs exactly as it does in production. See bench_load.py for the driver.
+"""
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = ImageDraw = None
+
+
+class Upstream:
+    """Latency and error model for one backend"""
+
+    def __init__(self, name, mean_ms=0.0, sigma=0.0, error_rate=0.0, error_factory=None):
+        self.name = name
+        self.mean_ms = mean_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_factory = error_factory
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def latency(self):
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.mean_ms / 1000
+        # Lognormal with the requested mean, sigma sets the tail
+        mu = math.log(self.mean_ms) - self.sigma ** 2 / 2
+        return random.lognormvariate(mu, self.sigma) / 1000
+
+    def call(self):
+        """Sleep like a request would, then raise the backend's error at error_rate"""
+        time.sleep(self.latency())
+        failed = self.error_factory is not None and random.random() < self.error_rate
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+        if failed:
+            raise self.error_factory()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors}
+
+
+class Backends:
+    """The upstreams plus the shared in-memory state behind the fake clients"""
+
+    NAMES = ("telegram", "gemini", "gcs", "sheets", "drive")
+
+    def __init__(self, latencies=None, error_rates=None, responses=None, image_kb=200):
+        latencies = latencies or {}
+        error_rates = error_rates or {}
+        self.upstreams = {
+            name: Upstream(name, *latencies.get(name, (0.0, 0.0)), error_rate=error_rates.get(name, 0.0))
+            for name in self.NAMES
+        }
+        self.responses = responses or {}
+        self.image_kb = image_kb
+        self.blobs = {}
+        self.blob_times = {}
+        self.blobs_lock = threading.Lock()
+        self.spreadsheets = {}
+        self.sheets_lock = threading.Lock()
+
+    def seed_blob(self, bucket_name, object_name, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.blobs_lock:
+            self.blobs[(bucket_name, object_name)] = data
+            self.blob_times[(bucket_name, object_name)] = datetime.datetime.now(datetime.timezone.utc)
+
+    def stats(self):
+        return {name: upstream.stats() for name, upstream in self.upstreams.items()}
+
+
+backends = None
+
+
+def slip_image(seed, image_kb):
+    """A distinct screenshot-like image per seed, so neither cache tier short-circuits OCR"""
+    rng = random.Random(seed)
+    if Image is None:
+        return b"\xff\xd8\xff\xe0" + rng.randbytes(image_kb * 1024)
+    image = Image.new("RGB", (720, 1280), "white")
+    draw = ImageDraw.Draw(image)
+    for top in range(40, 1240, 48):
+        width = rng.randint(120, 640)
+        draw.rectangle((40, top, 40 + width, top + 20), fill=tuple(rng.randint(0, 200) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# Telegram
+
+class FakeFile:
+    def __init__(self, file_id, file_size):
+        self.file_id = file_id
+        self.file_size = file_size
+        self.file_path = f"fake://telegram/{file_id}.jpg"
+
+    def download(self, custom_path=None, out=None):
+        backends.upstreams["telegram"].call()
+        data = slip_image(self.file_id, backends.image_kb)
+        if out is not None:
+            out.write(data)
+            return out
+        path = custom_path or os.path.join(tempfile.gettempdir(), f"{self.file_id}.jpg")
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+
+class FakeBot:
+    def get_file(self, file_id):
+        backends.upstreams["telegram"].call()
+        return FakeFile(file_id, backends.image_kb * 1024)
+
+    def set_my_commands(self, commands):
+        return True
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        backends.upstreams["telegram"].call()
+        message = FakeMessage(chat_id)
+        message.message_id = message_id
+        message.text = text
+        return message
+
+
+_message_ids = itertools.count(1)
+
+
+class FakeMessage:
+    """A sent or received message; edits are recorded so the driver can see the final text"""
+
+    def __init__(self, user_id=None, photo=None):
+        self.from_user = types.SimpleNamespace(id=user_id)
+        self.chat_id = user_id
+        self.message_id = next(_message_ids)
+        self.photo = photo or []
+        self.document = None
+        self.media_group_id = None
+        self.text = None
+        self.edits = []
+
+    def reply_text(self, text, **kwargs):
+        backends.upstreams["telegram"].call()
+        reply = FakeMessage(self.from_user.id)
+        reply.text = text
+        return reply
+
+    def edit_text(self, text, **kwargs):
+        backends.upstreams["telegram"].call()
+        self.edits.append(text)
+        self.text = text
+        return self
+
+
+def photo_update(user_id, file_id):
+    """A Telegram update carrying one photo, as PTB would hand it to a MessageHandler"""
+    photo = types.SimpleNamespace(file_id=file_id, file_size=backends.image_kb * 1024)
+    return types.SimpleNamespace(message=FakeMessage(user_id, [photo]), effective_user=types.SimpleNamespace(id=user_id))
+
+
+class _Filter:
+    def __init__(self, name):
+        self.name = name
+
+    def __or__(self, other):
+        return _Filter(f"{self.name}|{other.name}")
+
+
+class _Handler:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.callback = kwargs.get("callback") or next(arg for arg in args if callable(arg))
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def handler(self, kind):
+        return next(handler.callback for handler in self.handlers if type(handler).__name__ == kind)
+
+    def command(self, name):
+        return next(
+            handler.callback for handler in self.handlers
+            if type(handler).__name__ == "CommandHandler" and handler.args[0] == name
+        )
+
+
+class FakeUpdater:
+    """Captures the dispatcher and blocks in idle() until the driver calls stop()"""
+
+    instance = None
+
+    def __init__(self, token, workers=4, request_kwargs=None, **kwargs):
+        self.workers = workers
+        self.bot = FakeBot()
+        self.dispatcher = FakeDispatcher()
+        self.started = threading.Event()
+        self._stopped = threading.Event()
+        FakeUpdater.instance = self
+
+    def start_polling(self, *args, **kwargs):
+        self.started.set()
+
+    def idle(self, *args, **kwargs):
+        self._stopped.wait()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_bot(main_bot, timeout=60, poll=0.001):
+    """Run the bot's main() on a daemon thread, returning its updater and the thread once polling has started
+
+    Raises RuntimeError if main() exits first, e.g. because building the bot
+    raised, and TimeoutError if polling hasn't started within timeout seconds.
+    """
+    failure = []
+
+    def run():
+        try:
+            main_bot()
+        except BaseException as e:
+            failure.append(e)
+            raise
+
+    thread = threading.Thread(target=run, name="bot-main", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        updater = FakeUpdater.instance
+        if updater is not None and updater.started.wait(poll):
+            return updater, thread
+        if not thread.is_alive():
+            raise RuntimeError(f"The bot exited before it started polling: {failure[0] if failure else 'no error'!r}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The bot did not start polling within {timeout:.0f} s")
+        if updater is None:
+            time.sleep(poll)
+
+
+# Gemini
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def resolve(self):
+        pass
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name=None, generation_config=None, safety_settings=None):
+        self.generation_config = generation_config or {}
+
+    def generate_content(self, parts, generation_config=None):
+        backends.upstreams["gemini"].call()
+        config = generation_config or self.generation_config
+        mode = "json" if config.get("response_mime_type") == "application/json" else "text"
+        images = sum(1 for part in parts if isinstance(part, dict))
+        texts = [random.choice(backends.responses[mode]) for _ in range(images)]
+        if images == 1:
+            return FakeResponse(texts[0])
+        if mode == "json":
+            return FakeResponse("[" + ",".join(texts) + "]")
+        return FakeResponse("".join(f"=== SLIP {number} ===\n{text}\n" for number, text in enumerate(texts, 1)))
+
+
+# Tesseract
+
+class FakeTesseract:
+    """Stand-in for pytesseract that "recognises" the text registered for an image, at one confidence
+
+    Images are told apart by their decoded pixels, as the backend hands over a
+    PIL image rather than the bytes it was sent.
+    """
+
+    class Output:
+        DICT = "dict"
+
+    def __init__(self, mean_ms=0.0, sigma=0.0):
+        self.upstream = Upstream("tesseract", mean_ms, sigma)
+        self.readings = {}
+
+    @staticmethod
+    def _key(image):
+        return hashlib.sha256(image.tobytes()).hexdigest()
+
+    def register(self, image_bytes, text, confidence):
+        self.readings[self._key(Image.open(io.BytesIO(image_bytes)))] = (text, confidence)
+
+    def image_to_data(self, image, lang=None, output_type=None):
+        self.upstream.call()
+        text, confidence = self.readings.get(self._key(image), ("", -1))
+        data = {"text": [], "conf": [], "block_num": [], "par_num": [], "line_num": []}
+        for line_num, line in enumerate(text.splitlines(), 1):
+            for word in line.split():
+                data["text"].append(word)
+                data["conf"].append(confidence)
+                data["block_num"].append(1)
+                data["par_num"].append(1)
+                data["line_num"].append(line_num)
+        return data
+
+
+# GCS
+
+class NotFound(Exception):
+    pass
+
+
+class TooManyRequests(Exception):
+    pass
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class InternalServerError(Exception):
+    pass
+
+
+class GatewayTimeout(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class FakeBlob:
+    def __init__(self, bucket_name, name):
+        self.key = (bucket_name, name)
+        self.name = name
+
+    def download_as_bytes(self):
+        backends.upstreams["gcs"].call()
+        with backends.blobs_lock:
+            data = backends.blobs.get(self.key)
+        if data is None:
+            raise NotFound(f"{self.key[0]}/{self.key[1]}")
+        return data
+
+    def upload_from_string(self, data):
+        backends.upstreams["gcs"].call()
+        backends.seed_blob(*self.key, data)
+
+    def exists(self):
+        backends.upstreams["gcs"].call()
+        with backends.blobs_lock:
+            return self.key in backends.blobs
+
+    def delete(self):
+        backends.upstreams["gcs"].call()
+        with backends.blobs_lock:
+            backends.blob_times.pop(self.key, None)
+            if backends.blobs.pop(self.key, None) is None:
+                raise NotFound(f"{self.key[0]}/{self.key[1]}")
+
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.name, name)
+
+    def get_blob(self, name):
+        backends.upstreams["gcs"].call()
+        blob = FakeBlob(self.name, name)
+        with backends.blobs_lock:
+            if blob.key not in backends.blobs:
+                return None
+            blob.updated = backends.blob_times[blob.key]
+        return blob
+
+
+class FakeStorageClient:
+    SCOPE = ("https://www.googleapis.com/auth/devstorage.full_control",)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        return FakeBucket(name)
+
+    def list_blobs(self, bucket_name, prefix=None, page_size=1000, page_token=None):
+        return FakeBlobPages(bucket_name, prefix or "", page_size, page_token)
+
+
+class FakeBlobPages:
+    """Sorted listing resumed after the name in page_token, each page is one GCS call"""
+
+    def __init__(self, bucket_name, prefix, page_size, page_token):
+        self._args = (bucket_name, prefix, page_size, page_token)
+        self.next_page_token = None
+
+    @property
+    def pages(self):
+        bucket_name, prefix, page_size, page_token = self._args
+        while True:
+            backends.upstreams["gcs"].call()
+            with backends.blobs_lock:
+                names = sorted(
+                    name for bucket, name in backends.blobs
+                    if bucket == bucket_name and name.startswith(prefix) and name > (page_token or "")
+                )
+            page, rest = names[:page_size], names[page_size:]
+            self.next_page_token = page_token = page[-1] if rest else None
+            yield [FakeBlob(bucket_name, name) for name in page]
+            if page_token is None:
+                return
+
+
+class FakeAuthorizedSession:
+    def __init__(self, credentials=None):
+        pass
+
+    def mount(self, prefix, adapter):
+        pass
+
+
+# Google auth
+
+class FakeCredentials:
+    """A token.json of {"expires_in": seconds} expires that soon, {"revoked": true} fails to refresh"""
+
+    def __init__(self, info=None):
+        self.info = info or {}
+        self.refresh_token = "fake-refresh-token"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.info.get("expires_in", 86400))
+
+    @property
+    def valid(self):
+        return self.expiry > datetime.datetime.utcnow()
+
+    @property
+    def expired(self):
+        return not self.valid
+
+    @classmethod
+    def from_authorized_user_info(cls, info, scopes=None):
+        return cls(info)
+
+    def refresh(self, request):
+        if self.info.get("revoked"):
+            raise Exception("invalid_grant: Token has been expired or revoked.")
+        self.info = dict(self.info, expires_in=86400)
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+    def to_json(self):
+        return json.dumps(self.info)
+
+
+# Sheets and Drive
+
+class HttpError(Exception):
+    def __init__(self, resp, content=b"", uri=None):
+        super().__init__(f"HTTP {resp.status}")
+        self.resp = resp
+        self.content = content
+
+
+class _Response(dict):
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class _Request:
+    def __init__(self, upstream, run):
+        self._upstream = upstream
+        self._run = run
+
+    def execute(self):
+        backends.upstreams[self._upstream].call()
+        return self._run()
+
+
+def _parse_range(range):
+    """0-based column and row slices of an A1 range like 'Sheet1!A2:M' or 'Sheet1!A:A', single letters only"""
+    cells = re.findall(r"([A-Z])(\d*)", range.split("!")[-1])
+    (first_column, first_row), (last_column, last_row) = cells[0], cells[-1]
+    columns = slice(ord(first_column) - ord("A"), ord(last_column) - ord("A") + 1)
+    rows = slice(int(first_row) - 1 if first_row else 0, int(last_row) if last_row else None)
+    return columns, rows
+
+
+class _Values:
+    def _read(self, spreadsheetId, range):
+        columns, rows = _parse_range(range)
+        with backends.sheets_lock:
+            sheet = backends.spreadsheets.get(spreadsheetId)
+            if sheet is None:
+                raise HttpError(_Response(404))
+            values = [row[columns] for row in sheet["rows"][rows]]
+        return {"range": range, "values": values}
+
+    def get(self, spreadsheetId, range):
+        return _Request("sheets", lambda: self._read(spreadsheetId, range))
+
+    def batchGet(self, spreadsheetId, ranges):
+        return _Request("sheets", lambda: {"valueRanges": [self._read(spreadsheetId, range) for range in ranges]})
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            columns, rows = _parse_range(range)
+            with backends.sheets_lock:
+                sheet = backends.spreadsheets.get(spreadsheetId)
+                if sheet is None:
+                    raise HttpError(_Response(404))
+                for number, values in enumerate(body["values"], rows.start):
+                    while len(sheet["rows"]) <= number:
+                        sheet["rows"].append([])
+                    row = sheet["rows"][number]
+                    row.extend([""] * (columns.start + len(values) - len(row)))
+                    row[columns.start:columns.start + len(values)] = values
+            return {"updatedRange": range}
+        return _Request("sheets", run)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            with backends.sheets_lock:
+                sheet = backends.spreadsheets.get(spreadsheetId)
+                if sheet is None:
+                    raise HttpError(_Response(404))
+                first = len(sheet["rows"]) + 1
+                sheet["rows"].extend(list(row) for row in body["values"])
+                last = len(sheet["rows"])
+            return {"updates": {"updatedRange": f"Sheet1!A{first}:M{last}"}}
+        return _Request("sheets", run)
+
+
+class _Spreadsheets:
+    def values(self):
+        return _Values()
+
+    def create(self, body, fields=None):
+        def run():
+            spreadsheet_id = os.urandom(12).hex()
+            with backends.sheets_lock:
+                backends.spreadsheets[spreadsheet_id] = {"title": body["properties"]["title"], "rows": []}
+            return {"spreadsheetId": spreadsheet_id}
+        return _Request("sheets", run)
+
+
+class _Files:
+    def list(self, q=None, **kwargs):
+        match = re.search(r"name='([^']*)'", q or "")
+
+        def run():
+            with backends.sheets_lock:
+                files = [
+                    {"id": spreadsheet_id, "name": sheet["title"]}
+                    for spreadsheet_id, sheet in backends.spreadsheets.items()
+                    if match is None or sheet["title"] == match.group(1)
+                ]
+            return {"files": files}
+        return _Request("drive", run)
+
+
+class FakeSheetsService:
+    def spreadsheets(self):
+        return _Spreadsheets()
+
+
+class FakeDriveService:
+    def files(self):
+        return _Files()
+
+
+def build(service_name, version, credentials=None, **kwargs):
+    return FakeSheetsService() if service_name == "sheets" else FakeDriveService()
+
+
+# Errors each upstream raises when its error rate fires, all of them retryable in the bot
+ERROR_FACTORIES = {
+    "telegram": lambda: ConnectionError("Telegram timed out"),
+    "gemini": lambda: TooManyRequests("429 Resource has been exhausted"),
+    "gcs": lambda: ServiceUnavailable("503 Backend unavailable"),
+    "sheets": lambda: HttpError(_Response(429, {"retry-after": "1"})),
+    "drive": lambda: HttpError(_Response(503)),
+}
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def install(latencies=None, error_rates=None, responses=None, image_kb=200):
+    """Replace the Google and Telegram SDK modules with the fakes, returning the shared Backends"""
+    global backends
+    if "bet_ocr.handlers" in sys.modules:
+        raise RuntimeError("fake_backends.install() must run before the bot is built")
+    backends = Backends(latencies, error_rates, responses, image_kb)
+    for name, upstream in backends.upstreams.items():
+        upstream.error_factory = ERROR_FACTORIES[name]
+
+    _module("google", __path__=[])
+    _module("google.auth", __path__=[], default=lambda scopes=None: (None, "fake-project"))
+    _module("google.auth.transport", __path__=[])
+    _module("google.auth.transport.requests", Request=lambda *args, **kwargs: None, AuthorizedSession=FakeAuthorizedSession)
+    _module("google.oauth2", __path__=[])
+    _module("google.oauth2.credentials", Credentials=FakeCredentials)
+    _module("google.cloud", __path__=[])
+    _module("google.cloud.storage", Client=FakeStorageClient)
+    _module("google.api_core", __path__=[])
+    _module(
+        "google.api_core.exceptions",
+        NotFound=NotFound, TooManyRequests=TooManyRequests, ServiceUnavailable=ServiceUnavailable,
+        InternalServerError=InternalServerError, GatewayTimeout=GatewayTimeout, DeadlineExceeded=DeadlineExceeded
+    )
+    _module("google.generativeai", configure=lambda **kwargs: None, GenerativeModel=FakeGenerativeModel)
+    _module("google_auth_oauthlib", __path__=[])
+    _module("google_auth_oauthlib.flow", InstalledAppFlow=object, Flow=object)
+    _module("googleapiclient", __path__=[])
+    _module("googleapiclient.discovery", build=build)
+    _module("googleapiclient.errors", HttpError=HttpError)
+    _module(
+        "telegram", __path__=[],
+        Update=types.SimpleNamespace, BotCommand=lambda *args: args,
+        InlineKeyboardButton=lambda *args, **kwargs: (args, kwargs), InlineKeyboardMarkup=lambda rows: rows
+    )
+    _module(
+        "telegram.ext",
+        Updater=FakeUpdater, Filters=types.SimpleNamespace(photo=_Filter("photo"), document=_Filter("document")),
+        CallbackContext=types.SimpleNamespace,
+        CommandHandler=type("CommandHandler", (_Handler,), {}),
+        MessageHandler=type("MessageHandler", (_Handler,), {}),
+        CallbackQueryHandler=type("CallbackQueryHandler", (_Handler,), {})
+    )
+    return backends
@@ -0,0 +1,118 @@
+"""Print a flame-style breakdown of the slowest slips in a trace export.
+
+Reads the JSONL file the bot writes to TRACE_PATH (one span tree per slip) and,
+for the N slowest slips, draws every span as a bar on the slip's timeline, nested
+under its parent. The summary at the end totals self time per span name across
+those slips, which is where the time actually went.
+
+    python benchmarks/trace_report.py traces.jsonl --top 10
+    python benchmarks/trace_report.py traces.jsonl --status saved --since 3600
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+from pathlib import Path
+
+
+def load_traces(path, status=None, since=None):
+    traces = []
+    with path.open(encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                trace = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line {number}", file=sys.stderr)
+                continue
+            if status and trace["status"] != status:
+                continue
+            if since and trace["started_at"] < since:
+                continue
+            traces.append(trace)
+    return traces
+
+
+def self_times(spans):
+    """Span duration minus the time covered by its direct children"""
+    covered = {}
+    for span in spans:
+        if span["parent_id"] is not None:
+            covered[span["parent_id"]] = covered.get(span["parent_id"], 0.0) + span["duration_ms"]
+    return {span["span_id"]: max(0.0, span["duration_ms"] - covered.get(span["span_id"], 0.0)) for span in spans}
+
+
+def bar(span, total, width):
+    if total <= 0:
+        return " " * width
+    begin = min(width - 1, int(span["offset_ms"] / total * width))
+    length = max(1, round(span["duration_ms"] / total * width))
+    return (" " * begin + "█" * length)[:width].ljust(width)
+
+
+def print_trace(rank, trace, width):
+    started = datetime.datetime.fromtimestamp(trace["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    user_id = trace["attributes"].get("user_id", "?")
+    print(
+        f"#{rank} {trace['trace_id']}  user {user_id}  {trace['status']}  "
+        f"{trace['duration_ms'] / 1000:.2f} s  {started}"
+    )
+
+    children = {}
+    for span in trace["spans"]:
+        children.setdefault(span["parent_id"], []).append(span)
+
+    def walk(parent_id, depth):
+        for span in sorted(children.get(parent_id, []), key=lambda span: span["offset_ms"]):
+            label = ("  " * depth + span["name"])[:32]
+            error = f"  ! {span['error']}" if span["error"] else ""
+            print(
+                f"  {label:<32} {span['duration_ms']:>9.1f} ms "
+                f"{span['duration_ms'] / trace['duration_ms'] * 100 if trace['duration_ms'] else 0:5.1f}% "
+                f"|{bar(span, trace['duration_ms'], width)}|{error}"
+            )
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path, nargs="?", default=Path("traces.jsonl"))
+    parser.add_argument("--top", type=int, default=5, help="number of slowest slips to show")
+    parser.add_argument("--status", help="only slips that finished with this status, e.g. saved or error")
+    parser.add_argument("--since", type=float, metavar="SECONDS", help="only slips started in the last SECONDS")
+    parser.add_argument("--width", type=int, default=40, help="timeline width in characters")
+    args = parser.parse_args()
+
+    if not args.path.exists():
+        sys.exit(f"No trace file at {args.path}, is TRACE_PATH set?")
+    traces = load_traces(args.path, args.status, time.time() - args.since if args.since else None)
+    if not traces:
+        sys.exit("No matching traces")
+
+    slowest = sorted(traces, key=lambda trace: trace["duration_ms"], reverse=True)[:args.top]
+    durations = sorted(trace["duration_ms"] for trace in traces)
+    print(
+        f"{len(traces)} slips, p50 {durations[len(durations) // 2] / 1000:.2f} s, "
+        f"max {durations[-1] / 1000:.2f} s, showing the slowest {len(slowest)}\n"
+    )
+    for rank, trace in enumerate(slowest, 1):
+        print_trace(rank, trace, args.width)
+
+    totals = {}
+    for trace in slowest:
+        own = self_times(trace["spans"])
+        for span in trace["spans"]:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + own[span["span_id"]]
+    grand_total = sum(totals.values()) or 1.0
+    print(f"Self time across these {len(slowest)} slips")
+    for name, total in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<32} {total:>10.1f} ms {total / grand_total * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""Telegram bot that reads bet slips with Gemini and records them in the user's Google Sheet
+
+bet_ocr.handlers imports the Telegram SDK when it is imported, every other module imports
+the Google and Telegram SDKs only when they are first used. handlers.SlipBot holds the
+bot's components and handlers, handlers.create_bot() builds one and TOCRSB.py is the
+entry point that runs it.
+"""
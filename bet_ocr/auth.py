@@ -0,0 +1,199 @@
+"""Each user's Google OAuth token: the consent link, the callback that stores it, loading, refreshing and revoking it"""
+import hashlib
+import hmac
+import json
+import logging
+
+from .config import SCOPES
+from .storage import CredentialCache
+from .telemetry import stage_timer, timing_decorator
+
+logger = logging.getLogger(__name__)
+
+
+def token_path(user_id):
+    return f"bot_user_tokens/{user_id}/token.json"
+
+
+class GoogleAuth:
+    """Loads, caches and refreshes users' Google credentials stored in the bucket
+
+    redirect_uri is this deployment's OAuth callback and link_url the page the
+    bot's connect button opens, the callback itself unless another service runs
+    the consent flow. With a state_secret the user ID in that link is signed,
+    which only our own callback checks. index is the TokenHealthIndex of users
+    whose grant was revoked, cache_options go to the CredentialCache.
+    """
+
+    def __init__(self, storage, bucket_name, index, redirect_uri, link_url=None, state_secret=None,
+                 client_object="client_secret.json", **cache_options):
+        self.storage = storage
+        self.bucket_name = bucket_name
+        self.token_health = index
+        self.redirect_uri = redirect_uri
+        self.link_url = link_url or redirect_uri
+        self.state_secret = state_secret
+        self.client_object = client_object
+        self._client_config = None
+        # Per-user credential cache, keeps the token download and refresh off the hot path
+        self.credential_cache = CredentialCache(
+            loader=self.load_user_credentials, refresher=self.refresh_user_credentials, **cache_options
+        )
+
+    @timing_decorator
+    def download_from_gcs(self, object_name):
+        with stage_timer("gcs_download"):
+            return self.storage.read(self.bucket_name, object_name)
+
+    def generate_google_auth_url(self, user_id):
+        """Generate authentication URL for Google OAuth"""
+        # Generate state parameter with user_id, signed when our own callback will check it
+        state = self.sign_oauth_state(user_id) if self.state_secret is not None else str(user_id)
+        return f"{self.link_url}?state={state}"
+
+    def sign_oauth_state(self, user_id):
+        signature = hmac.new(
+            (self.state_secret or "").encode('utf-8'), str(user_id).encode('utf-8'), hashlib.sha256
+        ).hexdigest()
+        return f"{user_id}.{signature[:32]}"
+
+    def verify_oauth_state(self, state):
+        """Return the user ID from a signed state, or None if the signature does not match"""
+        user_id, _, _ = state.partition('.')
+        if not user_id or not hmac.compare_digest(self.sign_oauth_state(user_id), state):
+            return None
+        return user_id
+
+    def oauth_client_config(self):
+        """OAuth client secrets, fetched from the bucket on first use"""
+        if self._client_config is None:
+            _, text = self.download_from_gcs(self.client_object)
+            self._client_config = json.loads(text)
+        return self._client_config
+
+    def oauth_callback(self, query):
+        """Send the user on to Google's consent screen, or store the token Google sent back"""
+        user_id = self.verify_oauth_state(query.get('state', ''))
+        if user_id is None:
+            return 400, "text/plain", "This link is invalid. Please request a new one from the bot.", {}
+        if 'error' in query:
+            return 400, "text/plain", f"Google sign-in was cancelled: {query['error']}", {}
+
+        from google_auth_oauthlib.flow import Flow
+
+        # No PKCE verifier, the callback may be served by a different replica than the redirect
+        flow = Flow.from_client_config(
+            self.oauth_client_config(),
+            scopes=SCOPES,
+            redirect_uri=self.redirect_uri,
+            autogenerate_code_verifier=False
+        )
+        if 'code' not in query:
+            auth_url, _ = flow.authorization_url(access_type='offline', prompt='consent', state=query['state'])
+            return 302, "text/plain", "", {"Location": auth_url}
+
+        flow.fetch_token(code=query['code'])
+        self.storage.write(self.bucket_name, token_path(user_id), flow.credentials.to_json())
+        self.invalidate_token_cache(user_id)
+        self.token_health.clear(user_id)
+        logger.info(f"Stored Google token for user {user_id}")
+        return 200, "text/html", "<p>✅ Google account connected. You can go back to Telegram.</p>", {}
+
+    def check_if_authenticated(self, user_id):
+        """Check if a user has already authenticated with Google"""
+        # Revoked by the token scan, so the slip is turned away before any download or OCR,
+        # until a token written after the revocation shows the user reconnected
+        revoked_at = self.token_health.revoked_at(user_id)
+        if revoked_at is not None:
+            try:
+                written = self.storage.updated(self.bucket_name, token_path(user_id))
+            except Exception:
+                return False
+            if written is None or written <= revoked_at:
+                return False
+            self.token_health.clear(user_id)
+            return True
+        if user_id in self.credential_cache:
+            return True
+        try:
+            return self.storage.exists(self.bucket_name, token_path(user_id))
+        except Exception:
+            return False
+
+    def refresh_user_credentials(self, user_id, creds):
+        """Refresh expired credentials and save them back, deleting tokens revoked by Google"""
+        from google.auth.transport.requests import Request
+
+        try:
+            logger.info(f"Attempting token refresh for user {user_id}")
+            with stage_timer("token_refresh"):
+                creds.refresh(Request())
+
+            with stage_timer("token_save"):
+                self.storage.write(self.bucket_name, token_path(user_id), creds.to_json())
+            return creds
+
+        except Exception as refresh_error:
+            logger.error(f"Token refresh failed for user {user_id}: {refresh_error}")
+
+            # Handle invalid_grant error by deleting the token
+            if 'invalid_grant' in str(refresh_error):
+                self.revoke_user(user_id)
+            return None
+
+    def revoke_user(self, user_id):
+        """Mark a user whose grant Google no longer accepts and delete their dead token"""
+        self.token_health.mark_revoked(user_id)
+        try:
+            self.delete_user_token(user_id)
+        except Exception as delete_error:
+            logger.error(f"Error deleting invalid token: {delete_error}")
+
+    def load_user_credentials(self, user_id):
+        """Load a user's credentials from GCS, refreshing them if they have expired"""
+        from google.oauth2.credentials import Credentials
+
+        try:
+            with stage_timer("token_download"):
+                gcs_tokens, _ = self.download_from_gcs(token_path(user_id))
+            creds = Credentials.from_authorized_user_info(json.loads(gcs_tokens))
+        except Exception as e:
+            logger.error(f"Token retrieval error for user {user_id}: {e}")
+            creds = None
+
+        # Handle credential validation and refresh
+        if creds and not creds.valid:
+            if creds.expired and creds.refresh_token:
+                creds = self.refresh_user_credentials(user_id, creds)
+            else:
+                creds = None
+
+        if creds is not None:
+            # A working token means the user reconnected since any revocation
+            self.token_health.clear(user_id)
+        return creds
+
+    def invalidate_token_cache(self, user_id):
+        """Drop a user's cached credentials so the next call reloads them"""
+        self.credential_cache.invalidate(user_id)
+
+    def delete_user_token(self, user_id):
+        """Delete a user's stored Google token if it exists"""
+        self.invalidate_token_cache(user_id)
+        with stage_timer("token_delete"):
+            return self.storage.delete(self.bucket_name, token_path(user_id))
+
+    @timing_decorator
+    def do_gsheet_authentication(self, user_id):
+        """Authenticate user access to Google Sheets"""
+        with stage_timer("sheet_auth"):
+            creds = self.credential_cache.get(user_id)
+
+            # Cached token expired between background refresh runs
+            if creds and not creds.valid:
+                creds = self.refresh_user_credentials(user_id, creds)
+                if creds:
+                    self.credential_cache.put(user_id, creds)
+                else:
+                    self.invalidate_token_cache(user_id)
+        return creds
@@ -0,0 +1,311 @@
+"""OCR backends, per-bookmaker layout templates for the local one, and the cascade that escalates between them"""
+import abc
+import io
+import json
+import logging
+import re
+import threading
+import time
+
+from .extraction import parse_number, parse_ocr_output
+from .telemetry import stage_timer, timing_decorator
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, the local backend declines every slip without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBackend(abc.ABC):
+    """Turns (image_bytes, mime_type) slips into OCR text that parse_ocr_output reads
+
+    read() may return None to decline a slip it cannot read, the cascade then
+    hands it to the next backend.
+    """
+
+    name = "backend"
+
+    @abc.abstractmethod
+    def read(self, image_bytes, mime_type, user_id=None):
+        """OCR text for one slip, or None to decline it"""
+
+    def read_batch(self, images, user_id=None):
+        return [self.read(image_bytes, mime_type, user_id=user_id) for image_bytes, mime_type in images]
+
+
+class GeminiBackend(OCRBackend):
+    """Gemini through the registry's per-thread models and the upstream guard, albums share a request"""
+
+    name = "gemini"
+
+    def __init__(self, registry, guard, batch_size=10):
+        self.registry = registry
+        self.guard = guard
+        self.batch_size = batch_size
+
+    @timing_decorator
+    def read(self, image_bytes, mime_type, user_id=None):
+        """Extract text from one bet slip image"""
+        model = self.registry.model()
+        with stage_timer("ocr"):
+            response = self.guard.call(
+                model.generate_content, self.registry.prompt_parts(image_bytes, mime_type), user_id=user_id
+            )
+            response.resolve()
+        return response.text
+
+    @timing_decorator
+    def read_album(self, images, user_id=None):
+        """OCR several slips in one Gemini request, one text per image"""
+        prompt_parts = self.registry.batch_prompt_parts(images)
+        batch_config = self.registry.batch_generation_config()
+        with stage_timer("ocr_batch"):
+            if batch_config is None:
+                response = self.guard.call(self.registry.model().generate_content, prompt_parts, user_id=user_id)
+            else:
+                response = self.guard.call(
+                    self.registry.model().generate_content, prompt_parts,
+                    generation_config=batch_config, user_id=user_id
+                )
+            response.resolve()
+
+        texts = self.registry.split_batch_response(response.text, len(images))
+        if texts is None:
+            # Blocks did not line up with the images, fall back to one request per image
+            logger.error(f'Could not split batch OCR response for {len(images)} images, retrying individually')
+            texts = [self.read(image_bytes, mime_type, user_id=user_id) for image_bytes, mime_type in images]
+        return texts
+
+    def read_batch(self, images, user_id=None):
+        if len(images) == 1:
+            return [self.read(*images[0], user_id=user_id)]
+        texts = []
+        for offset in range(0, len(images), self.batch_size):
+            texts += self.read_album(images[offset:offset + self.batch_size], user_id=user_id)
+        return texts
+
+
+class SlipTemplate:
+    """Where one bookmaker's slip layout puts each field, as regexes over the recognised text
+
+    `match` picks the template, `fields` maps the JSON slip fields to a pattern
+    whose first group is the value and `leg` is repeated over the text with
+    named groups for the leg fields. Patterns run with re.MULTILINE.
+    """
+
+    SLIP_FIELDS = ("id", "date", "staked_amount", "potential_winning", "total_odds", "bet_status")
+    LEG_FIELDS = ("time", "country", "league", "home_team", "away_team", "option", "odds")
+
+    def __init__(self, name, match, fields, leg, defaults=None):
+        unknown = set(fields) - set(self.SLIP_FIELDS)
+        if unknown:
+            raise ValueError(f"Template {name} has unknown fields: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.match = re.compile(match, re.MULTILINE)
+        self.fields = {field: re.compile(pattern, re.MULTILINE) for field, pattern in fields.items()}
+        self.leg = re.compile(leg, re.MULTILINE)
+        self.defaults = defaults or {}
+
+    @classmethod
+    def load_all(cls, path):
+        """Templates from a JSON list of {name, match, fields, leg, defaults}, in the order they are tried"""
+        with open(path, encoding="utf-8") as file:
+            return [cls(**entry) for entry in json.load(file)]
+
+    def matches(self, text):
+        return self.match.search(text) is not None
+
+    def _value(self, field, text):
+        pattern = self.fields.get(field)
+        match = pattern.search(text) if pattern is not None else None
+        return match.group(1).strip() if match else self.defaults.get(field, "")
+
+    def extract(self, text):
+        """The slip as a JSON-mode object, with empty strings and nulls for what the layout didn't show"""
+        slip = {field: self._value(field, text) for field in self.SLIP_FIELDS}
+        slip["total_odds"] = parse_number(slip["total_odds"])
+        slip["legs"] = []
+        for match in self.leg.finditer(text):
+            groups = match.groupdict()
+            leg = {field: (groups.get(field) or self.defaults.get(field, "")).strip() for field in self.LEG_FIELDS}
+            leg["odds"] = parse_number(leg["odds"])
+            slip["legs"].append(leg)
+        return slip
+
+
+class TesseractBackend(OCRBackend):
+    """Local Tesseract read of slips whose layout a template knows, in JSON output mode
+
+    Declines a slip when Pillow or pytesseract is missing, when the mean word
+    confidence is under min_confidence or when no template matches, so only
+    screenshots from known bookmaker apps are read locally.
+    """
+
+    name = "tesseract"
+
+    def __init__(self, templates, pytesseract=None, lang="eng", min_confidence=70, workers=2):
+        self.templates = templates
+        self._pytesseract = pytesseract
+        self.lang = lang
+        self.min_confidence = min_confidence
+        # Tesseract is CPU bound, more concurrent reads than cores only queue up
+        self._slots = threading.BoundedSemaphore(workers)
+        self._disabled = Image is None
+        if self._disabled:
+            logger.warning("Pillow is not installed, the Tesseract OCR backend will decline every slip")
+
+    def _engine(self):
+        if self._pytesseract is None and not self._disabled:
+            try:
+                import pytesseract
+            except ImportError:
+                logger.warning("pytesseract is not installed, the Tesseract OCR backend will decline every slip")
+                self._disabled = True
+                return None
+            self._pytesseract = pytesseract
+        return self._pytesseract
+
+    def recognise(self, image_bytes):
+        """The recognised text, one line per Tesseract line, and the mean word confidence"""
+        engine = self._engine()
+        if engine is None or self._disabled:
+            return None, 0.0
+        with self._slots:
+            image = Image.open(io.BytesIO(image_bytes))
+            data = engine.image_to_data(image, lang=self.lang, output_type=engine.Output.DICT)
+        lines = {}
+        confidences = []
+        for index, word in enumerate(data["text"]):
+            confidence = float(data["conf"][index])
+            if confidence < 0 or not word.strip():
+                continue
+            confidences.append(confidence)
+            key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+            lines.setdefault(key, []).append(word)
+        text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+        return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+    def read(self, image_bytes, mime_type, user_id=None):
+        with stage_timer("ocr_tesseract"):
+            text, confidence = self.recognise(image_bytes)
+        if not text or confidence < self.min_confidence:
+            return None
+        for template in self.templates:
+            if template.matches(text):
+                return json.dumps(template.extract(text), ensure_ascii=False)
+        return None
+
+
+def check_slip(text, tolerance=0.02):
+    """Why an extraction can't be trusted, or None when it is complete and adds up"""
+    try:
+        slip = parse_ocr_output(text)
+    except ValueError as e:
+        return str(e)
+    # The JSON parser makes up an ID when there is none, which would break updating the row later
+    if text.lstrip().startswith("{") and not json.loads(text)["id"].strip():
+        return "no bet ID"
+    if slip.stake is None:
+        return "no stake"
+    if slip.total_odds is None:
+        return "no total odds"
+    for leg in slip.legs:
+        if not leg["home_team"] or not leg["away_team"] or leg["odds"] is None:
+            return "incomplete leg"
+    # Misread digits rarely keep the odds and the payout consistent with each other
+    product = 1.0
+    for leg in slip.legs:
+        product *= leg["odds"]
+    if abs(product - slip.total_odds) > tolerance * slip.total_odds:
+        return f"leg odds multiply to {product:.2f}, total odds read as {slip.total_odds:.2f}"
+    if slip.potential_winning is not None:
+        expected = slip.stake * slip.total_odds
+        if abs(slip.potential_winning - expected) > tolerance * expected:
+            return f"potential winning {slip.potential_winning:.2f} is not stake x total odds {expected:.2f}"
+    return None
+
+
+class OCRCascade:
+    """Tries the backends in order, passing on what one declines or what fails validation
+
+    Every backend but the last has its output checked by `validate`; the last
+    one's is accepted as is, so with Gemini last nothing is rejected that the
+    Gemini-only path would have written. Errors from the last backend are
+    raised, so the pipeline's outage and rate limit handling still sees them.
+    """
+
+    RESULTS = ("accepted", "rejected", "declined", "errors")
+
+    def __init__(self, backends, validate=check_slip):
+        if not backends:
+            raise ValueError("The OCR cascade needs at least one backend")
+        self.backends = list(backends)
+        self.validate = validate
+        self._lock = threading.Lock()
+        self._stats = {
+            backend.name: dict(dict.fromkeys(("calls", "images") + self.RESULTS, 0), seconds=0.0, max_seconds=0.0)
+            for backend in self.backends
+        }
+
+    def _record(self, backend, images, elapsed, **results):
+        with self._lock:
+            stat = self._stats[backend.name]
+            stat["calls"] += 1
+            stat["images"] += images
+            stat["seconds"] += elapsed
+            stat["max_seconds"] = max(stat["max_seconds"], elapsed)
+            for result, count in results.items():
+                stat[result] += count
+
+    def read_batch(self, images, user_id=None):
+        """One OCR text per (image_bytes, mime_type), in order"""
+        texts = [None] * len(images)
+        pending = list(range(len(images)))
+        for position, backend in enumerate(self.backends):
+            if not pending:
+                break
+            last = position == len(self.backends) - 1
+            start_time = time.perf_counter()
+            try:
+                results = backend.read_batch([images[index] for index in pending], user_id=user_id)
+            except Exception as e:
+                self._record(backend, len(pending), time.perf_counter() - start_time, errors=len(pending))
+                if last:
+                    raise
+                logger.warning(f"OCR backend {backend.name} failed, escalating {len(pending)} slips: {e}")
+                continue
+
+            counts = dict.fromkeys(self.RESULTS, 0)
+            escalated = []
+            for index, text in zip(pending, results):
+                reason = "declined" if text is None else None if last else self.validate(text)
+                if reason is None:
+                    texts[index] = text
+                    counts["accepted"] += 1
+                elif text is None:
+                    counts["declined"] += 1
+                    escalated.append(index)
+                else:
+                    logger.info(f"OCR backend {backend.name} result rejected, escalating: {reason}")
+                    counts["rejected"] += 1
+                    escalated.append(index)
+            self._record(backend, len(pending), time.perf_counter() - start_time, **counts)
+            pending = escalated
+
+        if pending:
+            raise RuntimeError(f"No OCR backend could read {len(pending)} of {len(images)} slips")
+        return texts
+
+    def read(self, image_bytes, mime_type, user_id=None):
+        return self.read_batch([(image_bytes, mime_type)], user_id=user_id)[0]
+
+    def stats(self):
+        """Per backend counts with hit rate (accepted share of the slips it saw) and mean call latency"""
+        with self._lock:
+            snapshot = {name: dict(stat) for name, stat in self._stats.items()}
+        for stat in snapshot.values():
+            stat["hit_rate"] = stat["accepted"] / stat["images"] if stat["images"] else 0.0
+            stat["mean_seconds"] = stat["seconds"] / stat["calls"] if stat["calls"] else 0.0
+        return snapshot
@@ -0,0 +1,61 @@
+"""Bot settings from the environment, a local config file or, as a fallback, the bucket's config.txt"""
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ROOT_BUCKET_NAME = 'andre_ocr_bot-bucket'
+CONFIG_OBJECT = 'config.txt'
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+DEFAULT_CREDENTIALS_FILE = "telegram-ocr-connection-7eb1d30dee09.json"
+
+# config.txt key -> environment variable that overrides it
+CONFIG_KEYS = {
+    'telegram_bot_token': 'TELEGRAM_BOT_TOKEN',
+    'google_gemini_api_key': 'GOOGLE_GEMINI_API_KEY',
+}
+
+
+def use_default_credentials():
+    """Point Google's default credentials at the bundled service account unless the environment already does"""
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", DEFAULT_CREDENTIALS_FILE)
+
+
+def parse_config_text(text):
+    """Read 'key = value' lines, ignoring blanks and # comments"""
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, _, value = line.partition('=')
+        values[key.strip()] = value.strip()
+    return values
+
+
+def load_config(read_remote=None, path=None):
+    """Collect every CONFIG_KEYS setting, only calling read_remote() if env and the local file leave gaps
+
+    read_remote returns the text of the bucket's config.txt. The local file is
+    CONFIG_PATH, config.txt in the working directory by default.
+    """
+    config = {key: os.environ[env_name] for key, env_name in CONFIG_KEYS.items() if os.environ.get(env_name)}
+    sources = dict.fromkeys(config, 'env')
+
+    local_path = Path(path or os.environ.get('CONFIG_PATH', CONFIG_OBJECT))
+    if len(config) < len(CONFIG_KEYS) and local_path.is_file():
+        for key, value in parse_config_text(local_path.read_text(encoding='utf-8')).items():
+            if key in CONFIG_KEYS and key not in config:
+                config[key], sources[key] = value, str(local_path)
+
+    if len(config) < len(CONFIG_KEYS) and read_remote is not None:
+        for key, value in parse_config_text(read_remote()).items():
+            if key in CONFIG_KEYS and key not in config:
+                config[key], sources[key] = value, 'gcs'
+
+    missing = [CONFIG_KEYS[key] for key in CONFIG_KEYS if key not in config]
+    if missing:
+        raise ValueError(f"Missing configuration: set {', '.join(missing)} or add them to {local_path}")
+    logger.info(f"Configuration loaded from {sources}")
+    return config
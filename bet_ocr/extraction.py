@@ -0,0 +1,286 @@
+"""Bet slip parsing for both OCR output modes and the sheet row layout"""
+import json
+import re
+import uuid
+
+
+# Sheet columns, and the extraction keys that fill them in the same order
+HEADER_VALUES = [
+    'ID', 'Date', 'Time', 'Country', 'League', 'Home', 'Away', 
+    'Staked Amount', 'Potential Winning', 'Bet Option Staked', 
+    'Legs Odds', 'Total Odds', 'Bet Status'
+]
+ROW_KEYS = [
+    'ID', 'Date', 'Time', 'Country', 'Match League', 
+    'Home Team', 'Away Team', 'Staked Amount', 'Potential Winning', 
+    'Bet Option Staked', 'Legs Odds', 'Total Odds', 'Bet Status'
+]
+
+# Label in the OCR text -> extraction key; longest labels first so
+# "Odds of Bet Option Staked" wins over "Bet Option Staked"
+_OCR_LABELS = {
+    "Odds of Bet Option Staked": "Legs Odds",
+    "Bet Option Staked": "Bet Option Staked",
+    "Potential Winning": "Potential Winning",
+    "Staked Amount": "Staked Amount",
+    "Match League": "Match League",
+    "Total Odds": "Total Odds",
+    "Bet Status": "Bet Status",
+    "Home Team": "Home Team",
+    "Away Team": "Away Team",
+    "Country": "Country",
+    "Date": "Date",
+    "Time": "Time",
+    "ID": "ID",
+}
+_FIELD_PATTERN = re.compile("(" + "|".join(re.escape(label) for label in _OCR_LABELS) + r"): (.+)")
+_NUMBER_PATTERN = re.compile(r"-?\d[\d.,]*")
+
+
+def parse_number(text):
+    """Normalise an amount or odds string such as '₦1,250.50', '50,00' or '2.35' to a float"""
+    if not text:
+        return None
+    match = _NUMBER_PATTERN.search(text.replace(" ", ""))
+    if not match:
+        return None
+    number = match.group(0).rstrip(".,")
+    if "," in number and "." in number:
+        # The separator that comes last is the decimal point
+        if number.rfind(",") > number.rfind("."):
+            number = number.replace(".", "").replace(",", ".")
+        else:
+            number = number.replace(",", "")
+    elif "," in number:
+        head, _, tail = number.rpartition(",")
+        number = number.replace(",", "") if len(tail) == 3 and head else head.replace(",", "") + "." + tail
+    elif number.count(".") > 1:
+        number = number.replace(".", "")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def _split_legs(value):
+    if value == "NA":
+        return []
+    return [part.strip() for part in value.split(";")]
+
+
+class BetSlip:
+    """Typed record of one slip parsed from OCR text
+
+    The parsers only fill values; amounts and legs are parsed on first access,
+    so a slip that is only written to the sheet never pays for them.
+    """
+
+    __slots__ = ("values", "_amounts", "_legs")
+
+    def __init__(self, values):
+        self.values = values
+        self._amounts = None
+        self._legs = None
+
+    def _amount(self, index):
+        if self._amounts is None:
+            values = self.values
+            self._amounts = (
+                parse_number(values["Staked Amount"]),
+                parse_number(values["Potential Winning"]),
+                parse_number(values["Total Odds"]),
+            )
+        return self._amounts[index]
+
+    @property
+    def stake(self):
+        return self._amount(0)
+
+    @property
+    def potential_winning(self):
+        return self._amount(1)
+
+    @property
+    def total_odds(self):
+        return self._amount(2)
+
+    @property
+    def legs(self):
+        if self._legs is None:
+            values = self.values
+            columns = {
+                "country": _split_legs(values["Country"]),
+                "league": _split_legs(values["Match League"]),
+                "home_team": _split_legs(values["Home Team"]),
+                "away_team": _split_legs(values["Away Team"]),
+                "option": _split_legs(values["Bet Option Staked"]),
+                "odds": _split_legs(values["Legs Odds"]),
+            }
+            leg_count = max(len(parts) for parts in columns.values())
+            legs = []
+            for index in range(leg_count):
+                leg = {name: parts[index] if index < len(parts) else None for name, parts in columns.items()}
+                leg["odds"] = parse_number(leg["odds"])
+                legs.append(leg)
+            self._legs = legs
+        return self._legs
+
+    @property
+    def bet_id(self):
+        return self.values["ID"]
+
+    @property
+    def status(self):
+        return self.values["Bet Status"]
+
+    def to_row(self):
+        """Row in HEADER_VALUES column order"""
+        return [self.values[key] for key in ROW_KEYS]
+
+
+def parse_bet_slip(text_from_ocr):
+    """Parse OCR text into a BetSlip in a single scan, keeping the first value seen for each field"""
+    values = dict.fromkeys(ROW_KEYS, "NA")
+    seen = set()
+    for match in _FIELD_PATTERN.finditer(text_from_ocr):
+        key = _OCR_LABELS[match.group(1)]
+        if key not in seen:
+            seen.add(key)
+            values[key] = match.group(2)
+
+    # If ID wasn't provided, generate a random one
+    if values["ID"] == "NA":
+        values["ID"] = str(uuid.uuid4())[:8]
+
+    # For single leg bets without Total Odds, use the legs odds as total odds
+    if values["Total Odds"] == "NA" and values["Legs Odds"] != "NA" and ";" not in values["Legs Odds"]:
+        values["Total Odds"] = values["Legs Odds"]
+
+    return BetSlip(values)
+
+
+class SlipValidationError(ValueError):
+    """OCR output that does not match the slip schema"""
+
+
+# Response schema for JSON output mode, in the subset of OpenAPI that Gemini accepts
+_LEG_TEXT_FIELDS = ("time", "country", "league", "home_team", "away_team", "option")
+_SLIP_TEXT_FIELDS = ("id", "date", "staked_amount", "potential_winning", "bet_status")
+SLIP_JSON_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **{field: {"type": "STRING"} for field in _SLIP_TEXT_FIELDS},
+        "total_odds": {"type": "NUMBER", "nullable": True},
+        "legs": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    **{field: {"type": "STRING"} for field in _LEG_TEXT_FIELDS},
+                    "odds": {"type": "NUMBER", "nullable": True},
+                },
+                "required": list(_LEG_TEXT_FIELDS) + ["odds"],
+            },
+        },
+    },
+    "required": list(_SLIP_TEXT_FIELDS) + ["total_odds", "legs"],
+}
+
+# Leg field -> extraction key of the semicolon-joined column
+_LEG_COLUMNS = {
+    "time": "Time",
+    "country": "Country",
+    "league": "Match League",
+    "home_team": "Home Team",
+    "away_team": "Away Team",
+    "option": "Bet Option Staked",
+    "odds": "Legs Odds",
+}
+_SLIP_COLUMNS = {
+    "id": "ID",
+    "date": "Date",
+    "staked_amount": "Staked Amount",
+    "potential_winning": "Potential Winning",
+    "total_odds": "Total Odds",
+    "bet_status": "Bet Status",
+}
+
+
+def _check_field(record, field, number, where):
+    if field not in record:
+        raise SlipValidationError(f"{where} is missing '{field}'")
+    value = record[field]
+    if number:
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise SlipValidationError(f"{where}.{field} should be a number, got {value!r}")
+    elif not isinstance(value, str):
+        raise SlipValidationError(f"{where}.{field} should be a string, got {value!r}")
+
+
+def validate_slip_json(data):
+    """Check a decoded JSON slip against SLIP_JSON_SCHEMA, raising SlipValidationError on the first problem"""
+    if not isinstance(data, dict):
+        raise SlipValidationError(f"slip should be an object, got {type(data).__name__}")
+    for field in _SLIP_TEXT_FIELDS:
+        _check_field(data, field, False, "slip")
+    _check_field(data, "total_odds", True, "slip")
+
+    legs = data.get("legs")
+    if not isinstance(legs, list) or not legs:
+        raise SlipValidationError("slip.legs should be a non-empty array")
+    for index, leg in enumerate(legs):
+        where = f"slip.legs[{index}]"
+        if not isinstance(leg, dict):
+            raise SlipValidationError(f"{where} should be an object")
+        for field in _LEG_TEXT_FIELDS:
+            _check_field(leg, field, False, where)
+        _check_field(leg, "odds", True, where)
+    return data
+
+
+def _format_odds(value):
+    if value is None:
+        return "NA"
+    return format(value, ".2f") if round(value, 2) == value else str(value)
+
+
+def _column_text(value):
+    if value is None:
+        return "NA"
+    if isinstance(value, (int, float)):
+        return _format_odds(value)
+    value = value.strip()
+    return value if value else "NA"
+
+
+def parse_slip_json(text_from_ocr):
+    """Validate a JSON-mode OCR response and turn it into a BetSlip with the same columns as the text parser"""
+    try:
+        data = json.loads(text_from_ocr)
+    except ValueError as e:
+        raise SlipValidationError(f"OCR response is not valid JSON: {e}") from e
+    validate_slip_json(data)
+
+    values = {key: _column_text(data[field]) for field, key in _SLIP_COLUMNS.items()}
+    for field, key in _LEG_COLUMNS.items():
+        parts = [_column_text(leg[field]) for leg in data["legs"]]
+        values[key] = "NA" if all(part == "NA" for part in parts) else "; ".join(parts)
+
+    # Same fallbacks as the text parser
+    if values["ID"] == "NA":
+        values["ID"] = str(uuid.uuid4())[:8]
+    if values["Total Odds"] == "NA" and len(data["legs"]) == 1:
+        values["Total Odds"] = values["Legs Odds"]
+
+    return BetSlip(values)
+
+
+def build_row(extracted_values):
+    return [extracted_values.get(key, 'NA') for key in ROW_KEYS]
+
+
+def parse_ocr_output(text_from_ocr):
+    """Parse OCR output from either mode; cached results may predate a switch of OCR_OUTPUT_MODE"""
+    if text_from_ocr.lstrip().startswith("{"):
+        return parse_slip_json(text_from_ocr)
+    return parse_bet_slip(text_from_ocr)
@@ -0,0 +1,1105 @@
+"""Telegram handlers and the SlipBot that builds the running bot from the other modules
+
+The only bet_ocr module that imports the Telegram SDK at import time, so TOCRSB.py imports it inside TOCR().
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram.ext import (
+    Updater, CommandHandler, MessageHandler,
+    Filters, CallbackContext, CallbackQueryHandler
+)
+
+from .auth import GoogleAuth
+from .backends import GeminiBackend, OCRCascade, SlipTemplate, TesseractBackend
+from .config import CONFIG_OBJECT, ROOT_BUCKET_NAME, load_config
+from .extraction import SlipValidationError, parse_ocr_output
+from .history import BetHistory
+from .journal import JobJournal, JournaledMessage
+from .ocr import GeminiModelRegistry, ImagePreprocessor, OCRResultCache, detect_mime_type
+from .pipeline import AlbumCollector, AsyncSlipRuntime, OCRStage, SheetStage, SlipJob, StagedPipeline, TaskGraph
+from .resilience import UpstreamGuard, is_http_error
+from .sheets import BatchSheetWriter, BetRowIndex, SheetIndex, UserSpreadsheets, build_service
+from .storage import GCSStorage
+from .telemetry import SLIPS, STAGE_SECONDS, count_error, metrics, stage_timer, timing_decorator, tracer
+from .tokens import TokenHealthIndex, TokenHealthScanner, check_token_health
+from .webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+HELP_TEXT = (
+    "📱 *Using Bet OCR Assistant:*\n\n"
+    "• Send screenshots of your betting slips\n"
+    "• Take screenshots directly from betting apps for best results\n"
+    "• All information will be stored in your Google Sheet\n\n"
+    "*Available commands:*\n"
+    "/start - Start the bot\n"
+    "/sheet - Access your Google Sheet\n"
+    "/stats - Your ROI, hit rate and stakes per league\n"
+    "/help - Show this help message"
+)
+
+BUTTON_HELP_TEXT = (
+    "🔍 *How to use this bot:*\n\n"
+    "1. Upload a photo of your betting slip\n"
+    "2. I'll extract the information and save it\n"
+    "3. View your betting history in Google Sheets\n\n"
+    "*Tips for best results:*\n"
+    "• Make sure the image is clear and well-lit\n"
+    "• All text should be readable\n"
+    "• Include all betting information in the image"
+)
+
+
+def build_guard(name, rate, burst, user_rate=None, user_burst=None, retries=3):
+    """UpstreamGuard for one API, every limit overridable as <NAME>_RATE, <NAME>_BURST, ..."""
+    prefix = name.upper()
+    user_rate = os.environ.get(f'{prefix}_USER_RATE', user_rate)
+    return UpstreamGuard(
+        name,
+        rate=float(os.environ.get(f'{prefix}_RATE', rate)),
+        burst=int(os.environ.get(f'{prefix}_BURST', burst)),
+        user_rate=float(user_rate) if user_rate else None,
+        user_burst=int(os.environ.get(f'{prefix}_USER_BURST', user_burst or burst)),
+        max_wait=float(os.environ.get(f'{prefix}_MAX_WAIT', 10)),
+        retries=int(os.environ.get(f'{prefix}_RETRIES', retries)),
+        failure_threshold=int(os.environ.get(f'{prefix}_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.environ.get(f'{prefix}_BREAKER_RESET', 30))
+    )
+
+
+def build_ocr_backends(registry, guard, batch_size):
+    """The OCR_BACKENDS in order, a Tesseract backend without loadable templates is left out"""
+    ocr_backends = []
+    for backend_name in os.environ.get('OCR_BACKENDS', 'gemini').split(','):
+        backend_name = backend_name.strip()
+        if backend_name == 'gemini':
+            ocr_backends.append(GeminiBackend(registry, guard, batch_size=batch_size))
+        elif backend_name == 'tesseract':
+            # The repo ships no ocr_templates.json, the only templates are the benchmark corpus's
+            # benchmarks/corpus/tesseract/templates.json. Without a file here Tesseract is left out
+            # and OCR_BACKENDS=tesseract,gemini runs Gemini alone, with only the error below to say so
+            templates_path = os.environ.get('OCR_TEMPLATES_PATH', 'ocr_templates.json')
+            try:
+                templates = SlipTemplate.load_all(templates_path)
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"Tesseract OCR backend disabled, could not load templates from {templates_path}: {e}")
+                continue
+            ocr_backends.append(TesseractBackend(
+                templates,
+                lang=os.environ.get('TESSERACT_LANG', 'eng'),
+                min_confidence=float(os.environ.get('TESSERACT_MIN_CONFIDENCE', 70)),
+                workers=int(os.environ.get('TESSERACT_WORKERS', os.cpu_count() or 2))
+            ))
+        elif backend_name:
+            raise ValueError(f"Unknown OCR backend: {backend_name}")
+    return ocr_backends
+
+
+def format_stats(summary):
+    """The /stats reply for a BetHistory summary"""
+    def money(value):
+        return f"{value:,.2f}"
+
+    def percent(value):
+        return "n/a" if value is None else f"{value * 100:.1f}%"
+
+    lines = [
+        "📈 Your betting stats\n",
+        f"Bets: {summary['bets']} ({summary['settled']} settled, {summary['bets'] - summary['settled']} open)",
+        f"Won / lost: {summary['won']} / {summary['lost']}, hit rate {percent(summary['hit_rate'])}",
+        f"Staked: {money(summary['staked'])}, returned: {money(summary['returned'])}",
+        f"Profit: {money(summary['profit'])}, ROI {percent(summary['roi'])}",
+    ]
+    if summary['leagues']:
+        lines.append("\nTop leagues by stake:")
+        for league in summary['leagues']:
+            lines.append(
+                f"• {league['league']}: {league['bets']} bets, staked {money(league['staked'])}, "
+                f"ROI {percent(league['roi'])}"
+            )
+    return "\n".join(lines)
+
+
+def sheet_link_markup(sheet_link):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("📑 Open Sheet", url=sheet_link)]])
+
+
+class SlipBot:
+    """The components shared by the handlers, built from the environment, and the Telegram handlers themselves
+
+    Each handler is a method taking (update, context) as python-telegram-bot
+    calls it, so one can be called on its own against a SlipBot built over any
+    backends. Nothing here touches the network except the config fallback, so
+    the bot can poll as soon as main() has registered its handlers. started is
+    the perf_counter() value the cold-start time is measured from.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.root_bucket_name = ROOT_BUCKET_NAME
+
+        # One guard per upstream, the defaults sit under the published per-project quotas
+        self.gemini_guard = build_guard('gemini', rate=10, burst=20, user_rate=0.5, user_burst=5, retries=2)
+        self.sheets_guard = build_guard('sheets', rate=5, burst=10, user_rate=1, user_burst=5)
+        self.drive_guard = build_guard('drive', rate=10, burst=20, user_rate=2, user_burst=5)
+        self.gcs_guard = build_guard('gcs', rate=50, burst=100)
+        self.upstream_guards = [self.gemini_guard, self.sheets_guard, self.drive_guard, self.gcs_guard]
+
+        # Shared storage layer, one client and connection pool for the whole process
+        self.gcs = GCSStorage(pool_size=int(os.environ.get('GCS_POOL_SIZE', 10)), guard=self.gcs_guard)
+
+        # 'webhook' serves Telegram updates and the OAuth callback from an embedded server, 'polling' long-polls
+        self.bot_mode = os.environ.get('BOT_MODE', 'polling')
+        self.webhook_url = os.environ.get('WEBHOOK_URL', 'https://web-production-acba3.up.railway.app').rstrip('/')
+        self.webhook_path = os.environ.get('WEBHOOK_PATH', '/telegram')
+        self.webhook_secret = os.environ.get('WEBHOOK_SECRET', '')
+
+        self.token_health = TokenHealthIndex(os.environ.get('TOKEN_HEALTH_PATH', 'token_health.db'))
+        oauth_redirect_uri = f"{self.webhook_url}/oauth-callback"
+        self.auth = GoogleAuth(
+            self.gcs, self.root_bucket_name, self.token_health,
+            redirect_uri=oauth_redirect_uri,
+            link_url=os.environ.get('REDIRECT_URL', oauth_redirect_uri),
+            # Only our own callback checks the signature, so the state is signed in webhook mode
+            state_secret=self.webhook_secret if self.bot_mode == 'webhook' else None,
+            client_object=os.environ.get('OAUTH_CLIENT_OBJECT', 'client_secret.json'),
+            max_size=int(os.environ.get('CRED_CACHE_SIZE', 1000)),
+            ttl=int(os.environ.get('CRED_CACHE_TTL', 3600)),
+            refresh_margin=int(os.environ.get('CRED_REFRESH_MARGIN', 300)),
+            refresh_interval=int(os.environ.get('CRED_REFRESH_INTERVAL', 60))
+        )
+
+        # Environment first, then a local config file, the bucket's config.txt only for what is still missing
+        config = load_config(lambda: self.auth.download_from_gcs(CONFIG_OBJECT)[1])
+        self.token = config['telegram_bot_token']
+
+        # 'json' asks Gemini for schema-checked JSON, 'text' keeps the "Field: value" layout
+        ocr_output_mode = os.environ.get('OCR_OUTPUT_MODE', 'json')
+
+        # Configured once, each worker thread gets its own model on first use
+        self.gemini_registry = GeminiModelRegistry(
+            api_key=config['google_gemini_api_key'],
+            per_thread=os.environ.get('GEMINI_MODEL_PER_THREAD', '1') == '1',
+            output_mode=ocr_output_mode
+        )
+
+        # Runs before OCR on cache misses, Gemini cost grows with image resolution
+        self.image_preprocessor = ImagePreprocessor(
+            max_dimension=int(os.environ.get('PREPROCESS_MAX_DIMENSION', 1600)),
+            grayscale=os.environ.get('PREPROCESS_GRAYSCALE', '1') == '1',
+            crop_margins=os.environ.get('PREPROCESS_CROP', '1') == '1',
+            jpeg_quality=int(os.environ.get('PREPROCESS_JPEG_QUALITY', 80))
+        ) if os.environ.get('PREPROCESS_ENABLED', '1') == '1' else None
+
+        # Resent screenshots reuse the stored OCR text instead of paying for Gemini again
+        self.ocr_cache = OCRResultCache(
+            os.environ.get('OCR_CACHE_PATH', 'ocr_cache.db'),
+            memory_size=int(os.environ.get('OCR_CACHE_MEMORY_SIZE', 256)),
+            phash_distance=int(os.environ.get('OCR_CACHE_PHASH_DISTANCE', 0))
+        )
+        # 'skip' drops the write for a slip the user already recorded, 'flag' writes it and warns
+        self.duplicate_mode = os.environ.get('OCR_DUPLICATE_MODE', 'skip')
+
+        # Every row written to a sheet is mirrored here, /stats reads only this
+        self.bet_history = BetHistory(os.environ.get('BET_HISTORY_PATH', 'bet_history.db'))
+
+        # Backends tried in order, each slip goes to the next one when a backend declines it or its fields don't add up
+        self.gemini_batch_size = int(os.environ.get('ALBUM_MAX_IMAGES', 10))
+        self.ocr_cascade = OCRCascade(build_ocr_backends(self.gemini_registry, self.gemini_guard, self.gemini_batch_size))
+
+        self.token_scanner = TokenHealthScanner(
+            self.gcs, self.root_bucket_name,
+            partial(
+                check_token_health, storage=self.gcs, bucket_name=self.root_bucket_name, index=self.token_health,
+                refresh=self.auth.refresh_user_credentials, revoke=self.auth.revoke_user,
+                cache=self.auth.credential_cache,
+                refresh_margin=int(os.environ.get('TOKEN_SCAN_REFRESH_MARGIN', 1800))
+            ),
+            workers=int(os.environ.get('TOKEN_SCAN_WORKERS', 8)),
+            page_size=int(os.environ.get('TOKEN_SCAN_PAGE_SIZE', 500)),
+            interval=int(os.environ.get('TOKEN_SCAN_INTERVAL', 3600))
+        )
+
+        # Per-user spreadsheet ID and row cursor, saves the Drive search and sheet scan per slip
+        self.sheet_index = SheetIndex(
+            os.environ.get('SHEET_INDEX_PATH', 'sheet_index.json'),
+            gcs=self.gcs if os.environ.get('SHEET_INDEX_GCS', '1') == '1' else None,
+            bucket_name=self.root_bucket_name
+        )
+
+        # Where each bet ID sits in its user's sheet, a re-sent or settled slip updates that row
+        self.bet_rows = BetRowIndex(os.environ.get('BET_ROW_INDEX_PATH', 'bet_rows.db'))
+
+        self.user_sheets = UserSpreadsheets(self.sheet_index, self.bet_rows)
+
+        # Rows from consecutive slips of one user go out in a single append
+        # The writer does its own retrying, so the guard only limits and trips the breaker
+        self.sheet_writer = BatchSheetWriter(
+            lambda user_id, rows: self.sheets_guard.call(self.write_user_rows, user_id, rows, user_id=user_id, retries=0),
+            max_rows=int(os.environ.get('SHEET_BATCH_ROWS', 10)),
+            max_delay=int(os.environ.get('SHEET_BATCH_MS', 1000)) / 1000,
+            flush_workers=int(os.environ.get('SHEET_FLUSH_WORKERS', 4)),
+            max_retries=int(os.environ.get('SHEET_WRITE_RETRIES', 5))
+        )
+
+        # Credentials and the spreadsheet don't depend on the OCR result, so they are prepared
+        # alongside the download and Gemini call and joined before the row is queued
+        self.speculative_prep = os.environ.get('SPECULATIVE_PREP', '1') == '1'
+        self.prep_timeout = float(os.environ.get('SHEET_PREP_TIMEOUT', 30))
+        self.prep_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('SHEET_PREP_WORKERS', 4)), thread_name_prefix="sheet-prep"
+        )
+
+        # Each slip's span tree is appended to TRACE_PATH, benchmarks/trace_report.py prints the slowest
+        tracer.configure(os.environ.get('TRACE_PATH', 'traces.jsonl'), float(os.environ.get('TRACE_SAMPLE_RATE', 1)))
+
+        # Each slip's progress is journaled so a restart resumes it instead of losing paid OCR work
+        self.job_journal = JobJournal(
+            os.environ.get('JOB_JOURNAL_PATH', 'jobs.db'),
+            retention=int(os.environ.get('JOB_JOURNAL_RETENTION', 86400))
+        ) if os.environ.get('JOB_JOURNAL_ENABLED', '1') == '1' else None
+
+        # 'memory' downloads straight into a per-worker buffer, 'disk' keeps the temp file path
+        self.ingest_mode = os.environ.get('INGEST_MODE', 'memory')
+        self.max_image_bytes = int(os.environ.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+        self.download_buffers = threading.local()
+
+        self.ocr_stage = OCRStage(
+            self.ocr_cache, self.ocr_cascade, self.preprocess_image, self.gemini_guard,
+            resubmit=self.submit_slips, finish=self.finish_slip, notify=self.notify_slip, journal=self.journal
+        )
+        self.sheet_stage = SheetStage(
+            self.ocr_cache, self.sheet_writer, self.do_values_extraction, self.report_sheet_result,
+            self.get_sheet_link, self.join_sheet_prep,
+            journal=self.journal, record_history=self.record_history, duplicate_mode=self.duplicate_mode
+        )
+
+        # Download, OCR and sheet writes each get their own pool, so slow Gemini calls
+        # never occupy the dispatcher threads that answer commands
+        self.slip_pipeline = StagedPipeline(
+            [
+                ("download", self.download_stage, int(os.environ.get('PIPELINE_DOWNLOAD_WORKERS', 4))),
+                ("ocr", self.ocr_stage, int(os.environ.get('PIPELINE_OCR_WORKERS', 8))),
+                ("sheet", self.sheet_stage, int(os.environ.get('PIPELINE_SHEET_WORKERS', 4))),
+            ],
+            queue_size=int(os.environ.get('PIPELINE_QUEUE_SIZE', 100)),
+            on_error=self.pipeline_error
+        )
+        self.submit_timeout = float(os.environ.get('PIPELINE_SUBMIT_TIMEOUT', 2))
+
+        # 'threads' uses the staged worker pipeline; 'async' runs slips as tasks on an event loop, but its SDK
+        # calls still block executor threads, so it is no faster yet (see AsyncSlipRuntime)
+        self.runtime_mode = os.environ.get('BOT_RUNTIME', 'threads')
+        self.async_runtime = AsyncSlipRuntime(
+            self.prepare_slips_async,
+            self.commit_slips_async,
+            limits={
+                "telegram": int(os.environ.get('ASYNC_TELEGRAM_CONCURRENCY', 16)),
+                "gemini": int(os.environ.get('ASYNC_GEMINI_CONCURRENCY', 16)),
+                "sheets": int(os.environ.get('ASYNC_SHEETS_CONCURRENCY', 4)),
+                "gcs": int(os.environ.get('ASYNC_GCS_CONCURRENCY', 8)),
+            },
+            max_in_flight=int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 500)),
+            http_fetch=os.environ.get('ASYNC_HTTP_FETCH', '1') == '1'
+        )
+
+        # Album photos arrive as separate updates, gather them so they share one OCR request
+        self.album_collector = AlbumCollector(
+            self.submit_slips,
+            window=int(os.environ.get('ALBUM_WINDOW_MS', 1500)) / 1000,
+            max_items=self.gemini_batch_size
+        )
+
+        self.startup_budget = float(os.environ.get('STARTUP_BUDGET_SECONDS', 5))
+        self.startup_seconds = metrics.gauge("bot_startup_seconds", "Seconds from process start until updates were accepted")
+        self.register_metrics()
+
+    def upstream_stats(self):
+        return {guard.name: guard.stats() for guard in self.upstream_guards}
+
+    @timing_decorator
+    def preprocess_image(self, image_bytes):
+        if self.image_preprocessor is None:
+            return image_bytes, detect_mime_type(image_bytes)
+        return self.image_preprocessor.process(image_bytes)
+
+    @staticmethod
+    @timing_decorator
+    def do_values_extraction(text_from_ocr):
+        """Parse a JSON-mode response or text-mode output into a BetSlip"""
+        with stage_timer("extraction"):
+            return parse_ocr_output(text_from_ocr)
+
+    @timing_decorator
+    def write_user_rows(self, user_id, rows):
+        """Write rows to the user's sheet, updating bets it already holds, resolving the spreadsheet if needed"""
+        with stage_timer("sheet_write"):
+            return self.user_sheets.write_rows(self.auth.do_gsheet_authentication(user_id), user_id, rows)
+
+    @timing_decorator
+    def prepare_sheet(self, user_id, creds):
+        """Resolve the user's spreadsheet and next row if the index doesn't have them yet"""
+        entry = self.sheet_index.get(user_id)
+        if entry is None and creds is not None:
+            entry = self.sheets_guard.call(
+                self.user_sheets.ensure_spreadsheet, build_service("sheets", "v4", creds), creds, user_id,
+                user_id=user_id, retries=0
+            )
+        return entry
+
+    def start_sheet_prep(self, jobs):
+        """Start the sheet branch for one user's jobs, shared by all of them and traced under the first"""
+        fresh = [job for job in jobs if job.prep is None]
+        if not self.speculative_prep or not fresh:
+            return
+        user_id = fresh[0].user_id
+        prep = TaskGraph(self.prep_executor, owners=len(fresh))
+        with tracer.activate(fresh[0].trace):
+            prep.add("credentials", partial(self.auth.do_gsheet_authentication, user_id))
+            prep.add("sheet", partial(self.prepare_sheet, user_id), "credentials")
+        for job in fresh:
+            job.prep = prep
+
+    def join_sheet_prep(self, job):
+        """Wait for the job's sheet branch, the write itself redoes anything that failed or timed out"""
+        if job.prep is not None:
+            with stage_timer("prep_join"):
+                if not job.prep.wait(self.prep_timeout):
+                    logger.info(f"Sheet preparation for user {job.user_id} still running after {self.prep_timeout} s")
+
+    def record_history(self, user_id, slip):
+        """Mirror a written row into the local bet history, which never fails the slip"""
+        try:
+            with stage_timer("history_record"):
+                self.bet_history.record(user_id, slip)
+        except Exception as e:
+            count_error("history", e)
+            logger.error(f"Could not record bet history for user {user_id}: {e}")
+
+    @timing_decorator
+    def backfill_history(self, user_id):
+        """Rebuild a user's local history from their sheet, None when they have no known sheet"""
+        entry = self.sheet_index.get(user_id)
+        if entry is None:
+            return None
+        creds = self.auth.do_gsheet_authentication(user_id)
+        service = build_service("sheets", "v4", creds)
+        sheet_data = self.sheets_guard.call(
+            service.spreadsheets().values().get(spreadsheetId=entry['spreadsheet_id'], range="Sheet1!A:M").execute,
+            user_id=user_id
+        )
+        return self.bet_history.rebuild(user_id, sheet_data.get('values', []))
+
+    def get_sheet_link(self, user_id):
+        """Get the Google Sheet link for a user"""
+        entry = self.sheet_index.get(user_id)
+        if entry is not None:
+            return f"https://docs.google.com/spreadsheets/d/{entry['spreadsheet_id']}"
+        try:
+            creds = self.auth.do_gsheet_authentication(user_id)
+            service_drive = build_service("drive", "v3", creds)
+            title = f"Track_record_{user_id}"
+
+            spreadsheets = self.drive_guard.call(service_drive.files().list().execute, user_id=user_id)
+            existing_spreadsheet = next((s for s in spreadsheets.get("files", []) if s["name"] == title), None)
+
+            if not existing_spreadsheet:
+                return None
+
+            spreadsheet_id = existing_spreadsheet["id"]
+            return f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+        except Exception as e:
+            logger.error(f"Error getting sheet link for user {user_id}: {e}")
+            return None
+
+    def connect_markup(self, user_id, label="🔗 Connect Google Account"):
+        return InlineKeyboardMarkup([[InlineKeyboardButton(label, url=self.auth.generate_google_auth_url(user_id))]])
+
+    def reauth_command(self, update: Update, context: CallbackContext) -> None:
+        """Force re-authentication with Google"""
+        user_id = update.effective_user.id
+
+        # Delete any existing token, the next one stored is a fresh grant
+        try:
+            self.auth.delete_user_token(user_id)
+        except Exception as e:
+            logger.error(f"Error deleting token during reauth for user {user_id}: {e}")
+        self.token_health.clear(user_id)
+
+        update.message.reply_text(
+            "To reconnect your Google account, please click the button below:",
+            reply_markup=self.connect_markup(user_id, "Connect Google Account")
+        )
+
+    def handle_button(self, update: Update, context: CallbackContext):
+        """Handle button callbacks"""
+        query = update.callback_query
+        query.answer()
+        user_id = query.from_user.id
+        data = query.data
+
+        if data == 'upload':
+            query.message.reply_text(
+                "📸 Please send me a screenshot of your betting slip.\n"
+                "💡 Tip: Screenshots from betting apps work best!"
+            )
+
+        elif data == 'view_sheet':
+            sheet_link = self.get_sheet_link(user_id)
+            if sheet_link:
+                query.message.reply_text("📊 Your betting records:", reply_markup=sheet_link_markup(sheet_link))
+            else:
+                query.message.reply_text("No sheet found. Please upload a betting slip first.")
+
+        elif data == 'help':
+            query.message.reply_text(BUTTON_HELP_TEXT, parse_mode='Markdown')
+
+    def stats_command(self, update: Update, context: CallbackContext):
+        """Handle /stats from the local bet history; '/stats rebuild' reloads it from the sheet first"""
+        user_id = update.message.from_user.id
+        rebuild = bool(getattr(context, 'args', None)) and context.args[0].lower() == 'rebuild'
+        if rebuild or not self.bet_history.has_bets(user_id):
+            try:
+                self.backfill_history(user_id)
+            except Exception as e:
+                logger.error(f"Could not rebuild bet history for user {user_id}: {e}")
+                if rebuild:
+                    update.message.reply_text(f"❌ Could not read your sheet: {str(e)}\n\nPlease try again later.")
+                    return
+
+        with stage_timer("stats"):
+            summary = self.bet_history.summary(user_id)
+        if summary is None:
+            update.message.reply_text("No bets recorded yet. Send me a betting slip to get started.")
+            return
+        update.message.reply_text(format_stats(summary))
+
+    def sheet_command(self, update: Update, context: CallbackContext):
+        """Handle /sheet command"""
+        user_id = update.message.from_user.id
+        sheet_link = self.get_sheet_link(user_id)
+        if sheet_link:
+            update.message.reply_text("📊 Your betting records:", reply_markup=sheet_link_markup(sheet_link))
+        else:
+            update.message.reply_text("No sheet found. Please upload a betting slip first.")
+
+    def prompt_reauth(self, processing_msg, user_id):
+        """Tell the user their Google authorization expired and drop the invalid token"""
+        self.auth.invalidate_token_cache(user_id)
+
+        processing_msg.edit_text(
+            "⚠️ Your Google authorization has expired.\n\n"
+            "Please reconnect your account to continue:",
+            reply_markup=self.connect_markup(user_id, "🔄 Reconnect Google Account")
+        )
+
+        # Delete the invalid token
+        try:
+            self.auth.delete_user_token(user_id)
+        except Exception:
+            logger.error("Failed to delete invalid token")
+
+    def journal(self, job, state, outcome=None):
+        """Record a stage the job has completed, a journal failure never fails the slip"""
+        if self.job_journal is None:
+            return
+        try:
+            if state == "received":
+                self.job_journal.received(job)
+            elif state == "finished":
+                self.job_journal.finish(job, outcome)
+            else:
+                self.job_journal.advance(job, state)
+        except Exception as e:
+            count_error("journal", e)
+            logger.error(f"Could not journal slip state {state} for user {job.user_id}: {e}")
+
+    def finish_slip(self, job, outcome, error=None):
+        """Count a finished slip and export its trace"""
+        SLIPS.inc(outcome=outcome)
+        self.journal(job, "finished", outcome)
+        if job.prep is not None:
+            # The last slip sharing the sheet branch to give up cancels what hasn't started
+            job.prep.release()
+        tracer.finish(job.trace, outcome, error)
+
+    def notify_slip(self, job, text):
+        """Edit a slip's processing message once its outcome is recorded, a failed edit is only logged"""
+        try:
+            job.processing_msg.edit_text(text)
+        except Exception as e:
+            logger.error(f"Could not update the processing message for user {job.user_id}: {e}")
+
+    def check_image_size(self, file_size):
+        if file_size and file_size > self.max_image_bytes:
+            raise ValueError(
+                f"Image is {file_size / 1024 / 1024:.1f} MB, the limit is {self.max_image_bytes / 1024 / 1024:.1f} MB"
+            )
+
+    def download_to_memory(self, file_obj):
+        """Download a Telegram file into this worker's reusable buffer and return one bytes copy"""
+        buffer = getattr(self.download_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = self.download_buffers.buffer = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        file_obj.download(out=buffer)
+        self.check_image_size(buffer.tell())
+        return buffer.getvalue()
+
+    def download_slip(self, job):
+        """Fetch the Telegram file for a slip and load its bytes"""
+        if job.image_bytes is not None or job.ocr_text is not None:
+            # Deferred during an OCR outage the bytes are still in memory, a replayed job may be past OCR
+            return True
+        try:
+            with stage_timer("get_file"):
+                file_obj = job.bot.get_file(job.file_id)
+
+            self.check_image_size(file_obj.file_size)
+
+            with stage_timer("download"):
+                if self.ingest_mode == 'memory':
+                    job.image_bytes = self.download_to_memory(file_obj)
+                else:
+                    file_path = file_obj.download()
+                    try:
+                        job.image_bytes = Path(file_path).read_bytes()
+                    finally:
+                        Path(file_path).unlink()
+            self.journal(job, "downloaded")
+            return True
+
+        except Exception as file_error:
+            count_error("slip", file_error)
+            job.processing_msg.edit_text(
+                f"❌ Error processing file: {str(file_error)}\n\n"
+                "Please try again with a different image format."
+            )
+            self.finish_slip(job, "error", file_error)
+            return False
+
+    def download_stage(self, jobs):
+        downloaded = []
+        for job in jobs:
+            with tracer.activate(job.trace):
+                if self.download_slip(job):
+                    downloaded.append(job)
+        jobs[:] = downloaded
+        return bool(jobs)
+
+    def report_sheet_result(self, job, sheet_link, error, is_duplicate):
+        """Edit the processing message once the slip's row is committed or has failed"""
+        user_id = job.user_id
+        processing_msg = job.processing_msg
+        if error is not None:
+            count_error("slip", error)
+            self.finish_slip(job, "error", error)
+        else:
+            self.finish_slip(job, "duplicate" if is_duplicate else "saved")
+        STAGE_SECONDS.observe(time.time() - job.created, stage="total")
+        try:
+            if error is not None:
+                error_message = str(error)
+                if isinstance(error, SlipValidationError):
+                    processing_msg.edit_text(
+                        f"❌ Could not read the betting slip: {error_message}\n\n"
+                        "Please try again with a clearer image."
+                    )
+                elif "invalid_grant" in error_message:
+                    self.prompt_reauth(processing_msg, user_id)
+                elif is_http_error(error):
+                    logger.error(f"Sheet update error: {error}")
+                    processing_msg.edit_text(
+                        f"❌ Error during sheet update: Error: {error_message}\n\n"
+                        "Please try again later."
+                    )
+                else:
+                    processing_msg.edit_text(
+                        f"❌ Error updating sheet: {error_message}\n\n"
+                        "Please try again later."
+                    )
+            else:
+                if job.digest is not None:
+                    self.ocr_cache.mark_written(job.digest, user_id)
+                keyboard = [[InlineKeyboardButton("📑 View Sheet", url=sheet_link)]]
+
+                if is_duplicate and self.duplicate_mode == 'skip':
+                    status_text = "ℹ️ This betting slip was already recorded, so it was not added again.\n\n"
+                elif is_duplicate or job.similar_to is not None:
+                    status_text = "⚠️ Betting slip saved, but it looks like one you sent before.\n\n"
+                else:
+                    status_text = "✅ Betting slip processed successfully!\n\n"
+                processing_msg.edit_text(
+                    status_text +
+                    "📌 You can send more betting slips directly anytime!",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+        except Exception as e:
+            logger.error(f"Could not report sheet result to user {user_id}: {e}")
+
+    def pipeline_error(self, jobs, stage_name, error):
+        count_error(stage_name, error)
+        for job in jobs:
+            self.finish_slip(job, "error", error)
+            job.processing_msg.edit_text(
+                f"❌ Unexpected error while processing your slip: {str(error)}\n\n"
+                "Please try again later."
+            )
+
+    async def download_slip_async(self, job):
+        """Fetch a slip's Telegram file without holding a thread during the transfer"""
+        if job.image_bytes is not None or job.ocr_text is not None:
+            return True
+        runtime = self.async_runtime
+        with tracer.activate(job.trace):
+            try:
+                with stage_timer("get_file"):
+                    file_obj = await runtime.call("telegram", job.bot.get_file, job.file_id)
+                self.check_image_size(file_obj.file_size)
+                with stage_timer("download"):
+                    if runtime.can_fetch:
+                        job.image_bytes = await runtime.fetch(file_obj.file_path, self.max_image_bytes)
+                    else:
+                        job.image_bytes = await runtime.call("telegram", self.download_to_memory, file_obj)
+                self.journal(job, "downloaded")
+                return True
+
+            except Exception as file_error:
+                count_error("slip", file_error)
+                await runtime.call(
+                    "telegram",
+                    job.processing_msg.edit_text,
+                    f"❌ Error processing file: {str(file_error)}\n\n"
+                    "Please try again with a different image format."
+                )
+                self.finish_slip(job, "error", file_error)
+                return False
+
+    async def prepare_slips_async(self, jobs):
+        downloaded = await asyncio.gather(*(self.download_slip_async(job) for job in jobs))
+        jobs[:] = [job for job, ok in zip(jobs, downloaded) if ok]
+        return bool(jobs) and await self.async_runtime.call("gemini", self.ocr_stage, jobs)
+
+    async def commit_slips_async(self, jobs):
+        await self.async_runtime.call("sheets", self.sheet_stage, jobs)
+
+    def pipeline_stats(self):
+        return self.async_runtime.stats() if self.runtime_mode == 'async' else self.slip_pipeline.stats()
+
+    def register_metrics(self):
+        """Scrape-time views of the state the components already keep"""
+        metrics.gauge(
+            "bot_queue_depth", "Slips waiting in each pipeline stage queue", ("stage",),
+            callback=lambda: {(stage,): depth for stage, depth in self.slip_pipeline.stats()["queue_depth"].items()}
+        )
+        metrics.gauge("bot_in_flight_jobs", "Slip jobs accepted and not yet finished", callback=lambda: {(): self.pipeline_stats()["in_flight"]})
+        metrics.gauge("bot_sheet_pending_rows", "Rows waiting in the write-behind buffer", callback=lambda: {(): self.sheet_writer.pending_rows()})
+        metrics.gauge(
+            "bot_upstream_breaker_state", "Circuit breaker state per upstream (0 closed, 1 half open, 2 open)", ("upstream",),
+            callback=lambda: {
+                (guard.name,): {"closed": 0, "half_open": 1, "open": 2}[guard.breaker.state]
+                for guard in self.upstream_guards
+            }
+        )
+        metrics.gauge(
+            "bot_upstream_tokens", "Tokens left in each upstream's global bucket", ("upstream",),
+            callback=lambda: {(name,): stats["tokens"] for name, stats in self.upstream_stats().items()}
+        )
+        metrics.counter(
+            "bot_upstream_events_total", "Upstream guard calls, failures, retries, throttling and short circuits", ("upstream", "event"),
+            callback=lambda: {
+                (name, event): value
+                for name, stats in self.upstream_stats().items()
+                for event, value in stats.items()
+                if event in ("calls", "failures", "retries", "throttled", "rate_limited", "short_circuited", "deferred")
+            }
+        )
+        metrics.counter(
+            "bot_ocr_cache_lookups_total", "OCR cache lookups by result", ("result",),
+            callback=lambda: {(result,): count for result, count in self.ocr_cache.stats().items() if result != "hit_rate"}
+        )
+        metrics.counter(
+            "bot_ocr_backend_slips_total", "Slips each OCR backend accepted, rejected, declined or failed", ("backend", "result"),
+            callback=lambda: {
+                (backend, result): stat[result]
+                for backend, stat in self.ocr_cascade.stats().items()
+                for result in OCRCascade.RESULTS
+            }
+        )
+        metrics.counter(
+            "bot_ocr_backend_seconds_total", "Time spent in each OCR backend", ("backend",),
+            callback=lambda: {(backend,): stat["seconds"] for backend, stat in self.ocr_cascade.stats().items()}
+        )
+        metrics.counter(
+            "bot_ocr_backend_calls_total", "Calls into each OCR backend", ("backend",),
+            callback=lambda: {(backend,): stat["calls"] for backend, stat in self.ocr_cascade.stats().items()}
+        )
+        metrics.counter(
+            "bot_gcs_calls_total", "GCS calls per operation", ("operation",),
+            callback=lambda: {(operation,): stat["calls"] for operation, stat in self.gcs.stats().items()}
+        )
+        metrics.counter(
+            "bot_token_scan_results_total", "Stored tokens checked by the token scan, by result", ("result",),
+            callback=lambda: {
+                (result,): count for result, count in self.token_scanner.totals.items() if result != "scanned"
+            }
+        )
+        metrics.gauge("bot_revoked_users", "Users whose Google token was revoked", callback=lambda: {(): len(self.token_health)})
+        metrics.counter(
+            "bot_gcs_bytes_total", "GCS bytes transferred per operation", ("operation",),
+            callback=lambda: {(operation,): stat["bytes"] for operation, stat in self.gcs.stats().items()}
+        )
+
+    def metrics_route(self, query):
+        return 200, "text/plain; version=0.0.4", metrics.render(), {}
+
+    def submit_slips(self, jobs):
+        # Started first so the branch is attached before any stage can finish a job
+        self.start_sheet_prep(jobs)
+        try:
+            if self.runtime_mode == 'async':
+                self.async_runtime.submit(jobs)
+            else:
+                self.slip_pipeline.submit(jobs, timeout=self.submit_timeout)
+        except queue.Full:
+            logger.info(f'Pipeline full, rejected {len(jobs)} slips: {self.pipeline_stats()}')
+            for job in jobs:
+                self.finish_slip(job, "rejected")
+                job.processing_msg.edit_text(
+                    "⏳ I'm processing a lot of betting slips right now.\n\n"
+                    "Please send this one again in a minute."
+                )
+
+    def replay_journal(self, bot, entries):
+        """Resume slips a previous run left unfinished, each from the last stage it completed"""
+        for entry in entries:
+            processing_msg = JournaledMessage(bot, entry['chat_id'], entry['message_id'])
+            root = tracer.start_trace("slip", user_id=entry['user_id'], replayed_from=entry['state'])
+            job = SlipJob(entry['user_id'], bot, entry['file_id'], processing_msg, trace=root)
+            job.journal_id = entry['id']
+            job.created = entry['created']
+            if entry['state'] in ('ocr_done', 'written'):
+                job.digest, job.ocr_text = entry['digest'], entry['ocr_text']
+            try:
+                with tracer.activate(root):
+                    if entry['state'] == 'written':
+                        # Only the reply to the user was lost
+                        self.report_sheet_result(job, self.get_sheet_link(job.user_id), None, False)
+                    else:
+                        self.submit_slips([job])
+            except Exception as e:
+                logger.error(f"Could not replay journaled slip {entry['id']}: {e}")
+                self.finish_slip(job, "error", e)
+        logger.info(f"Replayed {len(entries)} unfinished slips from the job journal")
+
+    @timing_decorator
+    def image_ocr(self, update: Update, context: CallbackContext):
+        """Acknowledge an incoming image and queue it for OCR processing"""
+        user_id = update.message.from_user.id
+        # The slip's span tree starts here, the job carries it and the last stage exports it
+        root = tracer.start_trace("slip", user_id=user_id)
+        with tracer.activate(root):
+            try:
+                with stage_timer("auth_check"):
+                    authenticated = self.auth.check_if_authenticated(user_id)
+                if not authenticated:
+                    update.message.reply_text(
+                        "You need to connect your Google account first to process bet slips.",
+                        reply_markup=self.connect_markup(user_id)
+                    )
+                    SLIPS.inc(outcome="unauthenticated")
+                    tracer.finish(root, "unauthenticated")
+                    return
+
+                if update.message.photo or update.message.document:
+                    # Send processing message, the pipeline edits it when the job finishes
+                    processing_msg = update.message.reply_text("🔄 Processing your betting slip...")
+
+                    if update.message.photo:
+                        file_id = update.message.photo[-1].file_id
+                        file_size = update.message.photo[-1].file_size
+                    else:  # document
+                        file_id = update.message.document.file_id
+                        file_size = update.message.document.file_size
+
+                    try:
+                        self.check_image_size(file_size)
+                    except ValueError as size_error:
+                        processing_msg.edit_text(
+                            f"❌ Error processing file: {str(size_error)}\n\n"
+                            "Please send a smaller screenshot."
+                        )
+                        tracer.finish(root, "too_large", size_error)
+                        return
+
+                    job = SlipJob(user_id, context.bot, file_id, processing_msg, trace=root)
+                    self.journal(job, "received")
+                    if update.message.media_group_id:
+                        self.album_collector.add(update.message.media_group_id, job)
+                    else:
+                        self.submit_slips([job])
+                else:
+                    update.message.reply_text("Please send me an image or document containing your betting slip.")
+                    tracer.finish(root, "no_image")
+            except Exception as e:
+                tracer.finish(root, "error", e)
+                raise
+
+    async def image_ocr_async(self, update: Update, context: CallbackContext):
+        """Event loop version of image_ocr, blocking calls go through the runtime's upstream limits"""
+        user_id = update.message.from_user.id
+        message = update.message
+        runtime = self.async_runtime
+
+        root = tracer.start_trace("slip", user_id=user_id)
+        with tracer.activate(root):
+            try:
+                with stage_timer("auth_check"):
+                    authenticated = await runtime.call("gcs", self.auth.check_if_authenticated, user_id)
+                if not authenticated:
+                    await runtime.call(
+                        "telegram",
+                        message.reply_text,
+                        "You need to connect your Google account first to process bet slips.",
+                        reply_markup=self.connect_markup(user_id)
+                    )
+                    SLIPS.inc(outcome="unauthenticated")
+                    tracer.finish(root, "unauthenticated")
+                    return
+
+                if not (message.photo or message.document):
+                    await runtime.call(
+                        "telegram", message.reply_text, "Please send me an image or document containing your betting slip."
+                    )
+                    tracer.finish(root, "no_image")
+                    return
+
+                processing_msg = await runtime.call("telegram", message.reply_text, "🔄 Processing your betting slip...")
+                attachment = message.photo[-1] if message.photo else message.document
+                try:
+                    self.check_image_size(attachment.file_size)
+                except ValueError as size_error:
+                    await runtime.call(
+                        "telegram",
+                        processing_msg.edit_text,
+                        f"❌ Error processing file: {str(size_error)}\n\n"
+                        "Please send a smaller screenshot."
+                    )
+                    tracer.finish(root, "too_large", size_error)
+                    return
+
+                job = SlipJob(user_id, context.bot, attachment.file_id, processing_msg, trace=root)
+                self.journal(job, "received")
+                if message.media_group_id:
+                    self.album_collector.add(message.media_group_id, job)
+                else:
+                    self.submit_slips([job])
+            except Exception as e:
+                tracer.finish(root, "error", e)
+                raise
+
+    def image_handler(self, update: Update, context: CallbackContext):
+        if self.runtime_mode == 'async':
+            # Hand the update to the event loop so the dispatcher thread is free straight away
+            self.async_runtime.spawn(self.image_ocr_async(update, context))
+        else:
+            self.image_ocr(update, context)
+
+    def start(self, update: Update, context: CallbackContext):
+        """Handle /start command and authentication flow"""
+        user_id = update.message.from_user.id
+
+        if not self.auth.check_if_authenticated(user_id):
+            welcome_text = (
+                "👋 Welcome to Bet OCR Assistant!\n\n"
+                "To get started, I need to connect to your Google account.\n"
+                "This allows me to securely store your data in Google Sheets."
+            )
+            update.message.reply_text(welcome_text, reply_markup=self.connect_markup(user_id))
+        else:
+            welcome_text = (
+                "👋 Welcome to Bet OCR Assistant!\n\n"
+                "📸 Send me screenshots of your betting slips to track your bets.\n"
+                "I'll extract the data and organize it in Google Sheets.\n\n"
+                "💡 Tip: Clear, well-lit screenshots work best!"
+            )
+            keyboard = [
+                [
+                    InlineKeyboardButton("📸 Upload Bet Slip", callback_data='upload'),
+                    InlineKeyboardButton("📑 View Sheet", callback_data='view_sheet')
+                ],
+                [
+                    InlineKeyboardButton("❔ Help", callback_data='help')
+                ]
+            ]
+            update.message.reply_text(
+                welcome_text,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+
+    def help_command(self, update: Update, context: CallbackContext):
+        """Handle the /help command"""
+        update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
+
+    def set_commands(self, updater):
+        """Set up bot commands for menu"""
+        commands = [
+            BotCommand("start", "Start the bot"),
+            BotCommand("help", "Get help using the bot"),
+            BotCommand("sheet", "Get your Google Sheet link"),
+            BotCommand("stats", "Show your betting stats"),
+            BotCommand("reauth", "Reconnect your Google account")
+        ]
+        try:
+            updater.bot.set_my_commands(commands)
+        except Exception as e:
+            logger.error(f"Could not set bot commands: {e}")
+
+    def register_webhook(self):
+        """Point Telegram at this deployment; the raw API call is used because PTB 13 lacks secret_token"""
+        import requests
+
+        response = requests.post(
+            f"https://api.telegram.org/bot{self.token}/setWebhook",
+            json={
+                "url": f"{self.webhook_url}{self.webhook_path}",
+                "secret_token": self.webhook_secret,
+                "max_connections": int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40)),
+                "allowed_updates": ["message", "callback_query"]
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        logger.info(f"Webhook registered at {self.webhook_url}{self.webhook_path}")
+
+    def run_webhook(self, updater):
+        """Serve updates and the OAuth callback until SIGINT or SIGTERM"""
+        if not self.webhook_secret:
+            raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+        dp = updater.dispatcher
+        server = WebhookServer(
+            os.environ.get('WEBHOOK_HOST', '0.0.0.0'),
+            int(os.environ.get('PORT', 8080)),
+            self.webhook_path,
+            self.webhook_secret,
+            on_update=lambda data: dp.process_update(Update.de_json(data, updater.bot)),
+            routes={
+                '/oauth-callback': self.auth.oauth_callback,
+                '/metrics': self.metrics_route,
+                '/upstreams': lambda query: (200, "application/json", json.dumps(self.upstream_stats()), {})
+            },
+            workers=int(os.environ.get('WEBHOOK_WORKERS', 8)),
+            max_pending=int(os.environ.get('WEBHOOK_MAX_PENDING', 1000))
+        )
+        server.start()
+        self.report_ready()
+        # Replicas share the URL, so only one of them needs to register it
+        if os.environ.get('WEBHOOK_REGISTER', '1') == '1':
+            self.register_webhook()
+        print(f"🤖 Bot is serving webhooks on port {server.port}...")
+
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+        stop_event.wait()
+        server.stop()
+        logger.info(f'Webhook stats: {server.stats()}')
+
+    def report_ready(self):
+        """Record how long this replica took to start taking updates, warning when over budget"""
+        elapsed = time.perf_counter() - self.started
+        self.startup_seconds.set(elapsed)
+        if elapsed > self.startup_budget:
+            logger.warning(f"Cold start took {elapsed:.2f} s, over the {self.startup_budget:.1f} s budget")
+        else:
+            logger.info(f"Cold start took {elapsed:.2f} s")
+
+    def add_handlers(self, dispatcher):
+        """Register the command, button and slip handlers on a dispatcher"""
+        dispatcher.add_handler(CommandHandler("start", self.start))
+        dispatcher.add_handler(CommandHandler("help", self.help_command))
+        dispatcher.add_handler(CommandHandler("sheet", self.sheet_command))
+        dispatcher.add_handler(CommandHandler("stats", self.stats_command))
+        dispatcher.add_handler(CommandHandler("reauth", self.reauth_command))
+        dispatcher.add_handler(CallbackQueryHandler(self.handle_button))
+        dispatcher.add_handler(MessageHandler(Filters.photo | Filters.document, self.image_handler))
+
+    def main(self):
+        """Main function to run the bot"""
+        # Pipeline workers edit messages too, so size the Telegram connection pool for them
+        workers = int(os.environ.get('DISPATCHER_WORKERS', 4))
+        if self.runtime_mode == 'async':
+            limits = self.async_runtime.limits
+            background_workers = limits['telegram'] + limits['gemini'] + limits['sheets']
+        else:
+            background_workers = self.slip_pipeline.worker_count
+        updater = Updater(
+            self.token,
+            workers=workers,
+            request_kwargs={'con_pool_size': workers + background_workers + 4}
+        )
+
+        # The command menu is cosmetic, so setting it doesn't hold up the first poll
+        threading.Thread(target=self.set_commands, args=(updater,), name="set-commands", daemon=True).start()
+
+        # Keep cached tokens fresh in the background
+        self.auth.credential_cache.start_refresher()
+        # And every stored token, so revoked users are known before they send a slip
+        if os.environ.get('TOKEN_SCAN_ENABLED', '1') == '1':
+            self.token_scanner.start(first_run_delay=int(os.environ.get('TOKEN_SCAN_DELAY', 60)))
+        self.sheet_writer.start()
+        if self.runtime_mode == 'async':
+            self.async_runtime.start()
+        else:
+            self.slip_pipeline.start()
+
+        # Read before polling starts, so only the previous run's slips are replayed
+        unfinished = self.job_journal.pending() if self.job_journal is not None else []
+        if unfinished:
+            threading.Thread(
+                target=self.replay_journal, args=(updater.bot, unfinished), name="journal-replay", daemon=True
+            ).start()
+
+        self.add_handlers(updater.dispatcher)
+
+        if self.bot_mode == 'webhook':
+            self.run_webhook(updater)
+        else:
+            # Polling has no HTTP server of its own, so /metrics gets a local one
+            if os.environ.get('METRICS_ENABLED', '1') == '1':
+                WebhookServer(
+                    os.environ.get('METRICS_HOST', '127.0.0.1'),
+                    int(os.environ.get('METRICS_PORT', 9100)),
+                    None, None, on_update=None,
+                    routes={'/metrics': self.metrics_route},
+                    workers=1
+                ).start()
+            updater.start_polling()
+            self.report_ready()
+            print("🤖 Bot is running...")
+            updater.idle()
+
+        # Flush rows still waiting in the write-behind buffer
+        if self.runtime_mode == 'async':
+            self.async_runtime.stop()
+        self.token_scanner.stop()
+        self.sheet_writer.stop()
+        self.prep_executor.shutdown(wait=True)
+
+
+def create_bot(started=None):
+    """Build a SlipBot and return its main(), which runs the bot"""
+    return SlipBot(started).main
@@ -0,0 +1,168 @@
+"""Local bet history with per-user and per-league aggregates kept up to date on every write"""
+import logging
+import sqlite3
+import threading
+import time
+
+from .extraction import BetSlip, HEADER_VALUES, ROW_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Words in the slip's Bet Status that settle it, checked in this order
+_STATUS_WORDS = (
+    ("void", ("void", "refund", "cancel", "push")),
+    ("won", ("won", "win", "cashed", "cash out", "paid")),
+    ("lost", ("lost", "lose", "loss")),
+)
+_AGGREGATE_COLUMNS = ("bets", "settled", "won", "lost", "staked", "settled_staked", "returned")
+
+
+def settlement(status):
+    """'won', 'lost', 'void' or 'open' for a Bet Status as the slip shows it"""
+    status = (status or "").strip().lower()
+    for outcome, words in _STATUS_WORDS:
+        if any(word in status for word in words):
+            return outcome
+    return "open"
+
+
+def _contribution(slip):
+    """What one bet adds to the aggregates, in _AGGREGATE_COLUMNS order"""
+    outcome = settlement(slip.status)
+    stake = slip.stake or 0.0
+    if outcome == "won":
+        returned = slip.potential_winning if slip.potential_winning is not None else stake * (slip.total_odds or 1.0)
+    elif outcome == "void":
+        returned = stake
+    else:
+        returned = 0.0
+    settled = outcome != "open"
+    return (
+        1, int(settled), int(outcome == "won"), int(outcome == "lost"),
+        stake, stake if settled else 0.0, returned if settled else 0.0
+    )
+
+
+def _leagues(slip):
+    return sorted({leg["league"] for leg in slip.legs if leg["league"] and leg["league"] != "NA"}) or ["NA"]
+
+
+class BetHistory:
+    """SQLite copy of every bet written to a user's sheet, so summaries never read the sheet
+
+    Bets are keyed by (user_id, bet ID): recording a bet again, e.g. once it has
+    settled, replaces it and moves the aggregates by the difference. A
+    multi-league slip counts its full stake towards each of its leagues.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        aggregates = ", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in _AGGREGATE_COLUMNS)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS bets ("
+            "user_id TEXT NOT NULL, bet_id TEXT NOT NULL, date TEXT, status TEXT, stake REAL, "
+            "potential_winning REAL, total_odds REAL, legs INTEGER, leagues TEXT, row TEXT NOT NULL, "
+            "recorded REAL NOT NULL, PRIMARY KEY (user_id, bet_id));"
+            f"CREATE TABLE IF NOT EXISTS user_totals (user_id TEXT PRIMARY KEY, {aggregates});"
+            f"CREATE TABLE IF NOT EXISTS league_totals (user_id TEXT NOT NULL, league TEXT NOT NULL, {aggregates}, "
+            "PRIMARY KEY (user_id, league));"
+        )
+        self._db.commit()
+
+    def _apply(self, table, keys, values, sign):
+        key_names = ", ".join(name for name, _ in keys)
+        placeholders = ", ".join("?" for _ in keys)
+        self._db.execute(f"INSERT OR IGNORE INTO {table} ({key_names}) VALUES ({placeholders})", [v for _, v in keys])
+        assignments = ", ".join(f"{column} = {column} + ?" for column in _AGGREGATE_COLUMNS)
+        conditions = " AND ".join(f"{name} = ?" for name, _ in keys)
+        self._db.execute(
+            f"UPDATE {table} SET {assignments} WHERE {conditions}",
+            [sign * value for value in values] + [v for _, v in keys]
+        )
+
+    def _move(self, user_id, slip, leagues, sign):
+        values = _contribution(slip)
+        self._apply("user_totals", [("user_id", user_id)], values, sign)
+        for league in leagues:
+            self._apply("league_totals", [("user_id", user_id), ("league", league)], values, sign)
+
+    def _record(self, user_id, slip):
+        values = slip.values
+        row = "\x1f".join(str(values.get(key, "NA")) for key in ROW_KEYS)
+        old = self._db.execute(
+            "SELECT row, leagues FROM bets WHERE user_id = ? AND bet_id = ?", (user_id, slip.bet_id)
+        ).fetchone()
+        if old is not None:
+            if old[0] == row:
+                return False
+            self._move(user_id, BetSlip(dict(zip(ROW_KEYS, old[0].split("\x1f")))), old[1].split("\x1f"), -1)
+
+        leagues = _leagues(slip)
+        self._db.execute(
+            "INSERT OR REPLACE INTO bets (user_id, bet_id, date, status, stake, potential_winning, total_odds, "
+            "legs, leagues, row, recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                user_id, slip.bet_id, values.get("Date"), slip.status, slip.stake, slip.potential_winning,
+                slip.total_odds, len(slip.legs), "\x1f".join(leagues), row, time.time()
+            )
+        )
+        self._move(user_id, slip, leagues, 1)
+        return True
+
+    def record(self, user_id, slip):
+        """Add or replace one parsed BetSlip, False if it was already recorded as is"""
+        with self._lock, self._db:
+            return self._record(str(user_id), slip)
+
+    def rebuild(self, user_id, rows):
+        """Replace a user's history with rows read back from their sheet, returning how many were kept"""
+        user_id = str(user_id)
+        kept = 0
+        with self._lock, self._db:
+            for table in ("bets", "user_totals", "league_totals"):
+                self._db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            for row in rows:
+                if not row or list(row[:len(HEADER_VALUES)]) == HEADER_VALUES:
+                    continue
+                cells = list(row) + ["NA"] * (len(ROW_KEYS) - len(row))
+                values = {key: (str(cell).strip() or "NA") for key, cell in zip(ROW_KEYS, cells)}
+                if values["ID"] == "NA":
+                    continue
+                self._record(user_id, BetSlip(values))
+                kept += 1
+        logger.info(f"Rebuilt bet history for user {user_id} from {kept} sheet rows")
+        return kept
+
+    def has_bets(self, user_id):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM bets WHERE user_id = ? LIMIT 1", (str(user_id),)).fetchone()
+        return row is not None
+
+    def summary(self, user_id, top_leagues=5):
+        """Totals with ROI and hit rate for a user, plus the leagues they stake most on"""
+        columns = ", ".join(_AGGREGATE_COLUMNS)
+        with self._lock:
+            totals = self._db.execute(f"SELECT {columns} FROM user_totals WHERE user_id = ?", (str(user_id),)).fetchone()
+            leagues = self._db.execute(
+                f"SELECT league, {columns} FROM league_totals WHERE user_id = ? AND bets > 0 "
+                "ORDER BY staked DESC LIMIT ?",
+                (str(user_id), top_leagues)
+            ).fetchall()
+        if totals is None or not totals[0]:
+            return None
+        summary = self._with_ratios(dict(zip(_AGGREGATE_COLUMNS, totals)))
+        summary["leagues"] = [
+            dict(self._with_ratios(dict(zip(_AGGREGATE_COLUMNS, league[1:]))), league=league[0]) for league in leagues
+        ]
+        return summary
+
+    @staticmethod
+    def _with_ratios(totals):
+        for column in ("bets", "settled", "won", "lost"):
+            totals[column] = int(round(totals[column]))
+        decided = totals["won"] + totals["lost"]
+        totals["hit_rate"] = totals["won"] / decided if decided else None
+        totals["profit"] = totals["returned"] - totals["settled_staked"]
+        totals["roi"] = totals["profit"] / totals["settled_staked"] if totals["settled_staked"] else None
+        return totals
@@ -0,0 +1,100 @@
+"""Write-ahead journal of slip jobs, so a restart resumes unfinished slips from their last completed stage"""
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledMessage:
+    """Stand-in for a replayed job's "Processing..." message, edited through the bot by chat and message ID"""
+
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    def edit_text(self, text, **kwargs):
+        return self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+
+class JobJournal:
+    """SQLite WAL log of each slip's progress: received, downloaded, ocr_done, written, then finished
+
+    The OCR text is stored with the ocr_done state, so a replayed slip past that
+    point never calls Gemini again. A slip that crashed between the sheet write
+    and its written entry is written again, which the bet row index turns into
+    an update of the same row. Finished entries are kept for `retention`
+    seconds for inspection and pruned on startup.
+    """
+
+    STATES = ("received", "downloaded", "ocr_done", "written", "finished")
+
+    def __init__(self, path, retention=86400):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives a process crash, only an OS crash can drop the last commits
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "file_id TEXT NOT NULL, chat_id INTEGER, message_id INTEGER, state TEXT NOT NULL, digest TEXT, "
+            "ocr_text TEXT, outcome TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._db.execute("DELETE FROM jobs WHERE state = 'finished' AND updated < ?", (time.time() - retention,))
+        self._db.commit()
+
+    def received(self, job):
+        """Journal a new job and remember its entry on the job"""
+        message = job.processing_msg
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (user_id, file_id, chat_id, message_id, state, created, updated) "
+                "VALUES (?, ?, ?, ?, 'received', ?, ?)",
+                (
+                    job.user_id, job.file_id, getattr(message, "chat_id", None), getattr(message, "message_id", None),
+                    job.created, now
+                )
+            )
+        job.journal_id = cursor.lastrowid
+
+    def advance(self, job, state):
+        """Record that the job completed a stage, with its OCR text once it has one"""
+        if job.journal_id is None:
+            return
+        with self._lock, self._db:
+            if state == "ocr_done":
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, digest = ?, ocr_text = ?, updated = ? WHERE id = ?",
+                    (state, job.digest, job.ocr_text, time.time(), job.journal_id)
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (state, time.time(), job.journal_id)
+                )
+
+    def finish(self, job, outcome):
+        if job.journal_id is None:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = 'finished', outcome = ?, ocr_text = NULL, updated = ? WHERE id = ?",
+                (outcome, time.time(), job.journal_id)
+            )
+
+    def pending(self):
+        """Unfinished entries, oldest first, as dicts"""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT id, user_id, file_id, chat_id, message_id, state, digest, ocr_text, created "
+                "FROM jobs WHERE state != 'finished' ORDER BY id"
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
@@ -0,0 +1,371 @@
+"""Gemini model setup, image preprocessing and the OCR result cache"""
+import hashlib
+import io
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .extraction import SLIP_JSON_SCHEMA
+from .telemetry import stage_timer, timing_decorator
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:  # Pillow is optional, perceptual hashing and preprocessing are skipped without it
+    Image = ImageChops = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiModelRegistry:
+    """Configures Gemini once per process and keeps a ready model per worker thread"""
+
+    MODEL_NAME = "gemini-1.5-flash"
+
+    GENERATION_CONFIG = {
+        "temperature": 0.4,
+        "top_p": 1,
+        "top_k": 32
+    }
+
+    SAFETY_SETTINGS = [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    ]
+
+    # Prompt asks for delimiters so multiple teams are handled
+    PROMPT = (
+        "Extract betting slip data in format:\n"
+        "ID:\nDate:\nTime:\nCountry:\nMatch League:\nHome Team:\nAway Team:\n"
+        "Staked Amount:\nPotential Winning:\nBet Option Staked:\n"
+        "Odds of Bet Option Staked:\nTotal Odds:\nBet Status:\n"
+        "##############\n"
+        "Use semicolons for multiple teams/odds. Combined odds in Total Odds."
+    )
+
+    # Album requests put every slip in its own delimited block
+    BATCH_PROMPT = (
+        "The following {count} images are separate betting slips. For each image, in the order given, "
+        "write a line \"=== SLIP n ===\" (n counting from 1) and then that slip's data.\n"
+    )
+    BATCH_DELIMITER = re.compile(r"^=== SLIP (\d+) ===[ \t]*$", re.MULTILINE)
+
+    # JSON mode lets the response schema carry the layout, so the prompt only describes the content
+    JSON_PROMPT = (
+        "Extract the betting slip data. Give one entry in legs per match, in the order shown on the slip, "
+        "and put the combined odds in total_odds. Use an empty string for text that is not on the slip "
+        "and null for odds that are not shown."
+    )
+    JSON_BATCH_PROMPT = (
+        "The following {count} images are separate betting slips. "
+        "Return one object per image, in the order given.\n"
+    )
+
+    def __init__(self, genai=None, api_key=None, model_name=MODEL_NAME, per_thread=True, output_mode="text"):
+        if output_mode not in ("text", "json"):
+            raise ValueError(f"Unknown OCR output mode: {output_mode}")
+        self._genai = genai
+        self.api_key = api_key
+        self.model_name = model_name
+        self.per_thread = per_thread
+        self.output_mode = output_mode
+        self._configured = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shared_model = None
+
+    def _configure(self):
+        with self._lock:
+            if not self._configured:
+                if self._genai is None:
+                    # The SDK pulls in grpc and protobuf, so it loads with the first model rather than at startup
+                    with stage_timer("genai_import"):
+                        import google.generativeai as genai
+                    self._genai = genai
+                self._genai.configure(api_key=self.api_key)
+                self._configured = True
+
+    def _build_model(self):
+        with stage_timer("model_init"):
+            return self._genai.GenerativeModel(
+                model_name=self.model_name,
+                generation_config=self.generation_config(),
+                safety_settings=self.SAFETY_SETTINGS
+            )
+
+    def model(self):
+        """Return the configured model for the calling thread, creating it on first use"""
+        if not self._configured:
+            self._configure()
+        if self.per_thread:
+            model = getattr(self._local, "model", None)
+            if model is None:
+                model = self._local.model = self._build_model()
+            return model
+        if self._shared_model is None:
+            with self._lock:
+                if self._shared_model is None:
+                    self._shared_model = self._build_model()
+        return self._shared_model
+
+    def generation_config(self, batch=False):
+        """Generation config for the output mode; JSON batches expect an array of slips"""
+        if self.output_mode == "text":
+            return self.GENERATION_CONFIG
+        schema = {"type": "ARRAY", "items": SLIP_JSON_SCHEMA} if batch else SLIP_JSON_SCHEMA
+        return dict(self.GENERATION_CONFIG, response_mime_type="application/json", response_schema=schema)
+
+    def batch_generation_config(self):
+        """Per-request config override for batch calls, None when the model's own config fits"""
+        return self.generation_config(batch=True) if self.output_mode == "json" else None
+
+    def prompt_parts(self, image_bytes, mime_type="image/jpeg"):
+        prompt = self.JSON_PROMPT if self.output_mode == "json" else self.PROMPT
+        return [prompt, {"mime_type": mime_type, "data": image_bytes}]
+
+    def batch_prompt_parts(self, images):
+        """Prompt for several (image_bytes, mime_type) slips answered in one response"""
+        if self.output_mode == "json":
+            parts = [self.JSON_BATCH_PROMPT.format(count=len(images)) + self.JSON_PROMPT]
+        else:
+            parts = [self.BATCH_PROMPT.format(count=len(images)) + self.PROMPT]
+        for number, (image_bytes, mime_type) in enumerate(images, start=1):
+            parts.append(f"Slip {number}:")
+            parts.append({"mime_type": mime_type, "data": image_bytes})
+        return parts
+
+    def split_batch_response(self, text, count):
+        """Split a batch response into per-slip texts, or None if the blocks do not line up"""
+        if self.output_mode == "json":
+            try:
+                slips = json.loads(text)
+            except ValueError:
+                return None
+            if not isinstance(slips, list) or len(slips) != count:
+                return None
+            return [json.dumps(slip, ensure_ascii=False) for slip in slips]
+
+        pieces = self.BATCH_DELIMITER.split(text)
+        blocks = {}
+        for number, body in zip(pieces[1::2], pieces[2::2]):
+            blocks[int(number)] = body.strip() + "\n"
+        if sorted(blocks) != list(range(1, count + 1)):
+            return None
+        return [blocks[number] for number in range(1, count + 1)]
+
+
+class OCRResultCache:
+    """Content-addressed cache of OCR text keyed by image hash, with a memory LRU over a SQLite tier
+
+    phash_distance > 0 also reuses the text of a recent image whose perceptual
+    hash is that close. Different slips from one bookmaker's layout can hash
+    the same, so that tier is off by default and a match is only ever
+    reported as similar, never as the same slip.
+    """
+
+    def __init__(self, path, memory_size=256, phash_distance=0, phash_window=1000):
+        self.memory_size = memory_size
+        self.phash_distance = phash_distance if Image is not None and phash_distance > 0 else None
+        self.phash_window = phash_window
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_results "
+            "(digest TEXT PRIMARY KEY, phash INTEGER, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS written_slips "
+            "(digest TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (digest, user_id))"
+        )
+        self._db.commit()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "perceptual_hits": 0, "misses": 0}
+
+    @staticmethod
+    def digest(image_bytes):
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @staticmethod
+    def perceptual_hash(image_bytes):
+        """64-bit difference hash, stable across re-compression and resizing"""
+        if Image is None:
+            return None
+        try:
+            image = Image.open(io.BytesIO(image_bytes)).convert("L").resize((9, 8))
+        except Exception:
+            return None
+        pixels = list(image.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        # SQLite integers are signed 64-bit
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    def _remember(self, digest, text):
+        self._memory[digest] = text
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def lookup(self, image_bytes):
+        """Return (digest, phash, text, similar_to); text is None on a miss
+
+        digest is always this image's own hash. similar_to is the digest of the
+        image a perceptual hit took its text from, None otherwise.
+        """
+        digest = self.digest(image_bytes)
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                self.counters["memory_hits"] += 1
+                return digest, None, self._memory[digest], None
+
+            row = self._db.execute("SELECT text FROM ocr_results WHERE digest = ?", (digest,)).fetchone()
+            if row is not None:
+                self._remember(digest, row[0])
+                self.counters["disk_hits"] += 1
+                return digest, None, row[0], None
+
+        phash = self.perceptual_hash(image_bytes) if self.phash_distance is not None else None
+        if phash is not None:
+            with self._lock:
+                recent = self._db.execute(
+                    "SELECT digest, phash, text FROM ocr_results WHERE phash IS NOT NULL "
+                    "ORDER BY created DESC LIMIT ?",
+                    (self.phash_window,)
+                ).fetchall()
+                for match_digest, match_phash, text in recent:
+                    if bin((phash ^ match_phash) & ((1 << 64) - 1)).count("1") <= self.phash_distance:
+                        self.counters["perceptual_hits"] += 1
+                        return digest, phash, text, match_digest
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return digest, phash, None, None
+
+    def store(self, digest, phash, text):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ocr_results (digest, phash, text, created) VALUES (?, ?, ?, ?)",
+                (digest, phash, text, time.time())
+            )
+            self._db.commit()
+            self._remember(digest, text)
+
+    def discard(self, digest):
+        with self._lock:
+            self._db.execute("DELETE FROM ocr_results WHERE digest = ?", (digest,))
+            self._db.commit()
+            self._memory.pop(digest, None)
+
+    def mark_written(self, digest, user_id):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO written_slips (digest, user_id) VALUES (?, ?)",
+                (digest, str(user_id))
+            )
+            self._db.commit()
+
+    def was_written(self, digest, user_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM written_slips WHERE digest = ? AND user_id = ?",
+                (digest, str(user_id))
+            ).fetchone()
+        return row is not None
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        counters["hit_rate"] = (lookups - counters["misses"]) / lookups if lookups else 0.0
+        return counters
+
+
+def detect_mime_type(image_bytes):
+    """Identify the image format from its magic bytes, defaulting to JPEG"""
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return "image/jpeg"
+
+
+class ImagePreprocessor:
+    """Shrinks slip images before OCR: grayscale, crop uniform margins, downscale and re-encode"""
+
+    def __init__(self, max_dimension=1600, grayscale=True, crop_margins=True, jpeg_quality=80, margin_tolerance=12):
+        self.max_dimension = max_dimension
+        self.grayscale = grayscale
+        self.crop_margins = crop_margins
+        self.jpeg_quality = jpeg_quality
+        self.margin_tolerance = margin_tolerance
+
+    @timing_decorator
+    def _decode(self, image_bytes):
+        image = Image.open(io.BytesIO(image_bytes))
+        return ImageOps.exif_transpose(image)
+
+    @timing_decorator
+    def _to_grayscale(self, image):
+        return image.convert("L")
+
+    @timing_decorator
+    def _crop_uniform_margins(self, image):
+        gray = image if image.mode == "L" else image.convert("L")
+        background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+        mask = ImageChops.difference(gray, background).point(
+            lambda value: 255 if value > self.margin_tolerance else 0
+        )
+        bbox = mask.getbbox()
+        return image.crop(bbox) if bbox else image
+
+    @timing_decorator
+    def _downscale(self, image):
+        if max(image.size) <= self.max_dimension:
+            return image
+        image = image.copy()
+        image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+        return image
+
+    @timing_decorator
+    def _encode(self, image):
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        return out.getvalue()
+
+    def process(self, image_bytes):
+        """Return (image_bytes, mime_type) ready for OCR, keeping the original if it is already smaller"""
+        mime_type = detect_mime_type(image_bytes)
+        if Image is None:
+            return image_bytes, mime_type
+
+        try:
+            image = self._decode(image_bytes)
+            if self.grayscale:
+                image = self._to_grayscale(image)
+            if self.crop_margins:
+                image = self._crop_uniform_margins(image)
+            image = self._downscale(image)
+            processed = self._encode(image)
+        except Exception as e:
+            logger.error(f"Image preprocessing failed, sending original {mime_type}: {e}")
+            return image_bytes, mime_type
+
+        logger.info(
+            f'Preprocessing {mime_type} {len(image_bytes)} bytes in, {len(processed)} bytes out, '
+            f'{image.size[0]}x{image.size[1]}'
+        )
+        if len(processed) >= len(image_bytes):
+            return image_bytes, mime_type
+        return processed, "image/jpeg"
@@ -0,0 +1,546 @@
+"""Slip jobs, the OCR and sheet stages and the threaded and asyncio runtimes that move them through download, OCR and sheets"""
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+
+from .extraction import SlipValidationError
+from .resilience import CircuitOpenError, RateLimitedError
+from .telemetry import count_error, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class SlipJob:
+    """State carried by one bet slip through the processing pipeline
+
+    Pipeline items are lists of jobs: a single upload is a list of one, an album
+    travels together so its images can share one OCR request. trace is the
+    slip's root span, which stage workers re-activate. prep is the TaskGraph
+    preparing the user's sheet while the slip is downloaded and read,
+    journal_id the slip's JobJournal entry and similar_to the digest of an
+    earlier image whose OCR text was reused because it looked the same.
+    """
+
+    def __init__(self, user_id, bot, file_id, processing_msg, trace=None):
+        self.user_id = user_id
+        self.bot = bot
+        self.file_id = file_id
+        self.processing_msg = processing_msg
+        self.created = time.time()
+        self.image_bytes = None
+        self.digest = None
+        self.phash = None
+        self.similar_to = None
+        self.ocr_text = None
+        self.info_text = None
+        self.trace = trace
+        self.prep = None
+        self.journal_id = None
+
+
+class OCRStage:
+    """Pipeline stage that reads a batch of slips, reusing cached results and sharing one request for the rest
+
+    preprocess(image_bytes) returns the (image_bytes, mime_type) sent to the
+    cascade. While guard's circuit is open the slips are deferred and handed
+    to resubmit(jobs) once it lets a probe through. finish(job, outcome, error)
+    records a slip that ends here, notify(job, text) tells its user and
+    journal(job, state) records the OCR result of the ones passed on.
+    """
+
+    def __init__(self, cache, cascade, preprocess, guard, resubmit, finish, notify, journal):
+        self.cache = cache
+        self.cascade = cascade
+        self.preprocess = preprocess
+        self.guard = guard
+        self.resubmit = resubmit
+        self.finish = finish
+        self.notify = notify
+        self.journal = journal
+
+    def __call__(self, jobs):
+        try:
+            self._read(jobs)
+
+        except CircuitOpenError as outage:
+            # Park the slips until the breaker lets a probe through instead of failing them
+            waiting = [job for job in jobs if job.ocr_text is None]
+            parked = self.guard.defer(lambda: self.resubmit(waiting), outage.retry_after)
+            for job in waiting:
+                if parked:
+                    self.notify(
+                        job,
+                        "⏳ The OCR service is having trouble right now.\n\n"
+                        f"Your slip is queued and I'll try again in about {outage.retry_after:.0f} seconds."
+                    )
+                else:
+                    self.finish(job, "error", outage)
+                    self.notify(job, f"❌ {str(outage)}\n\nPlease send the slip again later.")
+
+        except RateLimitedError as limited:
+            for job in jobs:
+                if job.ocr_text is None:
+                    count_error("slip", limited)
+                    self.finish(job, "rate_limited", limited)
+                    self.notify(
+                        job,
+                        "⏳ You're sending slips faster than I can read them.\n\n"
+                        f"Please wait about {limited.retry_after:.0f} seconds and send this one again."
+                    )
+
+        except Exception as ocr_error:
+            for job in jobs:
+                if job.ocr_text is None:
+                    count_error("slip", ocr_error)
+                    self.finish(job, "error", ocr_error)
+                    self.notify(
+                        job,
+                        f"❌ Error during OCR processing: {str(ocr_error)}\n\n"
+                        "Please try again with a clearer image."
+                    )
+
+        # Parked slips are dropped from this pass too, they keep their image bytes
+        jobs[:] = [job for job in jobs if job.ocr_text is not None]
+        for job in jobs:
+            if job.image_bytes is not None:
+                self.journal(job, "ocr_done")
+            job.image_bytes = None
+            all_text = job.ocr_text
+            job.info_text = all_text.split("##############\n")[1] if "##############\n" in all_text else all_text
+        return bool(jobs)
+
+    def _read(self, jobs):
+        misses = []
+        for job in jobs:
+            if job.ocr_text is not None:
+                # Replayed from the journal, its OCR result is already paid for
+                continue
+            job.digest, job.phash, job.ocr_text, job.similar_to = self.cache.lookup(job.image_bytes)
+            if job.ocr_text is None:
+                misses.append(job)
+            else:
+                logger.info(f'OCR cache hit for {job.digest[:12]}')
+
+        if not misses:
+            return
+        # An album shares one request, traced under its first slip with a covering span in the others
+        shared = [tracer.start_span("ocr_shared", job.trace) for job in misses[1:]]
+        with tracer.activate(misses[0].trace):
+            images = [self.preprocess(job.image_bytes) for job in misses]
+            texts = self.cascade.read_batch(images, user_id=misses[0].user_id)
+        for span in shared:
+            if span is not None:
+                span.end()
+        for job, text in zip(misses, texts):
+            job.ocr_text = text
+            self.cache.store(job.digest, job.phash, text)
+
+
+class SheetStage:
+    """Pipeline stage that queues each slip's row on the write-behind writer
+
+    extract(text) turns the OCR text into a BetSlip. report(job, sheet_link,
+    error, is_duplicate) tells the user how the slip ended, sheet_link(user_id)
+    finds the sheet of a skipped duplicate, join_prep(job) waits for the
+    speculative sheet preparation and record_history(user_id, slip) mirrors a
+    written row. duplicate_mode 'skip' doesn't write an image the user already
+    recorded, anything else writes it and flags it.
+    """
+
+    def __init__(self, cache, writer, extract, report, sheet_link, join_prep, journal, record_history,
+                 duplicate_mode="skip"):
+        self.cache = cache
+        self.writer = writer
+        self.extract = extract
+        self.report = report
+        self.sheet_link = sheet_link
+        self.join_prep = join_prep
+        self.journal = journal
+        self.record_history = record_history
+        self.duplicate_mode = duplicate_mode
+
+    def __call__(self, jobs):
+        for job in jobs:
+            with tracer.activate(job.trace):
+                self.queue_row(job)
+
+    def queue_row(self, job):
+        """Queue a slip's row for the user's sheet, unless this user already recorded it"""
+        user_id = job.user_id
+        # Only the exact same image is skipped, a perceptual match may be a different slip and is just flagged
+        is_duplicate = self.cache.was_written(job.digest, user_id)
+        if job.similar_to is not None and not self.cache.was_written(job.similar_to, user_id):
+            job.similar_to = None
+        if is_duplicate and self.duplicate_mode == 'skip':
+            sheet_link = self.sheet_link(user_id)
+            if sheet_link:
+                self.report(job, sheet_link, None, is_duplicate)
+                return
+
+        try:
+            slip = self.extract(job.info_text)
+            row_values = slip.to_row()
+        except Exception as e:
+            if isinstance(e, SlipValidationError):
+                # Don't let a malformed response be served from the cache on a resend
+                self.cache.discard(job.digest)
+            self.report(job, None, e, is_duplicate)
+            return
+
+        self.join_prep(job)
+
+        # Spans from the batched write nest under this span of the batch's first slip
+        update_span = tracer.start_span("sheet_update", job.trace)
+
+        def on_written(sheet_link, error):
+            if update_span is not None:
+                update_span.end(error)
+            if error is None:
+                self.journal(job, "written")
+                self.record_history(user_id, slip)
+            self.report(job, sheet_link, error, is_duplicate)
+
+        with tracer.activate(update_span):
+            self.writer.add(user_id, row_values, on_written)
+
+
+class StagedPipeline:
+    """Chain of bounded queues, each drained by its own worker pool
+
+    A stage handler returns True to pass the job on to the next stage; anything
+    else ends the job. Full queues block the upstream stage, and submit() fails
+    fast once the first queue is full, which is the backpressure signal.
+    """
+
+    def __init__(self, stages, queue_size=100, on_error=None):
+        self._stages = stages
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._on_error = on_error
+        self._threads = []
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def start(self):
+        for index, (name, _, workers) in enumerate(self._stages):
+            for worker_number in range(workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(index,), name=f"{name}-{worker_number}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job, timeout=None):
+        """Queue a job for the first stage, raising queue.Full when the pipeline is saturated"""
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            self._queues[0].put(job, timeout=timeout)
+        except queue.Full:
+            self._finish()
+            raise
+
+    def _finish(self):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _worker(self, index):
+        name, handler, _ = self._stages[index]
+        job_queue = self._queues[index]
+        while True:
+            job = job_queue.get()
+            try:
+                forward = handler(job) is True
+            except Exception as e:
+                logger.error(f"Unhandled error in {name} stage: {e}")
+                forward = False
+                if self._on_error is not None:
+                    try:
+                        self._on_error(job, name, e)
+                    except Exception as error_handler_error:
+                        logger.error(f"Error handler failed in {name} stage: {error_handler_error}")
+            finally:
+                job_queue.task_done()
+
+            if forward and index + 1 < len(self._queues):
+                self._queues[index + 1].put(job)
+            else:
+                self._finish()
+
+    def stats(self):
+        """Queue depth per stage and number of jobs in flight"""
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+        return {
+            "queue_depth": {name: job_queue.qsize() for (name, _, _), job_queue in zip(self._stages, self._queues)},
+            "in_flight": in_flight
+        }
+
+    @property
+    def worker_count(self):
+        return sum(workers for _, _, workers in self._stages)
+
+
+class TaskGraph:
+    """Small DAG of named tasks on a shared executor, each started once its dependencies finish
+
+    A task gets its dependencies' results as arguments. If one fails or is
+    cancelled its dependents are cancelled without running. Several slips may
+    share a graph: each owner calls release() when it gives up, and the last one
+    cancels whatever has not started yet, so speculative work stops cleanly.
+    Tasks run in the context that was current when they were added.
+    """
+
+    def __init__(self, executor, owners=1):
+        self._executor = executor
+        self._futures = {}
+        self._owners = owners
+        self._lock = threading.Lock()
+        # Orders starting a task against cancelling it, re-entered by the cancel callbacks of dependents
+        self._start_lock = threading.RLock()
+
+    def add(self, name, func, *dependencies):
+        future = Future()
+        self._futures[name] = future
+        parents = [self._futures[dependency] for dependency in dependencies]
+        context = contextvars.copy_context()
+        remaining = [len(parents)]
+
+        def parent_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            if any(parent.cancelled() or parent.exception() is not None for parent in parents):
+                self._cancel(future)
+                return
+            try:
+                self._executor.submit(run)
+            except RuntimeError:  # executor shut down
+                self._cancel(future)
+
+        def run():
+            with self._start_lock:
+                if future.cancelled() or not future.set_running_or_notify_cancel():
+                    return
+            try:
+                future.set_result(context.run(func, *(parent.result() for parent in parents)))
+            except BaseException as e:
+                future.set_exception(e)
+
+        if parents:
+            for parent in parents:
+                parent.add_done_callback(parent_done)
+        else:
+            remaining[0] = 1
+            parent_done(None)
+        return future
+
+    def result(self, name, timeout=None):
+        return self._futures[name].result(timeout)
+
+    def wait(self, timeout=None):
+        """Block until every task has finished or been cancelled, True if none is still running"""
+        return not wait(list(self._futures.values()), timeout).not_done
+
+    def release(self):
+        """Drop one owner, cancelling the tasks that haven't started once no owner is left"""
+        with self._lock:
+            self._owners -= 1
+            if self._owners > 0:
+                return
+        self.cancel()
+
+    def cancel(self):
+        for future in self._futures.values():
+            self._cancel(future)
+
+    def _cancel(self, future):
+        # A plain cancel() leaves wait() blocked, notifying moves the future to cancelled-and-done
+        with self._start_lock:
+            if not future.cancelled() and future.cancel():
+                future.set_running_or_notify_cancel()
+
+
+class AsyncSlipRuntime:
+    """Runs slip jobs as tasks on a dedicated asyncio event loop thread
+
+    Blocking clients go through call(), which holds a global semaphore for the
+    upstream while the function runs in a shared executor, so threads are only
+    occupied for the duration of a request. prepare(jobs) may run concurrently
+    for one user's slips, but commit(jobs) runs in the order they were submitted.
+
+    Not a win over StagedPipeline yet: only the Telegram download can use aiohttp,
+    every Gemini, Sheets and GCS call still blocks an executor thread, and
+    bench_async_runtime shows the same throughput, thread count and memory for both.
+    It pays off once those clients are replaced by non-blocking ones.
+    """
+
+    def __init__(self, prepare, commit, limits, max_in_flight=500, http_fetch=True):
+        self._prepare = prepare
+        self._commit = commit
+        self.limits = dict(limits)
+        self.max_in_flight = max_in_flight
+        self.http_fetch = http_fetch
+        self._semaphores = {}
+        self._waiting = dict.fromkeys(self.limits, 0)
+        self._executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix="async-io")
+        self._user_tails = {}
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-runtime", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        # Created on the loop, older Pythons bind semaphores to the loop current at construction
+        self._semaphores = {upstream: asyncio.Semaphore(limit) for upstream, limit in self.limits.items()}
+        if not self.http_fetch:
+            return
+        try:
+            import aiohttp
+        except ImportError:  # aiohttp is optional, the async runtime downloads through its executor without it
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limits.get("telegram", 100))
+        )
+
+    def stop(self):
+        if self._thread is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def spawn(self, coroutine):
+        """Schedule a coroutine from any thread, logging the error if it fails"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Unhandled error in async task: {future.exception()}")
+
+    async def call(self, upstream, func, *args, **kwargs):
+        """Run a blocking call in the executor, bounded by the upstream's semaphore"""
+        semaphore = self._semaphores[upstream]
+        self._waiting[upstream] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[upstream] -= 1
+        try:
+            # Executor threads don't inherit context variables, so the current span goes along explicitly
+            context = contextvars.copy_context()
+            return await self._loop.run_in_executor(self._executor, partial(context.run, func, *args, **kwargs))
+        finally:
+            semaphore.release()
+
+    @property
+    def can_fetch(self):
+        return self._session is not None
+
+    async def fetch(self, url, max_bytes):
+        """Stream a URL into memory with aiohttp, refusing bodies larger than max_bytes"""
+        async with self._semaphores["telegram"]:
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                chunks, size = [], 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Image is over the {max_bytes / 1024 / 1024:.1f} MB limit")
+                    chunks.append(chunk)
+        return b"".join(chunks)
+
+    def submit(self, jobs):
+        """Start processing a list of jobs, raising queue.Full when max_in_flight is reached"""
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_in_flight:
+                raise queue.Full
+            self._in_flight += 1
+        self.spawn(self._run(jobs))
+
+    async def _run(self, jobs):
+        user_id = jobs[0].user_id
+        previous = self._user_tails.get(user_id)
+        done = self._loop.create_future()
+        self._user_tails[user_id] = done
+        try:
+            ready = await self._prepare(jobs)
+            # Wait for the user's previous slip even if this one failed, so later slips keep their order
+            if previous is not None:
+                await previous
+            if ready:
+                await self._commit(jobs)
+        finally:
+            done.set_result(None)
+            if self._user_tails.get(user_id) is done:
+                del self._user_tails[user_id]
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        """Jobs in flight and calls waiting on each upstream's semaphore"""
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+        return {"in_flight": in_flight, "waiting": dict(self._waiting)}
+
+
+class AlbumCollector:
+    """Groups items that share a Telegram media_group_id
+
+    A group is released to on_ready after `window` seconds without a new item,
+    or as soon as it holds max_items.
+    """
+
+    def __init__(self, on_ready, window=1.5, max_items=10):
+        self._on_ready = on_ready
+        self.window = window
+        self.max_items = max_items
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def add(self, group_id, item):
+        ready = None
+        with self._lock:
+            group = self._groups.get(group_id)
+            if group is None:
+                group = self._groups[group_id] = {"items": [], "timer": None}
+            group["items"].append(item)
+            if group["timer"] is not None:
+                group["timer"].cancel()
+            if len(group["items"]) >= self.max_items:
+                del self._groups[group_id]
+                ready = group["items"]
+            else:
+                group["timer"] = threading.Timer(self.window, self._release, args=(group_id, group))
+                group["timer"].daemon = True
+                group["timer"].start()
+        if ready is not None:
+            self._on_ready(ready)
+
+    def _release(self, group_id, group):
+        with self._lock:
+            # A full group may have been released already and replaced by a new one
+            if self._groups.get(group_id) is not group:
+                return
+            del self._groups[group_id]
+        self._on_ready(group["items"])
@@ -0,0 +1,300 @@
+"""Retry classification and the rate limiting and circuit breaking guard around each upstream"""
+import datetime
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _http_error_type():
+    from googleapiclient.errors import HttpError
+    return HttpError
+
+
+def is_retryable_http_error(error):
+    """True for Google API quota (429) and server (5xx) errors"""
+    if not isinstance(error, _http_error_type()):
+        return False
+    status = int(getattr(error.resp, "status", 0) or 0)
+    return status == 429 or 500 <= status < 600
+
+
+def is_http_error(error, status=None):
+    """True for a Google API HttpError, and only one with this HTTP status when status is given"""
+    if not isinstance(error, _http_error_type()):
+        return False
+    return status is None or int(getattr(error.resp, "status", 0) or 0) == status
+
+
+@lru_cache(maxsize=None)
+def _transient_error_types():
+    # google.api_core loads protobuf, so it is imported on the first failure rather than at startup
+    import requests
+    from google.api_core.exceptions import (
+        TooManyRequests, ServiceUnavailable, InternalServerError, GatewayTimeout, DeadlineExceeded
+    )
+    return (
+        TooManyRequests, ServiceUnavailable, InternalServerError, GatewayTimeout, DeadlineExceeded,
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout
+    )
+
+
+def is_retryable_error(error):
+    """Quota, server and connection errors from any upstream, including Gemini and GCS"""
+    if is_retryable_http_error(error):
+        return True
+    return isinstance(error, _transient_error_types())
+
+
+def retry_after_seconds(error):
+    """Seconds from a Retry-After header on the error's response, or None"""
+    if isinstance(error, (CircuitOpenError, RateLimitedError)):
+        return error.retry_after
+    if isinstance(error, _http_error_type()):
+        headers = error.resp
+    else:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.datetime.now(when.tzinfo)).total_seconds())
+
+
+def retry_delay(error, attempt, base_backoff=1.0, max_backoff=32.0):
+    """Wait before the next attempt: the server's Retry-After if given, else capped exponential backoff, plus jitter"""
+    retry_after = retry_after_seconds(error)
+    if retry_after is None:
+        retry_after = min(max_backoff, base_backoff * 2 ** attempt)
+    return retry_after + random.uniform(0, base_backoff)
+
+
+class RateLimitedError(Exception):
+    """A call would have waited longer than the guard's max_wait for a token"""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} rate limit reached, try again in {retry_after:.0f} seconds")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """The upstream's circuit breaker is open, so the call was not attempted"""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is temporarily unavailable, try again in {retry_after:.0f} seconds")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket where reservations may run into debt, so waiting callers are served in order"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return how many seconds the caller must wait before using it"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive upstream failures and lets one probe through after reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.trips = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """0 if a call may go ahead, otherwise the seconds until the next probe"""
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    return 1.0
+                self._probing = True
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.error(f"Circuit opened after {self._failures} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class UpstreamGuard:
+    """Rate limits, retries and a circuit breaker around calls to one upstream API
+
+    A global token bucket caps the upstream's request rate and an optional
+    per-user bucket keeps one user from using it all. Retryable errors count
+    against the breaker and are retried after retry_delay(). Once the breaker is
+    open, calls fail fast with CircuitOpenError, and defer() can park work until
+    the next probe.
+    """
+
+    def __init__(self, name, rate, burst, user_rate=None, user_burst=None, max_wait=10.0, retries=3,
+                 base_backoff=1.0, max_backoff=32.0, failure_threshold=5, reset_timeout=30.0,
+                 max_users=10000, max_deferred=1000):
+        self.name = name
+        self.max_wait = max_wait
+        self.retries = retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.user_rate = user_rate
+        self.user_burst = user_burst or burst
+        self.max_users = max_users
+        self.max_deferred = max_deferred
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._bucket = TokenBucket(rate, burst)
+        self._user_buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._deferred = 0
+        self.counters = {
+            "calls": 0, "failures": 0, "retries": 0, "throttled": 0,
+            "rate_limited": 0, "short_circuited": 0, "deferred": 0, "throttled_seconds": 0.0
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _user_bucket(self, user_id):
+        with self._lock:
+            bucket = self._user_buckets.get(user_id)
+            if bucket is None:
+                bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+                while len(self._user_buckets) > self.max_users:
+                    self._user_buckets.popitem(last=False)
+            self._user_buckets.move_to_end(user_id)
+            return bucket
+
+    def _acquire(self, bucket):
+        wait = bucket.reserve()
+        if wait > self.max_wait:
+            bucket.refund()
+            self._count("rate_limited")
+            raise RateLimitedError(self.name, wait)
+        if wait > 0:
+            self._count("throttled")
+            self._count("throttled_seconds", wait)
+            time.sleep(wait)
+
+    def call(self, func, *args, user_id=None, retries=None, **kwargs):
+        """Call func under the guard's limits, retrying retryable errors"""
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            remaining = self.breaker.allow()
+            if remaining:
+                self._count("short_circuited")
+                raise CircuitOpenError(self.name, remaining)
+            if user_id is not None and self.user_rate:
+                self._acquire(self._user_bucket(user_id))
+            self._acquire(self._bucket)
+
+            self._count("calls")
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # The upstream answered, so it is up even if the request was bad
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                if attempt == retries:
+                    raise
+                delay = retry_delay(e, attempt, self.base_backoff, self.max_backoff)
+                self._count("retries")
+                logger.info(f"{self.name} call failed, retrying in {delay:.2f} seconds: {e}")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def defer(self, callback, delay):
+        """Run callback after delay seconds, or return False if too much work is already parked"""
+        with self._lock:
+            if self._deferred >= self.max_deferred:
+                return False
+            self._deferred += 1
+            self.counters["deferred"] += 1
+
+        def run():
+            with self._lock:
+                self._deferred -= 1
+            callback()
+
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def stats(self):
+        """Counters plus current breaker state, tokens and parked work"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["deferred_pending"] = self._deferred
+            stats["tracked_users"] = len(self._user_buckets)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_trips"] = self.breaker.trips
+        stats["tokens"] = round(self._bucket.tokens, 2)
+        return stats
@@ -0,0 +1,466 @@
+"""Spreadsheet index, the writes to each user's sheet and the write-behind buffer for sheet rows"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .extraction import HEADER_VALUES
+from .resilience import CircuitOpenError, RateLimitedError, is_http_error, is_retryable_error, retry_delay
+from .telemetry import stage_timer, tracer
+
+logger = logging.getLogger(__name__)
+
+
+def build_service(service_name, version, credentials):
+    """Google API client, the slow googleapiclient.discovery import is paid by the first call"""
+    from googleapiclient.discovery import build
+
+    return build(service_name, version, credentials=credentials)
+
+
+def parse_row_range(updated_range):
+    """Return the first and last row numbers of an A1 range like 'Sheet1!A5:M6'"""
+    rows = [int(n) for n in re.findall(r"[A-Z]+(\d+)", updated_range.split("!")[-1])]
+    return rows[0], rows[-1]
+
+
+class SheetIndex:
+    """Persistent per-user map of spreadsheet IDs and next-row cursors, mirrored to GCS when available"""
+
+    def __init__(self, path, gcs=None, bucket_name=None, prefix="bot_user_sheets"):
+        self.path = Path(path)
+        self._gcs = gcs
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except Exception as e:
+                logger.error(f"Could not load sheet index from {self.path}: {e}")
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._entries))
+        os.replace(tmp_path, self.path)
+
+    def _gcs_path(self, user_id):
+        return f"{self._prefix}/{user_id}.json"
+
+    def get(self, user_id):
+        """Return {'spreadsheet_id', 'next_row'} for a user, or None if unknown"""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return dict(entry)
+
+        if self._gcs is None:
+            return None
+        try:
+            _, text = self._gcs.read(self._bucket_name, self._gcs_path(user_id))
+            entry = json.loads(text)
+        except Exception:
+            return None
+        with self._lock:
+            self._entries[key] = entry
+            self._save()
+        return dict(entry)
+
+    def set(self, user_id, spreadsheet_id, next_row):
+        """Record a freshly resolved spreadsheet and mirror it to GCS"""
+        entry = {"spreadsheet_id": spreadsheet_id, "next_row": next_row}
+        with self._lock:
+            self._entries[str(user_id)] = entry
+            self._save()
+        self._mirror(user_id, entry)
+
+    def _mirror(self, user_id, entry):
+        if self._gcs is None:
+            return
+        try:
+            self._gcs.write(self._bucket_name, self._gcs_path(user_id), json.dumps(entry))
+        except Exception as e:
+            logger.error(f"Could not mirror sheet index for user {user_id}: {e}")
+
+    def advance(self, user_id, next_row):
+        """Move a user's row cursor, mirrored to GCS only when it first moves past the header row
+
+        Appends land after the last filled row whatever the cursor says, but a
+        cursor of 1 makes the write add the header, so another replica loading
+        the GCS copy has to see that the header is there.
+        """
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+            if entry is None:
+                return
+            header_written = entry["next_row"] <= 1 < next_row
+            entry["next_row"] = next_row
+            self._save()
+            entry = dict(entry)
+        if header_written:
+            self._mirror(user_id, entry)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self._save()
+        if self._gcs is not None:
+            try:
+                self._gcs.delete(self._bucket_name, self._gcs_path(user_id))
+            except Exception as e:
+                logger.error(f"Could not delete mirrored sheet index for user {user_id}: {e}")
+
+
+class BetRowIndex:
+    """Persistent (user, bet ID) -> sheet row map, so a re-sent slip can update its row in place
+
+    Entries belong to the spreadsheet they were written to. A user's map is
+    filled from the sheet's ID column the first time that spreadsheet is seen
+    and after the sheet is found to have moved rows, and is otherwise only
+    kept up to date from the bot's own writes.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS bet_rows (user_id TEXT NOT NULL, spreadsheet_id TEXT NOT NULL, "
+            "bet_id TEXT NOT NULL, row INTEGER NOT NULL, PRIMARY KEY (user_id, spreadsheet_id, bet_id));"
+            "CREATE TABLE IF NOT EXISTS synced_sheets (user_id TEXT NOT NULL, spreadsheet_id TEXT NOT NULL, "
+            "synced REAL NOT NULL, PRIMARY KEY (user_id, spreadsheet_id));"
+        )
+        self._db.commit()
+
+    def is_synced(self, user_id, spreadsheet_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM synced_sheets WHERE user_id = ? AND spreadsheet_id = ?", (str(user_id), spreadsheet_id)
+            ).fetchone()
+        return row is not None
+
+    def lookup(self, user_id, spreadsheet_id, bet_ids):
+        """Row number of each bet ID that is known to be in the sheet"""
+        bet_ids = list(bet_ids)
+        if not bet_ids:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT bet_id, row FROM bet_rows WHERE user_id = ? AND spreadsheet_id = ? "
+                f"AND bet_id IN ({', '.join('?' for _ in bet_ids)})",
+                [str(user_id), spreadsheet_id] + bet_ids
+            ).fetchall()
+        return dict(rows)
+
+    def store(self, user_id, spreadsheet_id, rows):
+        """Record {bet_id: row} for rows the bot has just written"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO bet_rows (user_id, spreadsheet_id, bet_id, row) VALUES (?, ?, ?, ?)",
+                [(str(user_id), spreadsheet_id, bet_id, row) for bet_id, row in rows.items()]
+            )
+
+    def replace(self, user_id, spreadsheet_id, id_column):
+        """Rebuild a user's map from the sheet's column A values, the first occurrence of an ID wins"""
+        rows = {}
+        for number, cells in enumerate(id_column, 1):
+            bet_id = str(cells[0]).strip() if cells else ""
+            if bet_id and bet_id != "NA" and not (number == 1 and bet_id == "ID"):
+                rows.setdefault(bet_id, number)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM bet_rows WHERE user_id = ?", (str(user_id),))
+            self._db.execute("DELETE FROM synced_sheets WHERE user_id = ?", (str(user_id),))
+            self._db.executemany(
+                "INSERT INTO bet_rows (user_id, spreadsheet_id, bet_id, row) VALUES (?, ?, ?, ?)",
+                [(str(user_id), spreadsheet_id, bet_id, row) for bet_id, row in rows.items()]
+            )
+            self._db.execute(
+                "INSERT INTO synced_sheets (user_id, spreadsheet_id, synced) VALUES (?, ?, ?)",
+                (str(user_id), spreadsheet_id, time.time())
+            )
+        return rows
+
+    def forget(self, user_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM bet_rows WHERE user_id = ?", (str(user_id),))
+            self._db.execute("DELETE FROM synced_sheets WHERE user_id = ?", (str(user_id),))
+
+
+class UserSpreadsheets:
+    """Finds or creates each user's Track_record spreadsheet and writes their rows to it
+
+    Rows of bets the sheet already holds are updated in place and the rest are
+    appended after the last filled row. sheet_index keeps each user's
+    spreadsheet ID and row cursor, bet_rows where each bet ID sits.
+    """
+
+    def __init__(self, sheet_index, bet_rows, lock_count=64):
+        self.sheet_index = sheet_index
+        self.bet_rows = bet_rows
+        # Speculative preparation and the write can both miss the index, the lock keeps them to one new sheet
+        self._resolve_locks = [threading.Lock() for _ in range(lock_count)]
+
+    def resolve_spreadsheet(self, service, service_drive, user_id):
+        """Find or create the user's spreadsheet and work out the next free row"""
+        title = f"Track_record_{user_id}"
+        spreadsheets = service_drive.files().list(
+            q=f"name='{title}'",
+            spaces='drive',
+            fields='files(id, name)'
+        ).execute()
+
+        if spreadsheets.get('files'):
+            spreadsheet_id = spreadsheets['files'][0]['id']
+            # Only column A is needed to count the rows
+            sheet_data = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range="Sheet1!A:A"
+            ).execute()
+            next_row = len(sheet_data.get('values', [])) + 1
+            # Column A is the bet ID, so the same read fills the row index
+            self.bet_rows.replace(user_id, spreadsheet_id, sheet_data.get('values', []))
+        else:
+            spreadsheet = {"properties": {"title": title}}
+            spreadsheet = service.spreadsheets().create(body=spreadsheet, fields="spreadsheetId").execute()
+            spreadsheet_id = spreadsheet.get("spreadsheetId")
+            next_row = 1
+            self.bet_rows.replace(user_id, spreadsheet_id, [])
+
+        self.sheet_index.set(user_id, spreadsheet_id, next_row)
+        logger.info(f'Resolved spreadsheet for user {user_id}, next row {next_row}')
+        return self.sheet_index.get(user_id)
+
+    def ensure_spreadsheet(self, service, creds, user_id):
+        """Return the user's index entry, resolving it under the user's lock if it isn't known yet"""
+        entry = self.sheet_index.get(user_id)
+        if entry is not None:
+            return entry
+        with self._resolve_locks[hash(user_id) % len(self._resolve_locks)]:
+            entry = self.sheet_index.get(user_id)
+            if entry is None:
+                entry = self.resolve_spreadsheet(service, build_service("drive", "v3", creds), user_id)
+        return entry
+
+    def append_rows(self, service, user_id, entry, rows):
+        """Append rows after the last filled row and move the cursor, returning the row of the first one"""
+        with_header = entry['next_row'] <= 1 and not self._has_header(service, entry['spreadsheet_id'])
+        if with_header:
+            rows = [HEADER_VALUES] + rows
+
+        response = service.spreadsheets().values().append(
+            spreadsheetId=entry['spreadsheet_id'],
+            range="Sheet1!A1:M",
+            valueInputOption='RAW',
+            insertDataOption='INSERT_ROWS',
+            body={'values': rows}
+        ).execute()
+
+        first_row, last_row = parse_row_range(response['updates']['updatedRange'])
+        if first_row != entry['next_row']:
+            # The sheet was edited outside the bot, trust where the rows actually landed
+            logger.info(f"Row cursor conflict for user {user_id}: expected {entry['next_row']}, wrote at {first_row}")
+        self.sheet_index.advance(user_id, last_row + 1)
+        return first_row + 1 if with_header else first_row
+
+    @staticmethod
+    def _has_header(service, spreadsheet_id):
+        # A cursor of 1 may be a copy from before another replica's first write, so the sheet has the final say
+        sheet_data = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range="Sheet1!A1"
+        ).execute()
+        return bool(sheet_data.get('values'))
+
+    def sync_bet_rows(self, service, user_id, spreadsheet_id):
+        """Rebuild the user's row index from the sheet's ID column"""
+        with stage_timer("bet_row_sync"):
+            sheet_data = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range="Sheet1!A:A"
+            ).execute()
+        logger.info(f"Re-synced bet row index for user {user_id}")
+        return self.bet_rows.replace(user_id, spreadsheet_id, sheet_data.get('values', []))
+
+    def locate_bets(self, service, user_id, spreadsheet_id, bet_ids):
+        """Rows already holding these bet IDs, checked with one read and re-synced if any has moved"""
+        if not self.bet_rows.is_synced(user_id, spreadsheet_id):
+            known = self.sync_bet_rows(service, user_id, spreadsheet_id)
+            return {bet_id: known[bet_id] for bet_id in bet_ids if bet_id in known}
+
+        known = self.bet_rows.lookup(user_id, spreadsheet_id, bet_ids)
+        if not known:
+            return {}
+        # Rows can be sorted or deleted by hand, so confirm each ID is still where the index says
+        response = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[f"Sheet1!A{row}" for row in known.values()]
+        ).execute()
+        found = [value_range.get('values', [[None]])[0][0] for value_range in response.get('valueRanges', [])]
+        if found == list(known):
+            return known
+        known = self.sync_bet_rows(service, user_id, spreadsheet_id)
+        return {bet_id: known[bet_id] for bet_id in bet_ids if bet_id in known}
+
+    def upsert_rows(self, service, user_id, entry, rows):
+        """Update the rows of bets already in the sheet in place and append the rest"""
+        spreadsheet_id = entry['spreadsheet_id']
+        # Column A is the bet ID; a later version of the same bet in one batch replaces the earlier
+        latest = {}
+        for row in rows:
+            latest[row[0]] = row
+        existing = self.locate_bets(service, user_id, spreadsheet_id, list(latest))
+
+        for bet_id, row_number in existing.items():
+            service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range=f"Sheet1!A{row_number}:M{row_number}",
+                valueInputOption='RAW',
+                body={'values': [latest[bet_id]]}
+            ).execute()
+        if existing:
+            logger.info(f"Updated {len(existing)} bet rows in place for user {user_id}")
+
+        new_rows = [row for bet_id, row in latest.items() if bet_id not in existing]
+        if new_rows:
+            first_row = self.append_rows(service, user_id, entry, new_rows)
+            self.bet_rows.store(
+                user_id, spreadsheet_id, {row[0]: first_row + offset for offset, row in enumerate(new_rows)}
+            )
+
+    def write_rows(self, creds, user_id, rows):
+        """Write rows to the user's sheet, resolving the spreadsheet if needed, and return its link"""
+        service = build_service("sheets", "v4", creds)
+        entry = self.ensure_spreadsheet(service, creds, user_id)
+
+        try:
+            self.upsert_rows(service, user_id, entry, rows)
+        except Exception as error:
+            if not is_http_error(error, 404):
+                raise
+            # Spreadsheet was deleted, resolve it again and retry once
+            logger.info(f"Cached spreadsheet for user {user_id} is gone, re-syncing")
+            self.sheet_index.invalidate(user_id)
+            self.bet_rows.forget(user_id)
+            entry = self.resolve_spreadsheet(service, build_service("drive", "v3", creds), user_id)
+            self.upsert_rows(service, user_id, entry, rows)
+
+        return f"https://docs.google.com/spreadsheets/d/{entry['spreadsheet_id']}"
+
+
+class BatchSheetWriter:
+    """Write-behind buffer that coalesces rows per user into a single sheet append
+
+    A user's rows are flushed once max_rows are pending or the oldest row has
+    waited max_delay seconds. Quota and server errors are retried with
+    exponential backoff or after their Retry-After, rows are held while the
+    sheets circuit is open, and each row's callback gets (result, error) after
+    the flush commits or gives up. The flush is traced under the span that was
+    current when the batch's first row was added.
+    """
+
+    def __init__(self, write_rows, max_rows=10, max_delay=1.0, flush_workers=4,
+                 max_retries=5, base_backoff=1.0, max_backoff=32.0, max_outage=600.0):
+        self._write_rows = write_rows
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.max_outage = max_outage
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._pending = {}
+        self._deadlines = {}
+        self._flushing = set()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=flush_workers, thread_name_prefix="sheet-flush")
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheet-batcher", daemon=True)
+            self._thread.start()
+
+    def add(self, user_id, row, callback):
+        with self._condition:
+            self._pending.setdefault(user_id, []).append((row, callback, tracer.current()))
+            self._deadlines.setdefault(user_id, time.monotonic() + self.max_delay)
+            self._condition.notify()
+
+    def pending_rows(self):
+        with self._condition:
+            return sum(len(batch) for batch in self._pending.values())
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                for user_id in list(self._pending):
+                    if user_id in self._flushing:
+                        continue
+                    if len(self._pending[user_id]) >= self.max_rows or self._deadlines[user_id] <= now:
+                        batch = self._pending.pop(user_id)
+                        del self._deadlines[user_id]
+                        self._flushing.add(user_id)
+                        self._executor.submit(self._flush, user_id, batch)
+
+                waiting = [deadline for user_id, deadline in self._deadlines.items() if user_id not in self._flushing]
+                self._condition.wait(max(0.0, min(waiting) - now) if waiting else None)
+
+    def _flush(self, user_id, batch):
+        rows = [row for row, _, _ in batch]
+        result, error = None, None
+        attempt = 0
+        outage_deadline = time.monotonic() + self.max_outage
+        while True:
+            try:
+                with tracer.activate(batch[0][2]), stage_timer("sheet_flush"):
+                    result = self._write_rows(user_id, rows)
+                error = None
+                break
+            except (CircuitOpenError, RateLimitedError) as e:
+                # Rows stay queued while the upstream is down, up to max_outage
+                error = e
+                if time.monotonic() + e.retry_after > outage_deadline:
+                    break
+                logger.info(f"Sheet write for user {user_id} held for {e.retry_after:.2f} seconds: {e}")
+                time.sleep(retry_delay(e, attempt, self.base_backoff, self.max_backoff))
+            except Exception as e:
+                error = e
+                if not is_retryable_error(e) or attempt == self.max_retries:
+                    break
+                delay = retry_delay(e, attempt, self.base_backoff, self.max_backoff)
+                logger.info(f"Sheet write for user {user_id} throttled, retrying in {delay:.2f} seconds: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+        with self._condition:
+            self._flushing.discard(user_id)
+            self._condition.notify()
+
+        for _, callback, _ in batch:
+            try:
+                callback(result, error)
+            except Exception as callback_error:
+                logger.error(f"Sheet write callback failed for user {user_id}: {callback_error}")
+
+    def flush_all(self):
+        """Make every pending batch due immediately"""
+        with self._condition:
+            for user_id in self._deadlines:
+                self._deadlines[user_id] = 0
+            self._condition.notify()
+
+    def stop(self):
+        self.flush_all()
+        with self._condition:
+            while self._pending or self._flushing:
+                self._condition.wait(0.1)
+            self._stopped = True
+            self._condition.notify()
+        self._executor.shutdown(wait=True)
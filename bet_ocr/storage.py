@@ -0,0 +1,230 @@
+"""Google Cloud Storage access and the per-user credential cache"""
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class GCSStorage:
+    """Process-wide Google Cloud Storage layer with a pooled HTTP session and per-operation stats"""
+
+    def __init__(self, pool_size=10, guard=None):
+        self.pool_size = pool_size
+        self._guard = guard
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def client(self):
+        """Lazily build the shared storage client on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
+        # The storage SDK pulls in most of google-cloud, so it is only imported once a blob is needed
+        import google.auth
+        import requests
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size
+        )
+        session.mount("https://", adapter)
+        return storage.Client(project=project, credentials=credentials, _http=session)
+
+    def _blob(self, bucket_name, object_name):
+        return self.client.bucket(bucket_name).blob(object_name)
+
+    def _call(self, func, *args, **kwargs):
+        if self._guard is None:
+            return func(*args, **kwargs)
+        return self._guard.call(func, *args, **kwargs)
+
+    def _record(self, operation, elapsed, num_bytes=0):
+        with self._stats_lock:
+            stat = self._stats.setdefault(
+                operation, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0}
+            )
+            stat["calls"] += 1
+            stat["seconds"] += elapsed
+            stat["max_seconds"] = max(stat["max_seconds"], elapsed)
+            stat["bytes"] += num_bytes
+
+    def read(self, bucket_name, object_name):
+        """Download a blob once and return both its bytes and decoded text"""
+        start_time = time.perf_counter()
+        data = self._call(self._blob(bucket_name, object_name).download_as_bytes)
+        self._record("read", time.perf_counter() - start_time, len(data))
+        return data, data.decode("utf-8")
+
+    def write(self, bucket_name, object_name, data):
+        """Upload string or bytes data to a blob"""
+        start_time = time.perf_counter()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._call(self._blob(bucket_name, object_name).upload_from_string, data)
+        self._record("write", time.perf_counter() - start_time, len(data))
+
+    def exists(self, bucket_name, object_name):
+        start_time = time.perf_counter()
+        result = self._call(self._blob(bucket_name, object_name).exists)
+        self._record("exists", time.perf_counter() - start_time)
+        return result
+
+    def updated(self, bucket_name, object_name):
+        """Unix time a blob was last written, None if it does not exist"""
+        start_time = time.perf_counter()
+        blob = self._call(self.client.bucket(bucket_name).get_blob, object_name)
+        self._record("metadata", time.perf_counter() - start_time)
+        return blob.updated.timestamp() if blob is not None and blob.updated is not None else None
+
+    def delete(self, bucket_name, object_name):
+        """Delete a blob, returning False if it did not exist"""
+        from google.api_core.exceptions import NotFound
+
+        start_time = time.perf_counter()
+        try:
+            self._call(self._blob(bucket_name, object_name).delete)
+            return True
+        except NotFound:
+            return False
+        finally:
+            self._record("delete", time.perf_counter() - start_time)
+
+    def _list_page(self, bucket_name, prefix, page_size, page_token):
+        # A fresh iterator per page, so a retried call resumes from the same token
+        iterator = self.client.list_blobs(bucket_name, prefix=prefix, page_size=page_size, page_token=page_token)
+        page = next(iterator.pages, None)
+        return [blob.name for blob in page] if page is not None else [], iterator.next_page_token
+
+    def list_pages(self, bucket_name, prefix, page_size=1000):
+        """Yield the blob names under a prefix, one list per API page"""
+        page_token = None
+        while True:
+            start_time = time.perf_counter()
+            names, page_token = self._call(self._list_page, bucket_name, prefix, page_size, page_token)
+            self._record("list", time.perf_counter() - start_time)
+            if names:
+                yield names
+            if not page_token:
+                return
+
+    def stats(self):
+        """Return a snapshot of call counts, latency and byte counters per operation"""
+        with self._stats_lock:
+            return {operation: dict(stat) for operation, stat in self._stats.items()}
+
+
+class CredentialCache:
+    """LRU cache of per-user Google credentials with TTL expiry and a background refresher"""
+
+    def __init__(self, loader, refresher, max_size=1000, ttl=3600, refresh_margin=300, refresh_interval=60):
+        self._loader = loader
+        self._refresher = refresher
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh_entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return self._fresh_entry(user_id) is not None
+
+    def get(self, user_id):
+        """Return cached credentials for a user, loading them on a miss"""
+        with self._lock:
+            entry = self._fresh_entry(user_id)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        creds = self._loader(user_id)
+        if creds is not None and creds.valid:
+            self.put(user_id, creds)
+        return creds
+
+    def put(self, user_id, creds):
+        with self._lock:
+            self._entries[user_id] = (creds, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _needs_refresh(self, creds):
+        if not creds.refresh_token:
+            return False
+        if creds.expiry is None:
+            return not creds.valid
+        remaining = creds.expiry - datetime.datetime.utcnow()
+        return remaining.total_seconds() < self.refresh_margin
+
+    def refresh_expiring(self):
+        """Refresh cached credentials that are close to expiry, dropping the ones that fail"""
+        with self._lock:
+            candidates = [(user_id, entry[0]) for user_id, entry in self._entries.items()]
+
+        refreshed = 0
+        for user_id, creds in candidates:
+            if not self._needs_refresh(creds):
+                continue
+            new_creds = self._refresher(user_id, creds)
+            if new_creds is None:
+                self.invalidate(user_id)
+            else:
+                self.put(user_id, new_creds)
+                refreshed += 1
+        return refreshed
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                refreshed = self.refresh_expiring()
+                if refreshed:
+                    logger.info(f'Background refresher renewed {refreshed} cached tokens')
+            except Exception as e:
+                logger.error(f"Background token refresh failed: {e}")
+
+    def start_refresher(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+            self._thread.start()
+
+    def stop_refresher(self):
+        self._stop_event.set()
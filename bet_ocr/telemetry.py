@@ -0,0 +1,376 @@
+"""Prometheus-style metrics, per-slip tracing and the logging setup shared by every module"""
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Span of the slip being processed in this thread or task, see Tracer
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class TraceIdFilter(logging.Filter):
+    """Stamp log records with the trace ID of the current slip, '-' outside one"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        record.trace_id = span.trace.trace_id if span is not None else "-"
+        return True
+
+
+def configure_logging(log_path='bot_timing.log', level=logging.INFO):
+    """Log to a file and the console with trace IDs, called by the entry point rather than on import"""
+    handlers = [logging.FileHandler(log_path), logging.StreamHandler()]
+    for handler in handlers:
+        handler.addFilter(TraceIdFilter())
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(trace_id)s - %(message)s',
+        handlers=handlers
+    )
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, help_text, kind, label_names):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _SampleMetric(_Metric):
+    """Counter or gauge, either updated in place or read at scrape time from a callback
+
+    A callback returns {label value tuple: value}, which lets existing stats()
+    methods be exported without changing the classes that keep them.
+    """
+
+    def __init__(self, name, help_text, kind, label_names=(), callback=None):
+        super().__init__(name, help_text, kind, label_names)
+        self.callback = callback
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"Metric callback for {self.name} failed: {e}")
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(_SampleMetric):
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        super().__init__(name, help_text, "counter", label_names, callback)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_SampleMetric):
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        super().__init__(name, help_text, "gauge", label_names, callback)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, "histogram", label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(state[0]), state[1], state[2]) for key, state in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            # Callback metrics are rebound, e.g. when TOCR() builds a fresh pipeline
+            if existing is not None and getattr(metric, "callback", None) is None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=(), callback=None):
+        return self._register(Counter(name, help_text, label_names, callback))
+
+    def gauge(self, name, help_text, label_names=(), callback=None):
+        return self._register(Gauge(name, help_text, label_names, callback))
+
+    def histogram(self, name, help_text, label_names=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+FUNCTION_SECONDS = metrics.histogram("bot_function_seconds", "Wall time of functions wrapped by timing_decorator", ("function",))
+STAGE_SECONDS = metrics.histogram("bot_stage_seconds", "Latency of slip processing stages", ("stage",))
+ERRORS = metrics.counter("bot_errors_total", "Errors by stage and exception type", ("stage", "type"))
+SLIPS = metrics.counter("bot_slips_total", "Slips finished, by outcome", ("outcome",))
+
+
+def count_error(stage, error):
+    ERRORS.inc(stage=stage, type=type(error).__name__)
+
+
+class Span:
+    """One timed step of a slip, ended exactly once"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "duration", "attributes", "error")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {str(error)[:200]}"
+        self.trace.add(self)
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset_ms": round((self.start - self.trace.start) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Span tree of one slip, collected from whichever threads and tasks worked on it"""
+
+    def __init__(self, name, attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = Span(self, name, attributes=attributes)
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self, status):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.root.duration * 1000, 3),
+            "status": status,
+            "attributes": self.root.attributes,
+            "spans": [span.to_dict() for span in spans],
+        }
+
+
+class Tracer:
+    """Per-slip span trees carried in a context variable
+
+    start_trace() opens a root span, span() opens a child of the current span and
+    activate() makes a span current in another worker thread or task. Everything
+    is a no-op outside a trace, and finish() appends the whole tree to a JSONL file.
+    """
+
+    def __init__(self, path=None, sample_rate=1.0):
+        self._lock = threading.Lock()
+        self._file = None
+        self.exported = 0
+        self.configure(path, sample_rate)
+
+    def configure(self, path, sample_rate=1.0):
+        """Set the export file, an empty path turns tracing off"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path or None
+            self.sample_rate = sample_rate
+
+    @staticmethod
+    def current():
+        return _current_span.get()
+
+    def start_trace(self, name, **attributes):
+        """Open a root span, or return None when tracing is off or the slip is not sampled"""
+        if self.path is None or random.random() >= self.sample_rate:
+            return None
+        return Trace(name, attributes).root
+
+    def start_span(self, name, parent, **attributes):
+        """Open a child of parent that the caller ends itself, None when parent is None"""
+        if parent is None:
+            return None
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    @contextmanager
+    def activate(self, span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time a block as a child of the current span"""
+        span = self.start_span(name, _current_span.get(), **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def finish(self, root, status="ok", error=None):
+        """End a slip's root span and export its tree"""
+        if root is None or root.duration is not None:
+            return
+        root.end(error)
+        line = json.dumps(root.trace.to_dict(status), ensure_ascii=False)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+                self.exported += 1
+            except OSError as e:
+                logger.error(f"Could not export trace {root.trace.trace_id}: {e}")
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def stage_timer(stage):
+    """Observe a block's latency in bot_stage_seconds, count its exceptions and trace it as a span"""
+    start_time = time.perf_counter()
+    try:
+        with tracer.span(stage):
+            yield
+    except Exception as e:
+        count_error(stage, e)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage=stage)
+
+
+def timing_decorator(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            with tracer.span(func.__name__):
+                return func(*args, **kwargs)
+        except Exception as e:
+            count_error(func.__name__, e)
+            raise
+        finally:
+            execution_time = time.perf_counter() - start_time
+            FUNCTION_SECONDS.observe(execution_time, function=func.__name__)
+            logger.debug(f'{func.__name__} took {execution_time:.4f} seconds to execute')
+    return wrapper
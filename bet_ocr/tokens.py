@@ -0,0 +1,175 @@
+"""Scheduled health check of every stored user token and the index of users whose tokens were revoked"""
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .telemetry import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+class TokenHealthIndex:
+    """Users whose Google token was revoked and when, kept in memory over SQLite so the check on every slip is free"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS revoked_users (user_id TEXT PRIMARY KEY, revoked REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._revoked = dict(self._db.execute("SELECT user_id, revoked FROM revoked_users"))
+
+    def is_revoked(self, user_id):
+        return str(user_id) in self._revoked
+
+    def revoked_at(self, user_id):
+        """Unix time the user was marked, None if they aren't"""
+        return self._revoked.get(str(user_id))
+
+    def mark_revoked(self, user_id):
+        now = time.time()
+        with self._lock, self._db:
+            self._revoked[str(user_id)] = now
+            self._db.execute(
+                "INSERT OR REPLACE INTO revoked_users (user_id, revoked) VALUES (?, ?)", (str(user_id), now)
+            )
+
+    def clear(self, user_id):
+        """Forget a revocation once the user has connected their account again"""
+        if str(user_id) not in self._revoked:
+            return
+        with self._lock, self._db:
+            self._revoked.pop(str(user_id), None)
+            self._db.execute("DELETE FROM revoked_users WHERE user_id = ?", (str(user_id),))
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+def check_token_health(user_id, storage, bucket_name, index, refresh, revoke, cache=None, refresh_margin=1800):
+    """Refresh one stored token if it expires within refresh_margin seconds, for the scheduled token scan
+
+    refresh(user_id, creds) returns the refreshed credentials or None, and
+    marks the user in index itself when Google rejects the grant; revoke(user_id)
+    marks a user whose token can't be refreshed. A usable token clears the
+    user's mark. A refreshed token replaces one already in cache, but idle
+    users are not added to it.
+    """
+    from google.oauth2.credentials import Credentials
+
+    with stage_timer("token_download"):
+        _, text = storage.read(bucket_name, f"bot_user_tokens/{user_id}/token.json")
+    creds = Credentials.from_authorized_user_info(json.loads(text))
+    if not creds.refresh_token:
+        if creds.valid:
+            index.clear(user_id)
+            return "ok"
+        revoke(user_id)
+        return "revoked"
+    if creds.expiry is not None and (creds.expiry - datetime.datetime.utcnow()).total_seconds() > refresh_margin:
+        index.clear(user_id)
+        return "ok"
+
+    creds = refresh(user_id, creds)
+    if creds is None:
+        # refresh already marked an invalid grant, anything else is retried next scan
+        if index.is_revoked(user_id):
+            return "revoked"
+        raise RuntimeError("token refresh failed")
+    index.clear(user_id)
+    if cache is not None and user_id in cache:
+        cache.put(user_id, creds)
+    return "refreshed"
+
+
+class TokenHealthScanner:
+    """Pages through every stored token and checks each one on a bounded pool, on an APScheduler interval
+
+    check(user_id) refreshes the token if it needs it and returns 'ok',
+    'refreshed' or 'revoked'; anything it raises is counted as an error and
+    retried on the next scan. Only one scan runs at a time, a scan that is
+    due while another is still running is skipped.
+    """
+
+    RESULTS = ("ok", "refreshed", "revoked", "errors")
+
+    def __init__(self, storage, bucket_name, check, prefix="bot_user_tokens/", workers=8, page_size=500, interval=900):
+        self._storage = storage
+        self._bucket_name = bucket_name
+        self._check = check
+        self.prefix = prefix
+        self.workers = workers
+        self.page_size = page_size
+        self.interval = interval
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(("scanned",) + self.RESULTS, 0)
+        self.last_report = None
+
+    def _user_id(self, name):
+        # bot_user_tokens/<user_id>/token.json
+        parts = name[len(self.prefix):].split("/")
+        if len(parts) != 2 or parts[1] != "token.json" or not parts[0].isdigit():
+            return None
+        return int(parts[0])
+
+    def _check_user(self, user_id):
+        try:
+            return self._check(user_id)
+        except Exception as e:
+            logger.error(f"Token health check failed for user {user_id}: {e}")
+            return "errors"
+
+    def scan(self):
+        """Check every stored token once and return the counts, which are also logged"""
+        if not self._lock.acquire(blocking=False):
+            logger.info("Token scan still running, skipping this one")
+            return None
+        try:
+            start = time.perf_counter()
+            report = dict.fromkeys(("scanned",) + self.RESULTS, 0)
+            with stage_timer("token_scan"), ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="token-scan"
+            ) as executor:
+                for names in self._storage.list_pages(self._bucket_name, self.prefix, self.page_size):
+                    user_ids = [user_id for user_id in map(self._user_id, names) if user_id is not None]
+                    # One page at a time keeps memory flat however many users there are
+                    for result in executor.map(self._check_user, user_ids):
+                        report[result if result in self.RESULTS else "ok"] += 1
+                    report["scanned"] += len(user_ids)
+            report["seconds"] = round(time.perf_counter() - start, 3)
+            for key in self.totals:
+                self.totals[key] += report[key]
+            self.last_report = report
+            logger.info(
+                f"Token scan: {report['scanned']} scanned, {report['refreshed']} refreshed, "
+                f"{report['revoked']} revoked, {report['errors']} errors in {report['seconds']:.1f} s"
+            )
+            return report
+        finally:
+            self._lock.release()
+
+    def start(self, first_run_delay=60):
+        """Scan every `interval` seconds in the background, the first time after first_run_delay"""
+        if self._scheduler is not None:
+            return
+        import pytz
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        # APScheduler 3.6 only takes pytz zones and tzlocal 3+ no longer returns one, so it is set explicitly
+        self._scheduler = BackgroundScheduler(daemon=True, timezone=pytz.utc)
+        self._scheduler.add_job(
+            self.scan, "interval", seconds=self.interval, id="token-health-scan", max_instances=1, coalesce=True,
+            next_run_time=datetime.datetime.now(pytz.utc) + datetime.timedelta(seconds=first_run_delay)
+        )
+        self._scheduler.start()
+
+    def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
@@ -0,0 +1,131 @@
+"""Embedded HTTP server for Telegram webhooks, the OAuth callback and metrics"""
+import hmac
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class _WebhookHTTPServer(ThreadingHTTPServer):
+    # Telegram and load balancers open many connections at once, the default backlog is 5
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class WebhookServer:
+    """Embedded HTTP server for Telegram webhook updates and plain GET routes such as the OAuth callback
+
+    With webhook_path None it only serves the GET routes, which is how the
+    polling bot exposes /metrics. POSTs to webhook_path must carry the secret
+    token header. They are
+    acknowledged at once and processed on a bounded worker pool, and a full
+    pool answers 503 so Telegram retries later, possibly on another replica.
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, host, port, webhook_path, secret_token, on_update, routes=None, workers=8, max_pending=1000):
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self._on_update = on_update
+        self.routes = dict(routes or {})
+        self.routes.setdefault("/healthz", lambda query: (200, "text/plain", "ok", {}))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self.counters = {"accepted": 0, "rejected": 0, "forbidden": 0, "bad_request": 0}
+        self._counters_lock = threading.Lock()
+        self._server = _WebhookHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, content_type="text/plain", body="", headers=None):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                status = server.accept_update(
+                    urlsplit(self.path).path,
+                    self.headers.get(server.SECRET_HEADER, ""),
+                    self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                )
+                self._reply(status)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                route = server.routes.get(url.path)
+                if route is None:
+                    self._reply(404, body="not found")
+                    return
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    self._reply(*route(query))
+                except Exception as e:
+                    logger.error(f"Error serving {url.path}: {e}")
+                    self._reply(500, body="internal error")
+
+        return Handler
+
+    def accept_update(self, path, secret_token, body):
+        """Verify and queue one update, returning the HTTP status to answer with"""
+        if self.webhook_path is None or path != self.webhook_path:
+            return 404
+        if not hmac.compare_digest(secret_token.encode("utf-8"), self.secret_token.encode("utf-8")):
+            self._count("forbidden")
+            return 403
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self._count("bad_request")
+            return 400
+        if not self._pending.acquire(blocking=False):
+            self._count("rejected")
+            return 503
+        self._count("accepted")
+        self._executor.submit(self._process, data)
+        return 200
+
+    def _process(self, data):
+        try:
+            self._on_update(data)
+        except Exception as e:
+            logger.error(f"Error processing update {data.get('update_id')}: {e}")
+        finally:
+            self._pending.release()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="webhook-server", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self.counters)